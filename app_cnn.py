@@ -1,14 +1,27 @@
 import os
+import uuid
 import cv2
+import atexit # Vaciar la escritura diferida al cerrar la app
 import time
+import threading
 import numpy as np
-from flask import Flask, render_template, request, url_for, send_from_directory
+from datetime import datetime, timedelta
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Flask, render_template, request, url_for, send_from_directory, jsonify
 from werkzeug.utils import secure_filename
-from datetime import datetime
 # Importar Módulos de IA y Base de Datos
 from src.core.cnn_inspector import CnnInspectionAgent
-from src.core.database import DatabaseConnection
+from src.core.database import DatabaseConnection, to_local_naive
 from src.core.models import InspectionReportDTO
+from src.core.batching import MicroBatcher, InferenceQueueFull
+from src.core.persistence_queue import WriteBehindQueue
+from src.core.image_writer import ResultImageWriter
+from src.core.batch_runner import BatchInspectionRunner, BatchJournal, BatchJob, make_batcher_infer
+from src.core.result_cache import ResultCache
+from src.core.results_store import ThumbnailCache, RetentionSweeper, dated_subdir
+from src.core.inference_server import RemoteBackend, parse_address
+from src.core.services import ServiceContainer
+from src.core import config, metrics
 
 # Configuración de Flask
 app = Flask(__name__, 
@@ -18,6 +31,10 @@ app = Flask(__name__,
 PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, 'static', 'uploads')
 RESULTS_FOLDER = os.path.join(PROJECT_ROOT, 'static', 'results')
+DATA_FOLDER = os.path.join(PROJECT_ROOT, 'data')
+BATCH_JOBS_FOLDER = os.path.join(DATA_FOLDER, 'batch_jobs')
+STATIC_FOLDER = os.path.join(PROJECT_ROOT, 'static')
+THUMBS_FOLDER = os.path.join(DATA_FOLDER, 'thumbs')
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['RESULTS_FOLDER'] = RESULTS_FOLDER
@@ -30,20 +47,134 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Inicialización de Servicios Singleton
+# Inicialización de Servicios
 
-# 1. Cargar el "cerebro" de IA (modelo best.pt) una sola vez
-# El modelo se carga automáticamente dentro del constructor (__init__)
-agent = CnnInspectionAgent() 
+# Con serve.py hay varios procesos web: el worker 0 (o el único proceso) es el principal
+PRIMARY_WORKER = config.WORKER_ID in ('', '0')
+# Segundos entre intentos de preparar la base de datos si no respondía al arrancar
+DB_RETRY_S = 5.0
 
-# 2. Conectarse a la Base de Datos y preparar la tabla
-db_conn = DatabaseConnection()
-db_conn.initialize() # Crea la tabla 'inspections' si no existe
+# El modelo y la base de datos no se cargan al importar: cada servicio se crea la
+# primera vez que se pide, y el hilo de arranque (warm_up, al final) los crea y
+# precalienta en segundo plano. La ruta /ready dice cuándo está todo listo
+services = ServiceContainer()
+
+def create_remote_backend():
+    """Con serve.py el modelo ya está cargado en el proceso de inferencia compartido"""
+    return RemoteBackend(parse_address(config.INFERENCE_SERVER), config.INFERENCE_AUTHKEY.encode(),
+                         timeout=config.INFERENCE_TIMEOUT_S)
+
+def create_agent():
+    """
+    1. El "cerebro" de IA (modelo best.pt), cargado una sola vez en el constructor
+    (con serve.py este worker solo envía los frames; ROI, teselas y dibujo se hacen aquí)
+    """
+    return CnnInspectionAgent(model_path=config.MODEL_PATH,
+                              max_batch_size=config.MAX_BATCH_SIZE,
+                              max_wait_ms=config.MAX_WAIT_MS,
+                              backend=services.remote_backend if config.INFERENCE_SERVER else config.INFERENCE_BACKEND,
+                              intra_op_threads=config.INTRA_OP_THREADS,
+                              providers=config.ONNX_PROVIDERS,
+                              renderer=config.RENDERER,
+                              imgsz=config.INFERENCE_IMGSZ,
+                              roi=config.INFERENCE_ROI,
+                              tile_size=config.TILE_SIZE,
+                              tile_overlap=config.TILE_OVERLAP)
+
+def create_inference():
+    """
+    2. Servidor de inferencia: un único hilo es dueño del modelo y agrupa
+    en lotes las peticiones concurrentes (cola acotada = backpressure).
+    Con el proceso de inferencia compartido no se espera a completar lotes: allí se juntan los de todos los workers
+
+    Antes de aceptar frames se precalienta el modelo al tamaño configurado:
+    la primera petición real no paga la inicialización del backend
+    """
+    agent = services.agent
+    if agent.model is not None:
+        print(f"Modelo precalentado en {agent.warmup():.2f} s")
+    inference = MicroBatcher(agent, max_wait_ms=0 if config.INFERENCE_SERVER else None,
+                             max_queue_size=config.INFERENCE_QUEUE_SIZE)
+    inference.start()
+    return inference
+
+def create_database():
+    """3. Conectarse a la Base de Datos y preparar la tabla (crea 'inspections' si no existe)"""
+    db_conn = DatabaseConnection()
+    db_conn.initialize()
+    return db_conn
+
+def create_persistence():
+    """
+    4. Escritura diferida: las peticiones solo encolan el reporte; un hilo
+    lo guarda por lotes y, si MySQL no responde, lo deja en disco para reenviarlo
+    (cada worker secundario con su propio archivo: dos procesos no reenvían el mismo)
+    """
+    spill_name = 'pending_inspections.jsonl' if PRIMARY_WORKER else f"pending_inspections.w{config.WORKER_ID}.jsonl"
+    persistence = WriteBehindQueue(services.db,
+                                   spill_path=os.path.join(DATA_FOLDER, spill_name),
+                                   batch_size=config.DB_BATCH_SIZE,
+                                   flush_interval=config.DB_FLUSH_INTERVAL_S)
+    persistence.start()
+    return persistence
+
+if config.INFERENCE_SERVER:
+    services.register('remote_backend', create_remote_backend, close=RemoteBackend.close)
+services.register('agent', create_agent, ready=lambda agent: agent.model is not None)
+services.register('inference', create_inference, close=MicroBatcher.stop)
+services.register('db', create_database, ready=lambda db_conn: db_conn.initialized)
+services.register('persistence', create_persistence, close=WriteBehindQueue.close)
+
+# 5. Escritura de imágenes de resultado en un pool de hilos
+image_writer = ResultImageWriter(max_workers=config.RESULT_WRITER_THREADS,
+                                 jpeg_quality=config.RESULT_JPEG_QUALITY)
+
+# 6. Caché de resultados por contenido: una imagen ya inspeccionada no se vuelve a procesar
+# (las entradas de otros modelos se borran al arrancar, ver warm_up)
+result_cache = ResultCache(max_entries=config.RESULT_CACHE_SIZE, disk_dir=config.RESULT_CACHE_DIR or None)
+
+# 7. Ciclo de vida de static/results: miniaturas bajo demanda y retención por edad y espacio
+# (las imágenes borradas quedan sin referencia en la base de datos)
+thumbnails = ThumbnailCache(STATIC_FOLDER, THUMBS_FOLDER, max_width=config.THUMBNAIL_WIDTH)
+retention = RetentionSweeper(RESULTS_FOLDER, STATIC_FOLDER,
+                             max_age_days=config.RESULTS_MAX_AGE_DAYS,
+                             max_bytes=int(config.RESULTS_MAX_GB * 1e9),
+                             interval_s=config.RESULTS_SWEEP_INTERVAL_S,
+                             thumbnails=thumbnails,
+                             on_evicted=lambda paths: services.db.clear_result_images(paths))
+if PRIMARY_WORKER:
+    retention.start() # Un solo barrido aunque haya varios workers
+
+# 8. Métricas: ruta /metrics, duración de cada petición y colas leídas al momento del scrape
+# (sin crear servicios: mientras no existen, sus colas están vacías)
+metrics.install_flask(app)
+metrics.gauge('visionpharma_inference_queue_depth', "Frames esperando en la cola de inferencia").set_function(
+    lambda: services.inference.queue_depth() if services.created('inference') else 0)
+metrics.gauge('visionpharma_persistence_pending', "Reportes esperando ser guardados en la base de datos").set_function(
+    lambda: services.persistence.stats()['pending'] if services.created('persistence') else 0)
+metrics.gauge('visionpharma_result_images_pending', "Imágenes de resultado aún no escritas en disco").set_function(image_writer.pending)
+
+# 9. Arranque en segundo plano: modelo (precalentado), base de datos y escritura diferida
+shutting_down = threading.Event()
+
+def warm_up():
+    agent = services.agent
+    if agent.model is not None:
+        result_cache.clear_stale(agent.fingerprint)
+    services.inference
+    db_conn = services.db
+    services.persistence
+    # Si la base de datos no respondía, reintentar hasta que responda (los reportes se guardan en disco mientras tanto)
+    while not db_conn.initialized and not shutting_down.wait(DB_RETRY_S):
+        db_conn.initialize()
+
+services.start(warm_up)
 
 # Ruta Principal de la App
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
     step_image_urls = None
+    step_thumb_urls = None
     results_data = None
     
     if request.method == 'POST':
@@ -53,83 +184,310 @@ def upload_file():
         if file.filename == '' or not allowed_file(file.filename):
              return render_template('upload.html', error="Formato de archivo no permitido")
         
-        # Generar nombre seguro y único
-        filename_base = secure_filename(file.filename)
+        # 1. Leer el archivo y buscarlo en la caché (misma imagen + mismo modelo = mismo resultado)
+        file_data = file.read()
+        agent = services.agent
+        fingerprint = agent.fingerprint
+        cache_key = result_cache.content_key(file_data) if result_cache.enabled else None
+        cached = result_cache.get(fingerprint, cache_key) if cache_key else None
+
+        # Marca de tiempo única para los nombres de las imágenes de resultado (en la carpeta del día)
         timestamp = int(time.time() * 1000)
-        filename = f"input_{timestamp}_{filename_base}"
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        file.save(input_path)
+        day_folder = dated_subdir()
 
-        # 1. Leer la imagen con OpenCV (para procesamiento)
-        original_frame = cv2.imread(input_path)
+        if cached is not None and all(image_writer.exists(os.path.join(STATIC_FOLDER, path))
+                                      for path in cached.images.values()):
+            # Acierto: sin decodificar, inferir ni dibujar. Las imágenes se enlazan (o copian) en la
+            # carpeta del día: cada reporte tiene las suyas y la retención no borra las de otro
+            saved_images = {}
+            with metrics.span('upload_save_images'):
+                for step_name, cached_path in cached.images.items():
+                    relative_path = f"results/{day_folder}/{step_name}_{timestamp}.jpg"
+                    image_writer.submit_copy(os.path.join(STATIC_FOLDER, cached_path),
+                                             os.path.join(STATIC_FOLDER, relative_path))
+                    saved_images[step_name] = relative_path
+            results_list = cached.results
+            final_image_path_for_db = saved_images.get('final_contours')
+            # La caché apunta a las copias más nuevas (las últimas que borrará la retención)
+            result_cache.put(fingerprint, cache_key, cached.detections, results_list, saved_images)
+        else:
+            # Decodificar la imagen directamente desde la petición (sin pasar por disco)
+            with metrics.span('upload_decode'):
+                file_bytes = np.frombuffer(file_data, dtype=np.uint8)
+                original_frame = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR) if file_bytes.size else None
+            if original_frame is None:
+                return render_template('upload.html', error="No se pudo leer la imagen")
 
-        if original_frame is not None:
             # 2. Ejecutar el Pipeline de Visión IA
+            # (si la imagen está en caché pero sus archivos ya no existen, solo se vuelve a dibujar)
+            if cached is not None:
+                detections = cached.detections
+            else:
+                try:
+                    with metrics.span('upload_inference'):
+                        detections = services.inference.detect(original_frame, timeout=config.INFERENCE_TIMEOUT_S)
+                except (InferenceQueueFull, FutureTimeoutError, ConnectionError):
+                    # Servidor de inferencia saturado (o el proceso compartido caído): responder 503 en lugar de encolar sin límite
+                    return render_template('upload.html', error="El servidor de inferencia está ocupado, intente de nuevo en unos segundos"), 503
+
             # 'results_list' contiene los datos ('Pastilla', 'Vacio')
             # 'step_images' contiene las imágenes del pipeline para mostrar
-            _, step_images, results_list = agent.process_frame_step_by_step(original_frame)
-            
-            # 3. Guardar las imágenes de resultado y generar URLs
-            step_image_urls = {}
+            with metrics.span('upload_render'):
+                _, step_images, results_list = agent.build_outputs(original_frame, detections, outputs='debug')
+
+            # 3. Guardar las imágenes de resultado (en la carpeta del día)
+            saved_images = {}
             final_image_path_for_db = None
-            
-            for step_name, img_data in step_images.items():
-                if img_data.ndim == 2:
-                    img_data = cv2.cvtColor(img_data, cv2.COLOR_GRAY2BGR)
-
-                output_filename = f"{step_name}_{timestamp}.jpg"
-                output_path = os.path.join(app.config['RESULTS_FOLDER'], output_filename)
-                
-                # Guardar la imagen en el disco
-                cv2.imwrite(output_path, img_data)
-                
-                # Generar la URL estática para el HTML
-                relative_path = f'results/{output_filename}'
-                step_image_urls[step_name] = url_for('serve_static', filename=relative_path)
-                
-                # Guardar la ruta de la imagen final para la base de datos
-                if step_name == 'final_contours':
-                    final_image_path_for_db = relative_path
-
-            results_data = results_list
-            
-            # 4. Reporte y Persistencia (Base de Datos)
-            try:
-                # Contar los resultados de la IA
-                total_pastillas = sum(1 for r in results_list if r['status'] == 'Pastilla')
-                total_vacios = sum(1 for r in results_list if r['status'] == 'Vacio')
-                
-                # Determinar el estado final
-                estado_final = "Aprobado"
-                if total_vacios > 0:
-                    estado_final = "Defectuoso"
-                # (Se podría añadir lógica para 'Deforme' u otro estado si el modelo lo soporta)
-
-                # Crear el DTO
-                reporte_dto = InspectionReportDTO(
-                    timestamp=datetime.now(),
-                    total_pastillas=total_pastillas,
-                    total_vacios=total_vacios,
-                    estado_final=estado_final,
-                    imagen_resultado=final_image_path_for_db
-                )
-                
-                # Guardar el DTO en la base de datos
-                db_conn.save_inspection(reporte_dto)
-
-            except Exception as e:
-                print(f"Error al guardar en la base de datos: {e}")
-            
-            # 5. Limpieza de archivo subido
-            os.remove(input_path)
-
-    return render_template('upload.html', step_image_urls=step_image_urls, results_data=results_data)
+
+            with metrics.span('upload_save_images'):
+                for step_name, img_data in step_images.items():
+                    # (las imágenes en gris se guardan como JPEG de un canal, sin convertir a BGR)
+                    relative_path = f"results/{day_folder}/{step_name}_{timestamp}.jpg"
+                    output_path = os.path.join(STATIC_FOLDER, relative_path)
+
+                    # Codificar y guardar en segundo plano (la URL se devuelve sin esperar)
+                    image_writer.submit(output_path, img_data)
+                    saved_images[step_name] = relative_path
+
+                    # Guardar la ruta de la imagen final para la base de datos
+                    if step_name == 'final_contours':
+                        final_image_path_for_db = relative_path
+
+            if cache_key and agent.model is not None:
+                result_cache.put(fingerprint, cache_key, detections, results_list, saved_images)
+
+        # URLs de las imágenes completas y de sus miniaturas para el HTML
+        step_image_urls = {step_name: url_for('serve_static', filename=path) for step_name, path in saved_images.items()}
+        step_thumb_urls = {step_name: url_for('serve_thumbnail', filename=path) for step_name, path in saved_images.items()}
+        results_data = results_list
+
+        # 4. Reporte y Persistencia (Base de Datos)
+        try:
+            # Contar los resultados de la IA y determinar el estado final
+            reporte_dto = InspectionReportDTO.from_results(results_list, imagen_resultado=final_image_path_for_db)
+
+            # Encolar el DTO para la base de datos (sin esperar a MySQL)
+            with metrics.span('upload_persist'):
+                services.persistence.enqueue(reporte_dto)
+
+        except Exception as e:
+            print(f"Error al guardar en la base de datos: {e}")
+
+    return render_template('upload.html', step_image_urls=step_image_urls, step_thumb_urls=step_thumb_urls,
+                           results_data=results_data)
+
+# Inspección por lotes (varias imágenes o un .zip)
+batch_jobs = {} # job_id -> BatchJob
+
+def start_batch_job(job_id, source_path):
+    """Crea y lanza el lote; su diario queda en data/batch_jobs/<job_id> para poder reanudarlo"""
+    runner = BatchInspectionRunner(make_batcher_infer(services.inference, timeout=config.INFERENCE_TIMEOUT_S),
+                                   image_writer,
+                                   results_dir=os.path.join(RESULTS_FOLDER, f"batch_{job_id}"),
+                                   image_url_base=f"results/batch_{job_id}",
+                                   persistence=services.persistence,
+                                   journal=BatchJournal(os.path.join(BATCH_JOBS_FOLDER, job_id, 'journal.jsonl')),
+                                   batch_size=config.MAX_BATCH_SIZE,
+                                   decode_workers=config.BATCH_DECODE_WORKERS,
+                                   outputs='final',
+                                   checkpoint_every=config.BATCH_CHECKPOINT_EVERY)
+    job = BatchJob(job_id, runner, source_path)
+    batch_jobs[job_id] = job
+    job.start()
+    return job
+
+@app.route('/batch', methods=['POST'])
+def batch_upload():
+    """
+    Recibe varias imágenes o un .zip y las inspecciona en segundo plano
+    Devuelve el id del lote; el progreso se consulta en /batch/<job_id>
+    """
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({'error': "No se encontraron archivos"}), 400
+
+    job_id = uuid.uuid4().hex[:12]
+    job_folder = os.path.join(BATCH_JOBS_FOLDER, job_id)
+    rejected = renamed = 0 # Archivos descartados por formato / renombrados por nombre repetido
+    if len(files) == 1 and files[0].filename.lower().endswith('.zip'):
+        os.makedirs(job_folder, exist_ok=True)
+        source_path = os.path.join(job_folder, 'source.zip')
+        files[0].save(source_path)
+    else:
+        source_path = os.path.join(job_folder, 'images')
+        os.makedirs(source_path, exist_ok=True)
+        used = set()
+        for file in files:
+            filename = secure_filename(file.filename)
+            if not allowed_file(filename):
+                rejected += 1
+                continue
+            # Mismo nombre (de otra carpeta del cliente, o que secure_filename dejó igual): sufijo _2, _3...
+            stem, ext = os.path.splitext(filename)
+            candidate, n = filename, 1
+            while candidate.lower() in used:
+                n += 1
+                candidate = f"{stem}_{n}{ext}"
+            if candidate != filename:
+                renamed += 1
+            used.add(candidate.lower())
+            file.save(os.path.join(source_path, candidate))
+        if not used:
+            return jsonify({'error': "Ningún archivo con formato permitido", 'rejected': rejected}), 400
+
+    job = start_batch_job(job_id, source_path)
+    return jsonify({'job_id': job_id, 'status_url': url_for('batch_status', job_id=job_id),
+                    'rejected': rejected, 'renamed': renamed}), 202
+
+@app.route('/batch/<job_id>')
+def batch_status(job_id):
+    """Progreso del lote (procesadas, con error, velocidad, tiempo restante)"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': "Lote no encontrado"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/batch/<job_id>/cancel', methods=['POST'])
+def batch_cancel(job_id):
+    """Detiene el lote después del grupo en curso (se puede reanudar)"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': "Lote no encontrado"}), 404
+    job.cancel()
+    return jsonify(job.to_dict())
+
+@app.route('/batch/<job_id>/resume', methods=['POST'])
+def batch_resume(job_id):
+    """Continúa un lote cancelado o interrumpido (p. ej. por un reinicio de la app)"""
+    job = batch_jobs.get(job_id)
+    if job is not None and job.is_running():
+        return jsonify(job.to_dict())
+    job_folder = os.path.join(BATCH_JOBS_FOLDER, secure_filename(job_id))
+    for candidate in ('source.zip', 'images'):
+        source_path = os.path.join(job_folder, candidate)
+        if os.path.exists(source_path):
+            job = start_batch_job(secure_filename(job_id), source_path)
+            return jsonify(job.to_dict()), 202
+    return jsonify({'error': "Lote no encontrado"}), 404
+
+# API del historial de inspecciones (JSON para tableros)
+def parse_datetime_arg(name):
+    """
+    Lee un parámetro de fecha ISO 8601 de la URL (None si no viene; ValueError si es inválido)
+    Con zona horaria (p. ej. '2025-01-31T08:00Z') se convierte a la hora local, como se guardan las fechas
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return to_local_naive(datetime.fromisoformat(value))
+    except ValueError:
+        raise ValueError(f"Fecha inválida en '{name}': {value} (formato ISO 8601, p. ej. 2025-01-31T08:00)")
+
+def inspection_to_json(row):
+    row = dict(row)
+    row['timestamp'] = row['timestamp'].isoformat()
+    return row
+
+@app.route('/api/inspections')
+def api_inspections():
+    """
+    Historial paginado: ?start=&end=&status=&limit=&cursor=
+    'next_cursor' de la respuesta se pasa como 'cursor' para la página siguiente
+    """
+    try:
+        start = parse_datetime_arg('start')
+        end = parse_datetime_arg('end')
+        limit = int(request.args.get('limit', 50))
+        before = None
+        cursor = request.args.get('cursor')
+        if cursor:
+            cursor_timestamp, cursor_id = cursor.rsplit('_', 1)
+            before = (datetime.fromisoformat(cursor_timestamp), int(cursor_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    result = services.db.query_inspections(start=start, end=end, estado=request.args.get('status'),
+                                       limit=limit, before=before)
+    if result is None:
+        return jsonify({'error': "Base de datos no disponible"}), 503
+    rows, has_more = result
+    next_cursor = f"{rows[-1]['timestamp'].isoformat()}_{rows[-1]['id']}" if has_more else None
+    return jsonify({'items': [inspection_to_json(row) for row in rows], 'next_cursor': next_cursor})
+
+@app.route('/api/inspections/hourly')
+def api_inspections_hourly():
+    """Tasa de defectos por hora: ?start=&end= (por defecto las últimas 24 horas)"""
+    try:
+        end = parse_datetime_arg('end') or datetime.now()
+        start = parse_datetime_arg('start') or end - timedelta(hours=24)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if end - start > timedelta(days=31):
+        return jsonify({'error': "El rango máximo es de 31 días"}), 400
+
+    rows = services.db.hourly_defect_rates(start, end)
+    if rows is None:
+        return jsonify({'error': "Base de datos no disponible"}), 503
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'hours': rows})
+
+@app.route('/inference/stats')
+def inference_stats():
+    """Profundidad de la cola y tamaños de lote del servidor de inferencia"""
+    stats = services.inference.stats()
+    if config.INFERENCE_SERVER:
+        stats['shared_server'] = services.remote_backend.stats()
+    return jsonify(stats)
+
+@app.route('/ready')
+def ready():
+    """200 cuando el modelo está cargado y precalentado y la base de datos responde; 503 mientras tanto"""
+    status = services.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/persistence/stats')
+def persistence_stats():
+    """Reportes pendientes, guardados y derivados a disco por la escritura diferida"""
+    return jsonify(services.persistence.stats())
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Aciertos y fallos de la caché de resultados"""
+    return jsonify(result_cache.stats())
+
+@app.route('/results/stats')
+def results_stats():
+    """Política de retención y resultado del último barrido de static/results"""
+    return jsonify(retention.stats())
+
+@app.route('/thumbs/<path:filename>')
+def serve_thumbnail(filename):
+    """Miniatura de una imagen de static/ (se crea la primera vez que se pide)"""
+    image_writer.wait(os.path.join(STATIC_FOLDER, filename), timeout=10)
+    if thumbnails.get(filename) is None:
+        return jsonify({'error': "Imagen no encontrada"}), 404
+    return send_from_directory(THUMBS_FOLDER, filename)
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """imágenes de resultados"""
+    # Si la imagen aún se está escribiendo en segundo plano, esperarla
+    image_writer.wait(os.path.join(PROJECT_ROOT, 'static', filename), timeout=10)
     return send_from_directory(os.path.join(PROJECT_ROOT, 'static'), filename)
 
+# Limpieza al cerrar la app
+@atexit.register
+def shutdown_app():
+    """Vacía los reportes pendientes y detiene el servidor de inferencia"""
+    print("Cerrando la aplicación...")
+    for job in batch_jobs.values():
+        job.cancel()
+    for job in batch_jobs.values():
+        job.join(timeout=config.INFERENCE_TIMEOUT_S) # Termina el grupo en curso y anota el diario
+    shutting_down.set()
+    retention.stop()
+    services.close() # Reportes pendientes, servidor de inferencia (solo lo que llegó a crearse)
+    image_writer.shutdown()
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -1,85 +1,181 @@
 import cv2
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, Response, jsonify, abort
 import atexit # Manejar cierre de la app
 # Módulos CORE necesarios
 from src.core.cnn_inspector import CnnInspectionAgent
-from src.core.camera import CameraStream
+from src.core.capture import CaptureManager, parse_camera_sources
+from src.core.batching import MicroBatcher, FairScheduler, InferenceQueueFull
+from src.core.stream_broadcaster import LiveStreamBroadcaster
+from src.core.motion import MotionGate, AdaptiveRateController, GatedAnnotator
+from src.core.services import ServiceContainer
+from src.core import config, metrics
 
 # Configuración de Flask
 app = Flask(__name__, 
             template_folder='src/web_interface/templates', 
             static_folder='static')
 
-# Inicialización de Servicios Singleton
+# Inicialización de Servicios
 
-# 1. Cargar el "cerebro" de IA (modelo best.pt)
-print("Cargando agente de IA...")
-agent = CnnInspectionAgent() 
+# El modelo no se carga al importar: el hilo de arranque (al final) lo carga y
+# precalienta mientras las cámaras ya se abren; /ready dice cuándo está listo
+services = ServiceContainer()
 
-# 2. Inicializar la Cámara (Singleton)
-print("Inicializando la cámara...")
-cam = CameraStream(camera_index=0) 
+def create_agent():
+    """1. El "cerebro" de IA (modelo best.pt)"""
+    print("Cargando agente de IA...")
+    return CnnInspectionAgent(model_path=config.MODEL_PATH,
+                              max_batch_size=config.MAX_BATCH_SIZE,
+                              max_wait_ms=config.MAX_WAIT_MS,
+                              backend=config.INFERENCE_BACKEND,
+                              intra_op_threads=config.INTRA_OP_THREADS,
+                              providers=config.ONNX_PROVIDERS,
+                              renderer=config.RENDERER,
+                              imgsz=config.INFERENCE_IMGSZ,
+                              roi=config.INFERENCE_ROI,
+                              tile_size=config.TILE_SIZE,
+                              tile_overlap=config.TILE_OVERLAP)
 
-# 3. Iniciar el hilo de lectura de la cámara
-cam.start()
+def create_inference():
+    """2. Servidor de inferencia compartido por todas las cámaras y clientes (con el modelo ya precalentado)"""
+    agent = services.agent
+    if agent.model is not None:
+        print(f"Modelo precalentado en {agent.warmup():.2f} s")
+    inference = MicroBatcher(agent, max_queue_size=config.INFERENCE_QUEUE_SIZE)
+    inference.start()
+    return inference
 
-print("--- APLICACIÓN DE PRUEBA EN VIVO LISTA Y CORRIENDO ---")
+services.register('agent', create_agent, ready=lambda agent: agent.model is not None)
+services.register('inference', create_inference, close=MicroBatcher.stop)
+# Reparto por turnos: ninguna cámara acapara la cola de inferencia
+services.register('scheduler', lambda: FairScheduler(services.inference))
+
+# 3. Inicializar las cámaras (una por fuente de VISIONPHARMA_CAMERAS)
+print("Inicializando las cámaras...")
+cameras = CaptureManager(parse_camera_sources(config.CAMERAS),
+                         width=config.CAMERA_WIDTH,
+                         height=config.CAMERA_HEIGHT,
+                         fps=config.CAMERA_FPS,
+                         fourcc=config.CAMERA_FOURCC,
+                         buffer_size=config.CAMERA_BUFFER_SIZE,
+                         reconnect_max_s=config.CAMERA_RECONNECT_MAX_S)
+
+# 4. Iniciar el hilo de lectura de cada cámara
+cameras.start()
 
 # Ruta para la Página de Video en Vivo
 @app.route('/live')
 def live_page():
-    """Página HTML 'live.html' que contendrá el video"""
-    return render_template('live.html')
+    """Página HTML 'live.html' que contendrá el video de cada cámara"""
+    return render_template('live.html', camera_ids=cameras.ids())
+
+# Anotación de un frame con la IA (la ejecuta el hilo de difusión de cada cámara)
+# Todos los frames de la cámara se publican sin esperar a la IA: solo se le envía un
+# frame si la imagen cambió y al ritmo que permite el controlador, y mientras tanto se
+# dibujan las últimas cajas (hasta la primera detección, el video sale sin cajas)
+def submit_frame(camera_id, frame):
+    """Envía el frame a inferir; mientras el modelo carga se responde como cola llena (sin bloquear el video)"""
+    if not services.created('scheduler'):
+        raise InferenceQueueFull("El modelo aún está cargando")
+    return services.scheduler.submit(camera_id, frame)
+
+def create_annotator(camera_id):
+    """Anotador de una cámara: su propio detector de movimiento y su propio control de FPS"""
+    return GatedAnnotator(
+        submit=lambda frame: submit_frame(camera_id, frame),
+        render=lambda frame, detections: services.agent.render(frame, detections) if services.created('agent') else frame,
+        gate=MotionGate(pixel_threshold=config.MOTION_THRESHOLD,
+                        min_changed_fraction=config.MOTION_MIN_CHANGED,
+                        max_static_s=config.MOTION_MAX_STATIC_S) if config.MOTION_GATE else None,
+        controller=AdaptiveRateController(max_fps=config.LIVE_MAX_INFERENCE_FPS,
+                                          min_fps=config.LIVE_MIN_INFERENCE_FPS,
+                                          pressure=lambda: services.created('scheduler') and services.scheduler.backlog() > 0,
+                                          camera_id=camera_id),
+        camera_id=camera_id,
+        timeout=config.INFERENCE_TIMEOUT_S)
+
+# 5. Pipeline de anotación + JPEG por cámara, compartido por todos sus clientes
+annotators = {}
+broadcasters = {}
+for camera_id in cameras.ids():
+    annotators[camera_id] = create_annotator(camera_id)
+    broadcasters[camera_id] = LiveStreamBroadcaster(cameras.get(camera_id), annotators[camera_id],
+                                                    jpeg_quality=config.STREAM_JPEG_QUALITY, camera_id=camera_id)
+    broadcasters[camera_id].start()
+
+# 6. Métricas: ruta /metrics (FPS de cámara, frames descartados, latencias)
+metrics.install_flask(app)
+metrics.gauge('visionpharma_inference_queue_depth', "Frames esperando en la cola de inferencia").set_function(
+    lambda: services.inference.queue_depth() if services.created('inference') else 0)
+
+# 7. Arranque en segundo plano: modelo precalentado y servidor de inferencia
+services.start(lambda: services.scheduler)
+
+print("--- APLICACIÓN DE PRUEBA EN VIVO CORRIENDO (el modelo termina de cargar en segundo plano) ---")
 
 # Generador de Frames para el Video
-def generate_frames():
+def generate_frames(broadcaster):
     """
-    Obtiene cuadros de la cámara, los procesa con la IA,
-    y los codifica como JPEGs para el stream
+    Entrega a un cliente los JPEGs que produce el hilo de difusión de una cámara
+    Si el cliente es lento, salta directamente al JPEG más reciente
     """
-    while True:
-        # 1. Obtener frame (desde la variable, no desde la cámara)
-        frame = cam.get_frame()
-        if frame is None:
-            # Esperar un poco si el hilo de la cámara aún no ha capturado nada
-            time.sleep(0.1)
-            continue
-            
-        # 2. Procesar el frame con la IA
-        try:
-            _, step_images, _ = agent.process_frame_step_by_step(frame)
-            final_frame = step_images.get('final_contours', frame)
-        except Exception as e:
-            print(f"Error en el procesamiento de IA del frame: {e}")
-            final_frame = frame 
-            
-        # 3. Codificar el frame como JPEG
-        ret, buffer = cv2.imencode('.jpg', final_frame)
-        if not ret:
-            print("Error al codificar frame como JPEG")
-            continue
-            
-        frame_bytes = buffer.tobytes()
-        
-        # 4. entrega el frame al navegador
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    last_seq = 0
+    with broadcaster.subscribe():
+        while True:
+            item = broadcaster.wait_for_jpeg(after_seq=last_seq, timeout=1.0)
+            if item is None:
+                continue
+            last_seq, frame_bytes = item
+
+            # entrega el frame al navegador
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 
 # Ruta para el Stream de Video
 @app.route('/video_feed')
-def video_feed():
+@app.route('/video_feed/<camera_id>')
+def video_feed(camera_id=None):
     """
     Esta es la ruta que el <img> en 'live.html' llama para obtener el stream de video
+    (sin id, la primera cámara configurada)
     """
-    return Response(generate_frames(), 
+    broadcaster = broadcasters.get(camera_id or cameras.ids()[0])
+    if broadcaster is None:
+        abort(404)
+    return Response(generate_frames(broadcaster), 
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/inference/stats')
+def inference_stats():
+    """Profundidad de la cola, tamaños de lote y reparto entre cámaras del servidor de inferencia"""
+    return jsonify({**services.inference.stats(), 'scheduler': services.scheduler.stats()})
+
+@app.route('/stream/stats')
+def stream_stats():
+    """Por cámara: clientes conectados, frames codificados e inferencias hechas o reutilizadas"""
+    return jsonify({camera_id: {**broadcasters[camera_id].stats(), **annotators[camera_id].stats()}
+                    for camera_id in cameras.ids()})
+
+@app.route('/ready')
+def ready():
+    """200 cuando el modelo está cargado y precalentado; 503 mientras tanto"""
+    status = services.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/cameras')
+def cameras_status():
+    """Por cámara: fuente, conexión, FPS, frames descartados, latencia de captura y reconexiones"""
+    return jsonify(cameras.stats())
+
 # Limpieza al cerrar la app
 @atexit.register
 def shutdown_app():
-    """Asegura que la cámara se libere cuando la app se cierra (Ctrl+C)."""
+    """Asegura que las cámaras se liberen cuando la app se cierra (Ctrl+C)."""
     print("Cerrando la aplicación...")
-    cam.stop()
+    for broadcaster in broadcasters.values():
+        broadcaster.stop()
+    services.close()
+    cameras.stop()
 
 if __name__ == '__main__':
     app.run(debug=False, port=5000, threaded=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""
+Inspección por lotes sin interfaz web: re-inspecciona una carpeta (o un .zip)
+con las fotos de un turno y guarda los reportes en la base de datos
+
+Se puede interrumpir (Ctrl+C) y volver a ejecutar con los mismos argumentos:
+las imágenes ya terminadas (anotadas en el diario) se saltan
+
+Uso:
+    python batch_inspect.py fotos_turno_1/
+    python batch_inspect.py fotos_turno_1.zip --output static/results/turno_1 --outputs debug
+"""
+import argparse
+import os
+import sys
+import time
+
+from src.core import config
+from src.core.batch_runner import BatchInspectionRunner, BatchJournal, open_source
+from src.core.cnn_inspector import CnnInspectionAgent
+from src.core.image_writer import ResultImageWriter
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+STATIC_FOLDER = os.path.join(PROJECT_ROOT, 'static')
+DATA_FOLDER = os.path.join(PROJECT_ROOT, 'data')
+
+def image_url_base(results_dir):
+    """Ruta guardada en la base de datos: relativa a static/ (como en app_cnn) si es posible"""
+    results_dir = os.path.abspath(results_dir)
+    if os.path.commonpath([results_dir, STATIC_FOLDER]) == STATIC_FOLDER:
+        return os.path.relpath(results_dir, STATIC_FOLDER).replace(os.sep, '/')
+    return results_dir.replace(os.sep, '/')
+
+class ProgressPrinter:
+    """Imprime el progreso como máximo cada 'interval' segundos"""
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self._last = 0.0
+
+    def __call__(self, stats):
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        done = stats['processed'] + stats['failed'] + stats['skipped']
+        eta = time.strftime('%H:%M:%S', time.gmtime(stats['eta_s'])) if stats['eta_s'] is not None else '--:--:--'
+        print(f"Procesadas {done}/{stats['total']} ({stats['failed']} con error, {stats['defective']} defectuosas) "
+              f"- {stats['images_per_s']} img/s - faltan {eta}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspección por lotes de una carpeta o un .zip de imágenes")
+    parser.add_argument('source', help="Carpeta o archivo .zip con las imágenes")
+    parser.add_argument('--output', default=None,
+                        help="Carpeta de imágenes de resultado (por defecto static/results/lote_<nombre>)")
+    parser.add_argument('--journal', default=None,
+                        help="Diario para reanudar (por defecto <output>/batch_journal.jsonl)")
+    parser.add_argument('--outputs', default='final',
+                        help="Imágenes a guardar por foto: 'final', 'debug' o 'detections' (ninguna)")
+    parser.add_argument('--batch-size', type=int, default=config.MAX_BATCH_SIZE, help="Imágenes por inferencia")
+    parser.add_argument('--workers', type=int, default=config.BATCH_DECODE_WORKERS, help="Hilos de decodificación")
+    parser.add_argument('--checkpoint-every', type=int, default=config.BATCH_CHECKPOINT_EVERY,
+                        help="Imágenes entre puntos de control del diario")
+    parser.add_argument('--no-db', action='store_true', help="No guardar reportes en la base de datos")
+    args = parser.parse_args()
+
+    try:
+        source = open_source(args.source)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    source_name = os.path.splitext(os.path.basename(os.path.normpath(args.source)))[0]
+    results_dir = args.output or os.path.join(STATIC_FOLDER, 'results', f"lote_{source_name}")
+    journal = BatchJournal(args.journal or os.path.join(results_dir, 'batch_journal.jsonl'))
+
+    agent = CnnInspectionAgent(model_path=config.MODEL_PATH,
+                               max_batch_size=args.batch_size,
+                               backend=config.INFERENCE_BACKEND,
+                               intra_op_threads=config.INTRA_OP_THREADS,
+                               providers=config.ONNX_PROVIDERS,
+                               renderer=config.RENDERER,
+                               imgsz=config.INFERENCE_IMGSZ,
+                               roi=config.INFERENCE_ROI,
+                               tile_size=config.TILE_SIZE,
+                               tile_overlap=config.TILE_OVERLAP)
+    if agent.model is None:
+        print("Error: no se pudo cargar el modelo")
+        sys.exit(1)
+
+    persistence = None
+    if not args.no_db:
+        # Importación diferida: con --no-db no hace falta el conector de MySQL
+        from src.core.database import DatabaseConnection
+        from src.core.persistence_queue import WriteBehindQueue
+        db_conn = DatabaseConnection()
+        db_conn.initialize()
+        # Archivo de pendientes propio: el de app_cnn lo reenvía la app, y dos procesos
+        # reenviando el mismo archivo duplicarían reportes. Lo pendiente se reenvía
+        # en la próxima ejecución de batch_inspect.py
+        persistence = WriteBehindQueue(db_conn,
+                                       spill_path=os.path.join(DATA_FOLDER, 'pending_inspections.batch.jsonl'),
+                                       batch_size=config.DB_BATCH_SIZE,
+                                       flush_interval=config.DB_FLUSH_INTERVAL_S)
+        persistence.start()
+
+    image_writer = ResultImageWriter(max_workers=config.RESULT_WRITER_THREADS,
+                                     jpeg_quality=config.RESULT_JPEG_QUALITY)
+    runner = BatchInspectionRunner(agent.process_batch, image_writer,
+                                   results_dir=results_dir,
+                                   image_url_base=image_url_base(results_dir),
+                                   persistence=persistence,
+                                   journal=journal,
+                                   batch_size=args.batch_size,
+                                   decode_workers=args.workers,
+                                   outputs=args.outputs,
+                                   checkpoint_every=args.checkpoint_every,
+                                   progress=ProgressPrinter())
+    try:
+        runner.run(source)
+    except KeyboardInterrupt:
+        print("Interrumpido: vuelva a ejecutar el mismo comando para continuar")
+    finally:
+        source.close()
+        image_writer.shutdown()
+        if persistence is not None:
+            persistence.close()
+
+if __name__ == '__main__':
+    main()
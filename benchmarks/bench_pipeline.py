@@ -0,0 +1,389 @@
+"""
+Benchmark reproducible del pipeline de inspección (sin cámara, sin MySQL, sin GPU)
+
+Mide la latencia por etapa (decode, predict, postprocess, plot, imwrite,
+inserción en base de datos), el pipeline completo de process_frame_step_by_step,
+los FPS del stream en vivo, el pico de memoria y el tiempo hasta la primera
+inspección de un proceso nuevo (con y sin precalentar el modelo), y guarda
+todo en JSON para comparar entre ejecuciones.
+
+Por defecto usa imágenes sintéticas de blísteres y un modelo falso (StubBackend)
+que devuelve una detección por cavidad, así se mide todo lo que NO es la red.
+Con --model se usa el modelo real (.pt u .onnx).
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.bench_pipeline --output bench.json
+    python -m benchmarks.bench_pipeline --model best.onnx --images fotos/ --compare bench.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from src.core.cnn_inspector import CnnInspectionAgent
+from src.core.database import DatabaseConnection
+from src.core.models import InspectionReportDTO
+from src.core.storage_backends import create_storage_backend
+from src.core.stream_broadcaster import LiveStreamBroadcaster
+
+DEFAULT_SIZES = ('640x480', '1280x960', '1920x1080')
+
+class StubBackend:
+    """
+    Modelo falso: una detección por cavidad de una cuadrícula fija (filas x columnas)
+
+    Sus salidas son deterministas, por eso sirve para medir el resto del pipeline
+    sin que el tiempo de la red oculte las regresiones
+    """
+    name = 'stub'
+
+    def __init__(self, rows=5, cols=8, empty_every=7):
+        self.rows = rows
+        self.cols = cols
+        self.empty_every = empty_every # Una cavidad de cada N aparece 'vacio'
+        self.names = {0: 'pastilla', 1: 'vacio'}
+
+    def predict(self, source, conf, verbose=True):
+        frames = source if isinstance(source, (list, tuple)) else [source]
+        return [self._grid(frame.shape[:2]) for frame in frames]
+
+    def _grid(self, shape):
+        h, w = shape
+        cell_w, cell_h = w / (self.cols + 1), h / (self.rows + 1)
+        cx = (np.arange(self.cols) + 1) * cell_w
+        cy = (np.arange(self.rows) + 1) * cell_h
+        cx, cy = np.meshgrid(cx, cy)
+        cx, cy = cx.ravel(), cy.ravel()
+        r = min(cell_w, cell_h) * 0.35
+        n = len(cx)
+        cls = (np.arange(n) % self.empty_every == 0).astype(np.float32)
+        confs = 0.6 + 0.39 * ((np.arange(n) * 37) % 100) / 100
+        return np.stack([cx - r, cy - r, cx + r, cy + r, confs, cls], axis=1).astype(np.float32)
+
+def synthetic_blister(width, height, rows=5, cols=8, seed=0):
+    """Imagen sintética de un blíster: cuadrícula de pastillas sobre fondo gris"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 90, dtype=np.uint8)
+    img += rng.integers(0, 20, img.shape, dtype=np.uint8) # Ruido de sensor
+    cell_w, cell_h = width / (cols + 1), height / (rows + 1)
+    radius = int(min(cell_w, cell_h) * 0.35)
+    for i in range(rows):
+        for j in range(cols):
+            center = (int((j + 1) * cell_w), int((i + 1) * cell_h))
+            cv2.circle(img, center, radius, (200, 200, 200), -1, cv2.LINE_AA)
+            if (i * cols + j) % 7:
+                cv2.circle(img, center, int(radius * 0.8), (240, 240, 250), -1, cv2.LINE_AA)
+    return img
+
+def load_images(images_path, sizes):
+    """Carga imágenes de una carpeta o genera las sintéticas; devuelve [(nombre, bytes JPEG)]"""
+    encoded = []
+    if images_path:
+        paths = []
+        for pattern in ('*.jpg', '*.jpeg', '*.png'):
+            paths.extend(glob.glob(os.path.join(images_path, pattern)))
+        for path in sorted(paths):
+            with open(path, 'rb') as f:
+                encoded.append((os.path.basename(path), f.read()))
+    else:
+        for size in sizes:
+            width, height = (int(v) for v in size.lower().split('x'))
+            ret, buffer = cv2.imencode('.jpg', synthetic_blister(width, height), [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+            encoded.append((f"sintetica_{size}", buffer.tobytes()))
+    if not encoded:
+        raise SystemExit("No se encontraron imágenes para el benchmark")
+    return encoded
+
+def summarize(samples):
+    """Percentiles (ms) de una lista de duraciones en segundos"""
+    ms = np.asarray(samples) * 1000.0
+    return {
+        'n': int(ms.size),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+def bench_stages(agent, images, iterations, out_dir, store):
+    """Latencia por etapa del pipeline de subida (mismo orden que app_cnn.upload_file)"""
+    stages = {name: [] for name in ('decode', 'predict', 'postprocess', 'plot', 'imwrite', 'db_insert', 'db_insert_batch50', 'end_to_end')}
+    encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), 90]
+
+    for i in range(iterations):
+        for name, data in images:
+            t0 = time.perf_counter()
+            frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            t1 = time.perf_counter()
+            detections = agent.detect([frame])[0]
+            t2 = time.perf_counter()
+            results = agent.format_results(detections)
+            t3 = time.perf_counter()
+            final = agent.render(frame, detections)
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            thresholded = cv2.cvtColor(final, cv2.COLOR_BGR2GRAY)
+            t4 = time.perf_counter()
+            for step, img in (('original', frame), ('grayscale', gray), ('thresholded', thresholded), ('final_contours', final)):
+                cv2.imwrite(os.path.join(out_dir, f"{step}_{i}.jpg"), img, encode_params)
+            t5 = time.perf_counter()
+            dto = InspectionReportDTO.from_results(results, imagen_resultado=f"results/final_contours_{i}.jpg")
+            store.save_inspection(dto)
+            t6 = time.perf_counter()
+
+            stages['decode'].append(t1 - t0)
+            stages['predict'].append(t2 - t1)
+            stages['postprocess'].append(t3 - t2)
+            stages['plot'].append(t4 - t3)
+            stages['imwrite'].append(t5 - t4)
+            stages['db_insert'].append(t6 - t5)
+
+            # Pipeline completo tal como lo usa la app
+            t7 = time.perf_counter()
+            agent.process_frame_step_by_step(frame, outputs='debug')
+            stages['end_to_end'].append(time.perf_counter() - t7)
+
+    # Inserción por lotes (como la escritura diferida)
+    batch = [InspectionReportDTO(datetime.now(), 40, 0, 'Aprobado', None) for _ in range(50)]
+    for _ in range(max(3, iterations)):
+        t0 = time.perf_counter()
+        store.save_inspections(batch)
+        stages['db_insert_batch50'].append(time.perf_counter() - t0)
+
+    return {name: summarize(samples) for name, samples in stages.items() if samples}
+
+class _SyntheticPacket:
+    def __init__(self, seq, frame):
+        self.seq = seq
+        self.timestamp = time.time()
+        self.frame = frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class SyntheticCamera:
+    """Cámara falsa con la API de CameraStream (wait_for_frame) a FPS fijos"""
+
+    def __init__(self, frame, fps=30.0):
+        self.frame = frame
+        self.frame.flags.writeable = False
+        self.period = 1.0 / fps
+        self.start_time = time.monotonic()
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        seq = int((time.monotonic() - self.start_time) / self.period) + 1
+        if seq <= after_seq:
+            time.sleep(self.start_time + after_seq * self.period - time.monotonic() + 1e-4)
+            seq = after_seq + 1
+        return _SyntheticPacket(seq, self.frame)
+
+def bench_live(agent, frame, seconds, camera_fps, clients):
+    """FPS del stream en vivo: un pipeline de difusión y N clientes consumiendo"""
+    camera = SyntheticCamera(frame.copy(), fps=camera_fps)
+    annotate = lambda f: agent.process_frame_step_by_step(f, outputs='final')[0]
+    broadcaster = LiveStreamBroadcaster(camera, annotate)
+    received = [0] * clients
+    stop = threading.Event()
+
+    def client(idx):
+        seq = 0
+        with broadcaster.subscribe():
+            while not stop.is_set():
+                item = broadcaster.wait_for_jpeg(after_seq=seq, timeout=0.5)
+                if item is not None:
+                    seq = item[0]
+                    received[idx] += 1
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)]
+    broadcaster.start()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    stats = broadcaster.stats()
+    broadcaster.stop()
+    return {
+        'camera_fps': camera_fps,
+        'clients': clients,
+        'seconds': seconds,
+        'encoded_fps': round(stats['frames_encoded'] / seconds, 2),
+        'client_fps_min': round(min(received) / seconds, 2),
+        'client_fps_max': round(max(received) / seconds, 2),
+    }
+
+def bench_memory(agent, images):
+    """Pico de memoria del pipeline completo (tracemalloc) y RSS máximo del proceso"""
+    tracemalloc.start()
+    for _, data in images:
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        agent.process_frame_step_by_step(frame, outputs='debug')
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    memory = {'tracemalloc_peak_mb': round(peak / 2 ** 20, 2)}
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux informa KB, macOS bytes
+        memory['max_rss_mb'] = round(rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 2)
+    except ImportError:
+        pass # No disponible en Windows
+    return memory
+
+def startup_probe(mode, model, renderer):
+    """
+    Se ejecuta en un proceso nuevo (ver bench_startup): carga el modelo y mide
+    la primera inspección, 'cold' tal cual o 'warm' después de agent.warmup()
+    """
+    start = time.perf_counter()
+    agent = CnnInspectionAgent(model_path=model or 'stub', backend='auto' if model else StubBackend(), renderer=renderer)
+    load_s = time.perf_counter() - start
+    warmup_s = agent.warmup() if mode == 'warm' else 0.0
+    frame = synthetic_blister(1280, 960)
+    start = time.perf_counter()
+    agent.process_frame_step_by_step(frame, outputs='debug')
+    first_ms = (time.perf_counter() - start) * 1000
+    print(json.dumps({'load_s': round(load_s, 3), 'warmup_s': round(warmup_s, 3),
+                      'first_inference_ms': round(first_ms, 2), 'done_at': time.time()}))
+
+def bench_startup(model, renderer):
+    """
+    Tiempo hasta la primera inspección en un proceso nuevo (importaciones,
+    carga del modelo y primera llamada), sin y con precalentamiento
+    """
+    results = {}
+    for mode in ('cold', 'warm'):
+        command = [sys.executable, '-m', 'benchmarks.bench_pipeline', '--startup-probe', mode, '--renderer', renderer]
+        if model:
+            command += ['--model', model]
+        launched = time.time()
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        probe = json.loads(output.strip().splitlines()[-1]) # Las líneas anteriores son mensajes del agente
+        probe['time_to_first_inference_s'] = round(probe.pop('done_at') - launched, 3)
+        results[mode] = probe
+    cold, warm = results['cold']['first_inference_ms'], results['warm']['first_inference_ms']
+    results['first_inference_reduction_pct'] = round(100.0 * (cold - warm) / cold, 1) if cold else 0.0
+    return results
+
+def compare(current, baseline_path):
+    """Imprime la variación de p50 por etapa respecto a un JSON anterior"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nComparación con '{baseline_path}' (p50, negativo = más rápido):")
+    for name, stats in current['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if not old or not old['p50_ms']:
+            continue
+        delta = 100.0 * (stats['p50_ms'] - old['p50_ms']) / old['p50_ms']
+        print(f"  {name:<18} {old['p50_ms']:>9.2f} ms -> {stats['p50_ms']:>9.2f} ms ({delta:+.1f}%)")
+    old_live, live = baseline.get('live'), current.get('live')
+    if old_live and live:
+        print(f"  {'live encoded_fps':<18} {old_live['encoded_fps']:>9.2f} -> {live['encoded_fps']:>9.2f}")
+    old_startup, startup = baseline.get('startup'), current.get('startup')
+    if old_startup and startup:
+        for mode in ('cold', 'warm'):
+            print(f"  {'primera ' + mode:<18} {old_startup[mode]['first_inference_ms']:>9.2f} ms -> "
+                  f"{startup[mode]['first_inference_ms']:>9.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de inspección de VisionPharma")
+    parser.add_argument('--model', default=None, help="Modelo real (.pt/.onnx); por defecto el modelo falso")
+    parser.add_argument('--images', default=None, help="Carpeta con imágenes; por defecto imágenes sintéticas")
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES), help="Tamaños sintéticos, p. ej. 640x480,1920x1080")
+    parser.add_argument('--iterations', type=int, default=20, help="Repeticiones por imagen")
+    parser.add_argument('--renderer', default='opencv', help="Renderer de detecciones ('opencv' o 'ultralytics')")
+    parser.add_argument('--roi', default=None, help="Zona a inspeccionar x,y,ancho,alto (como VISIONPHARMA_ROI)")
+    parser.add_argument('--tile-size', type=int, default=0, help="Lado de las teselas (0 = sin teselas)")
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help="Solape entre teselas (fracción del lado)")
+    parser.add_argument('--live-seconds', type=float, default=3.0, help="Duración de la prueba del stream (0 = omitir)")
+    parser.add_argument('--live-clients', type=int, default=3, help="Clientes simultáneos del stream")
+    parser.add_argument('--camera-fps', type=float, default=30.0, help="FPS de la cámara sintética")
+    parser.add_argument('--output', default=None, help="Archivo JSON de salida")
+    parser.add_argument('--compare', default=None, help="JSON de una ejecución anterior para comparar")
+    parser.add_argument('--no-startup', action='store_true', help="Omitir la medición del arranque (procesos nuevos)")
+    parser.add_argument('--startup-probe', choices=('cold', 'warm'), default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_probe:
+        startup_probe(args.startup_probe, args.model, args.renderer)
+        return
+
+    backend = 'auto' if args.model else StubBackend()
+    agent = CnnInspectionAgent(model_path=args.model or 'stub', backend=backend, renderer=args.renderer,
+                               roi=args.roi, tile_size=args.tile_size, tile_overlap=args.tile_overlap)
+    if agent.model is None:
+        raise SystemExit("No se pudo cargar el modelo para el benchmark")
+
+    images = load_images(args.images, args.sizes.split(','))
+    print(f"Benchmark con {len(images)} imagen(es), {args.iterations} iteraciones, modelo {agent.model.name}")
+
+    # Calentamiento (primeras llamadas con costos únicos)
+    warm_frame = cv2.imdecode(np.frombuffer(images[0][1], dtype=np.uint8), cv2.IMREAD_COLOR)
+    agent.process_frame_step_by_step(warm_frame)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Mismo SQL que la app, sobre una base SQLite temporal (sin servidor)
+        store = DatabaseConnection(create_storage_backend('sqlite', sqlite_path=os.path.join(tmp, 'bench.db')))
+        store.initialize()
+        stages = bench_stages(agent, images, args.iterations, tmp, store)
+        store.close()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'model': args.model or 'stub',
+            'renderer': args.renderer,
+            'images': [name for name, _ in images],
+            'iterations': args.iterations,
+        },
+        'stages': stages,
+    }
+    if args.live_seconds > 0:
+        report['live'] = bench_live(agent, warm_frame, args.live_seconds, args.camera_fps, args.live_clients)
+    report['memory'] = bench_memory(agent, images)
+    if not args.no_startup:
+        report['startup'] = bench_startup(args.model, args.renderer)
+
+    print(f"\n{'etapa':<18} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for name, stats in stages.items():
+        print(f"{name:<18} {stats['p50_ms']:>9.2f} {stats['p90_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+    if 'live' in report:
+        live = report['live']
+        print(f"\nStream en vivo: {live['encoded_fps']} FPS codificados, "
+              f"{live['client_fps_min']}-{live['client_fps_max']} FPS por cliente ({live['clients']} clientes)")
+    print(f"Memoria: {report['memory']}")
+    if 'startup' in report:
+        startup = report['startup']
+        print(f"Primera inspección: {startup['cold']['first_inference_ms']} ms sin precalentar, "
+              f"{startup['warm']['first_inference_ms']} ms precalentado "
+              f"({startup['first_inference_reduction_pct']}% menos; "
+              f"{startup['warm']['time_to_first_inference_s']} s desde el arranque del proceso)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResultados guardados en '{args.output}'")
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Exporta best.pt a ONNX (y opcionalmente a INT8) y valida que el backend
+ONNX Runtime produzca los mismos resultados que el modelo PyTorch
+
+Uso:
+    python export_model.py --model best.pt --imgsz 640 --int8 --validate ruta/a/imagenes
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from src.core.cnn_inspector import CnnInspectionAgent
+from src.core.inference_backends import letterbox
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png')
+
+def find_images(path):
+    """Lista las imágenes de una carpeta (o la imagen indicada)"""
+    if not path:
+        return []
+    if os.path.isfile(path):
+        return [path]
+    images = []
+    for pattern in IMAGE_PATTERNS:
+        images.extend(glob.glob(os.path.join(path, pattern)))
+    return sorted(images)
+
+def export_onnx(model_path, imgsz):
+    """Exporta el modelo .pt a ONNX con lote y tamaño dinámicos"""
+    from ultralytics import YOLO
+    print(f"Exportando '{model_path}' a ONNX (imgsz={imgsz})...")
+    onnx_path = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    print(f"Modelo ONNX guardado en '{onnx_path}'")
+    return onnx_path
+
+class _CalibrationReader:
+    """Entrega imágenes de calibración (ya preprocesadas) a la cuantización estática"""
+
+    def __init__(self, images, input_name, imgsz):
+        self._images = iter(images)
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for path in self._images:
+            frame = cv2.imread(path)
+            if frame is None:
+                continue
+            img, _, _ = letterbox(frame, (self.imgsz, self.imgsz))
+            blob = np.ascontiguousarray(img[None, ..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+            return {self.input_name: blob}
+        return None
+
+def quantize_int8(onnx_path, calibration_images, imgsz):
+    """
+    Cuantiza el modelo ONNX a INT8
+
+    Con imágenes de calibración usa cuantización estática (QDQ, más rápida en CPU);
+    sin ellas, cuantización dinámica de los pesos
+    """
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    import onnxruntime as ort
+
+    int8_path = os.path.splitext(onnx_path)[0] + '_int8.onnx'
+    if calibration_images:
+        print(f"Cuantizando a INT8 (estática, {len(calibration_images)} imágenes de calibración)...")
+        input_name = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+        quantize_static(onnx_path, int8_path, _CalibrationReader(calibration_images, input_name, imgsz),
+                        quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    else:
+        print("Cuantizando a INT8 (dinámica, sin imágenes de calibración)...")
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+
+    # Conservar los metadatos de ultralytics (nombres de clases, imgsz)
+    import onnx
+    source, target = onnx.load(onnx_path), onnx.load(int8_path)
+    existing = {p.key for p in target.metadata_props}
+    for prop in source.metadata_props:
+        if prop.key not in existing:
+            target.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(target, int8_path)
+
+    print(f"Modelo INT8 guardado en '{int8_path}'")
+    return int8_path
+
+def _summary(results):
+    """Cantidad de detecciones por estado"""
+    counts = {}
+    for r in results:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    return counts
+
+def validate(reference_path, candidate_path, images, threads):
+    """
+    Compara el modelo de referencia (.pt) con el exportado sobre las mismas
+    imágenes: conteos por estado, diferencia de confianza y latencia media
+
+    Devuelve True si todos los conteos coinciden
+    """
+    if not images:
+        print("Sin imágenes de validación: se usa una imagen sintética (solo mide latencia)")
+        images = [None]
+
+    reference = CnnInspectionAgent(reference_path, backend='pytorch')
+    candidate = CnnInspectionAgent(candidate_path, backend='onnx', intra_op_threads=threads)
+    if reference.model is None or candidate.model is None:
+        print("Error: no se pudo cargar alguno de los modelos para validar")
+        return False
+
+    all_match = True
+    times = {'pytorch': [], 'onnx': []}
+    for path in images:
+        frame = cv2.imread(path) if path else np.full((640, 640, 3), 114, dtype=np.uint8)
+        if frame is None:
+            print(f"No se pudo leer '{path}', se omite")
+            continue
+
+        outputs = {}
+        for name, agent in (('pytorch', reference), ('onnx', candidate)):
+            start = time.perf_counter()
+            _, _, results = agent.process_frame_step_by_step(frame)
+            times[name].append(time.perf_counter() - start)
+            outputs[name] = results
+
+        ref_counts, cand_counts = _summary(outputs['pytorch']), _summary(outputs['onnx'])
+        match = ref_counts == cand_counts
+        all_match = all_match and match
+        conf_diff = 0.0
+        if match and outputs['pytorch']:
+            ref_conf = np.array(sorted(r['circularity'] for r in outputs['pytorch']))
+            cand_conf = np.array(sorted(r['circularity'] for r in outputs['onnx']))
+            conf_diff = float(np.abs(ref_conf - cand_conf).max())
+        print(f"{'OK ' if match else 'DIF'} {path or 'sintética'}: pytorch={ref_counts} onnx={cand_counts} "
+              f"(máx. dif. confianza {conf_diff:.2f})")
+
+    for name, values in times.items():
+        if values:
+            print(f"Latencia media {name}: {1000 * sum(values) / len(values):.1f} ms")
+    print("Validación correcta" if all_match else "Validación con diferencias")
+    return all_match
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportar y validar el modelo ONNX de VisionPharma")
+    parser.add_argument('--model', default='best.pt', help="Modelo PyTorch de origen")
+    parser.add_argument('--imgsz', type=int, default=640, help="Tamaño de entrada del modelo exportado")
+    parser.add_argument('--int8', action='store_true', help="Generar también una versión cuantizada INT8")
+    parser.add_argument('--validate', default=None, help="Imagen o carpeta de imágenes para validar (y calibrar INT8)")
+    parser.add_argument('--threads', type=int, default=0, help="Hilos por operador de ONNX Runtime en la validación")
+    parser.add_argument('--skip-export', action='store_true', help="Validar un .onnx ya exportado")
+    args = parser.parse_args()
+
+    images = find_images(args.validate)
+    onnx_path = os.path.splitext(args.model)[0] + '.onnx' if args.skip_export else export_onnx(args.model, args.imgsz)
+    candidates = [onnx_path]
+    if args.int8:
+        candidates.append(quantize_int8(onnx_path, images, args.imgsz))
+
+    ok = True
+    for candidate in candidates:
+        print(f"\n--- Validando '{candidate}' contra '{args.model}' ---")
+        ok = validate(args.model, candidate, images, args.threads) and ok
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
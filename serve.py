@@ -0,0 +1,138 @@
+"""
+Modo producción de la app principal (en lugar de 'python app_cnn.py')
+
+- Un proceso de inferencia carga el modelo una sola vez, lo precalienta y
+  atiende a todos los procesos web (ver src/core/inference_server.py)
+- gunicorn levanta varios procesos web (workers) con varios hilos cada uno:
+  decodificar, dibujar y codificar JPEG ya no compiten por un único GIL
+- Los frames pasan a la inferencia por memoria compartida, sin serializarlos
+
+En Windows (sin gunicorn) se usa waitress: un solo proceso con varios hilos
+y el modelo dentro de la app
+
+Uso:
+    python serve.py
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+"""
+import argparse
+import multiprocessing
+import os
+import secrets
+import sys
+
+from src.core import config
+from src.core.inference_server import parse_address, run_server
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+DATA_FOLDER = os.path.join(PROJECT_ROOT, 'data')
+
+def agent_options():
+    """Argumentos del agente del proceso de inferencia (ROI y teselas los hace cada worker)"""
+    return {
+        'model_path': config.MODEL_PATH,
+        'max_batch_size': config.MAX_BATCH_SIZE,
+        'max_wait_ms': config.MAX_WAIT_MS,
+        'backend': config.INFERENCE_BACKEND,
+        'intra_op_threads': config.INTRA_OP_THREADS,
+        'providers': config.ONNX_PROVIDERS,
+        'renderer': config.RENDERER,
+        'imgsz': config.INFERENCE_IMGSZ,
+    }
+
+def start_inference_process(address, authkey):
+    """Lanza el proceso de inferencia y espera a que acepte conexiones (None si no pudo cargar el modelo)"""
+    ctx = multiprocessing.get_context('spawn') # Proceso limpio: sin hilos ni estado heredado
+    ready = ctx.Event()
+    process = ctx.Process(target=run_server, name='visionpharma-inference', daemon=True,
+                          args=(parse_address(address), authkey, agent_options(), config.INFERENCE_QUEUE_SIZE, ready))
+    process.start()
+    while not ready.wait(1.0):
+        if not process.is_alive():
+            return None
+    return process
+
+def run_gunicorn(workers, threads, bind):
+    """Workers web con gunicorn; cada uno recibe un número fijo (0..N-1) en config.WORKER_ID"""
+    from gunicorn.app.base import BaseApplication
+
+    free_slots = list(range(workers))
+
+    def pre_fork(server, worker):
+        worker.slot = free_slots.pop(0) if free_slots else None # Se ejecuta en el proceso principal
+
+    def post_fork(server, worker):
+        # Ya en el worker, antes de importar app_cnn: el worker 0 reenvía el archivo de
+        # pendientes compartido y barre static/results; los demás usan su propio archivo
+        config.WORKER_ID = str(worker.slot) if worker.slot is not None else f"p{os.getpid()}"
+
+    def child_exit(server, worker):
+        if worker.slot is not None:
+            free_slots.append(worker.slot)
+            free_slots.sort()
+
+    class VisionPharmaApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': bind,
+                'workers': workers,
+                'threads': threads,
+                'worker_class': 'gthread',
+                'timeout': max(60, int(config.INFERENCE_TIMEOUT_S * 2)),
+                'pre_fork': pre_fork,
+                'post_fork': post_fork,
+                'child_exit': child_exit,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app_cnn import app
+            return app
+
+    VisionPharmaApplication().run()
+
+def run_waitress(threads, bind):
+    """Un solo proceso con 'threads' hilos (Windows); el modelo se carga en la app"""
+    from waitress import serve
+    from app_cnn import app
+    serve(app, listen=bind, threads=threads)
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de producción de VisionPharma (app_cnn)")
+    parser.add_argument('--workers', type=int, default=config.SERVE_WORKERS, help="Procesos web")
+    parser.add_argument('--threads', type=int, default=config.SERVE_THREADS, help="Hilos por proceso web")
+    parser.add_argument('--bind', default=config.SERVE_BIND, help="Dirección donde escuchar (host:puerto)")
+    args = parser.parse_args()
+
+    try:
+        import gunicorn # noqa: F401
+    except ImportError:
+        try:
+            import waitress # noqa: F401
+        except ImportError:
+            print("Instale gunicorn (Linux) o waitress (Windows): pip install -r requirements.txt")
+            sys.exit(1)
+        print(f"gunicorn no disponible: waitress con {args.threads} hilos en {args.bind}")
+        run_waitress(args.threads, args.bind)
+        return
+
+    # El socket y la clave se pasan a los workers por config (heredada al hacer fork)
+    config.INFERENCE_SERVER = config.INFERENCE_SERVER or os.path.join(DATA_FOLDER, 'inference.sock')
+    config.INFERENCE_AUTHKEY = config.INFERENCE_AUTHKEY or secrets.token_hex(16)
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+
+    print("Cargando el modelo en el proceso de inferencia...")
+    process = start_inference_process(config.INFERENCE_SERVER, config.INFERENCE_AUTHKEY.encode())
+    if process is None:
+        print("Error: el proceso de inferencia no pudo cargar el modelo")
+        sys.exit(1)
+
+    print(f"{args.workers} workers x {args.threads} hilos en {args.bind}")
+    try:
+        run_gunicorn(args.workers, args.threads, args.bind)
+    finally:
+        process.terminate()
+        process.join(timeout=10)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+"""
+Inspección por lotes de imágenes guardadas (una carpeta o un archivo .zip)
+
+Las imágenes se leen y decodifican en paralelo, pasan por la IA en lotes,
+las imágenes de resultado se escriben en el pool de ResultImageWriter y los
+reportes se guardan en bloque con la escritura diferida.
+
+Cada cierto número de imágenes se hace un punto de control: se espera a que
+las imágenes y los reportes estén guardados y recién entonces se anotan en
+un diario (JSON Lines). Si el proceso se interrumpe, al volver a ejecutarlo
+con el mismo diario se saltan las imágenes ya terminadas
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from . import metrics
+from .batching import InferenceQueueFull
+from .models import InspectionReportDTO
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+BATCH_IMAGES = metrics.counter('visionpharma_batch_images_total', "Imágenes procesadas por la inspección por lotes",
+                               labelnames=('result',))
+
+class DirectorySource:
+    """Imágenes de una carpeta (incluye subcarpetas), en orden alfabético"""
+
+    def __init__(self, path):
+        self.path = path
+        names = []
+        for root, _, files in os.walk(path):
+            for filename in files:
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    names.append(os.path.relpath(os.path.join(root, filename), path).replace(os.sep, '/'))
+        self.names = sorted(names)
+
+    def read(self, name) -> bytes:
+        with open(os.path.join(self.path, name), 'rb') as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+class ZipSource:
+    """Imágenes dentro de un archivo .zip (se leen sin descomprimir a disco)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        self.names = sorted(info.filename for info in self._zip.infolist()
+                            if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS))
+
+    def read(self, name) -> bytes:
+        # ZipFile permite leer miembros distintos desde varios hilos
+        return self._zip.read(name)
+
+    def close(self):
+        self._zip.close()
+
+def open_source(path):
+    """Abre una carpeta o un .zip como fuente de imágenes"""
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    if zipfile.is_zipfile(path):
+        return ZipSource(path)
+    raise ValueError(f"'{path}' no es una carpeta ni un archivo .zip")
+
+class BatchJournal:
+    """
+    Diario de solo-agregar con las imágenes ya terminadas
+
+    Una línea JSON por imagen: {"source": nombre, "estado_final": ...}
+    o {"source": nombre, "error": ...} si no se pudo leer. La primera línea,
+    {"run": id}, identifica la ejecución: las claves de origen de sus reportes
+    (report_key) se mantienen al reanudar, así la base ignora los reportes
+    que ya había guardado después del último punto de control
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.run_id = None
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        if 'run' in entry:
+                            self.run_id = self.run_id or entry['run']
+                        else:
+                            self.done.add(entry['source'])
+                    except (ValueError, KeyError, TypeError):
+                        continue # Última línea cortada por una interrupción
+        self._run_recorded = self.run_id is not None
+        self.run_id = self.run_id or uuid.uuid4().hex[:12]
+
+    def report_key(self, source) -> str:
+        """Clave de origen del reporte de una imagen (clave_origen en la base de datos)"""
+        return f"{self.run_id}/{hashlib.blake2b(source.encode('utf-8'), digest_size=16).hexdigest()}"
+
+    def record(self, entries):
+        """Agrega las entradas y las fuerza a disco"""
+        if not entries:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            if not self._run_recorded:
+                f.write(json.dumps({'run': self.run_id}) + '\n')
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._run_recorded = True
+        self.done.update(entry['source'] for entry in entries)
+
+def make_batcher_infer(batcher, timeout=None, retry_delay=0.05):
+    """
+    Función de inferencia que usa el servidor de inferencia compartido (MicroBatcher)
+    en lugar del modelo directamente (para correr dentro de la app web)
+
+    Si la cola está llena, espera y reintenta: un lote no debe fallar por
+    compartir el servidor con las peticiones interactivas
+    """
+    def infer(frames, outputs):
+        futures = []
+        for frame in frames:
+            while True:
+                try:
+                    futures.append(batcher.submit(frame, outputs))
+                    break
+                except InferenceQueueFull:
+                    time.sleep(retry_delay)
+        return [future.result(timeout=timeout) for future in futures]
+    return infer
+
+class BatchInspectionRunner:
+    """
+    Procesa todas las imágenes de una fuente:
+    lectura/decodificación paralela -> IA por lotes -> escritura paralela -> reportes en bloque
+    """
+
+    def __init__(self, infer, image_writer, results_dir, image_url_base, persistence=None,
+                 journal=None, batch_size=8, decode_workers=4, outputs='final',
+                 checkpoint_every=100, progress=None):
+        """
+        Args:
+            infer (callable): (frames, outputs) -> lista de (frame_final, step_images, results),
+                p. ej. agent.process_batch o make_batcher_infer(batcher)
+            image_writer (ResultImageWriter): Pool de escritura de imágenes
+            results_dir (str): Carpeta donde se guardan las imágenes de resultado
+            image_url_base (str): Prefijo de la ruta guardada en la base de datos (p. ej. 'results/lote_1')
+            persistence (WriteBehindQueue): Escritura diferida de reportes (None = no guardar reportes)
+            journal (BatchJournal): Diario para reanudar (None = sin reanudación)
+            batch_size (int): Imágenes por llamada a la IA
+            decode_workers (int): Hilos de lectura y decodificación
+            outputs: Imágenes de pasos a guardar (ver CnnInspectionAgent.resolve_outputs)
+            checkpoint_every (int): Imágenes entre puntos de control del diario
+            progress (callable): Recibe stats() después de cada lote
+        """
+        self.infer = infer
+        self.image_writer = image_writer
+        self.results_dir = results_dir
+        self.image_url_base = image_url_base.rstrip('/')
+        self.persistence = persistence
+        self.journal = journal
+        self.batch_size = max(1, int(batch_size))
+        self.decode_workers = max(1, int(decode_workers))
+        self.outputs = outputs
+        self.checkpoint_every = max(1, int(checkpoint_every))
+        self.progress = progress
+
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._pending_entries = [] # Terminadas pero aún no anotadas en el diario
+        self._pending_writes = [] # Futures de las imágenes de esas entradas
+        self._status = 'pendiente'
+        self._total = 0
+        self._skipped = 0
+        self._processed = 0
+        self._failed = 0
+        self._defective = 0
+        self._started = None
+        self._finished = None
+
+    def cancel(self):
+        """Pide detener el proceso después del lote en curso (se puede reanudar)"""
+        self._cancel.set()
+
+    def stats(self) -> dict:
+        """Progreso: imágenes totales, saltadas (ya hechas), procesadas, con error y velocidad"""
+        with self._lock:
+            elapsed = ((self._finished or time.monotonic()) - self._started) if self._started else 0.0
+            done = self._processed + self._failed
+            remaining = self._total - self._skipped - done
+            rate = done / elapsed if elapsed > 0 else 0.0
+            return {
+                'status': self._status,
+                'total': self._total,
+                'skipped': self._skipped,
+                'processed': self._processed,
+                'failed': self._failed,
+                'defective': self._defective,
+                'remaining': remaining,
+                'elapsed_s': round(elapsed, 1),
+                'images_per_s': round(rate, 2),
+                'eta_s': round(remaining / rate, 1) if rate > 0 else None,
+            }
+
+    def run(self, source) -> dict:
+        """Procesa la fuente completa (bloquea) y devuelve las estadísticas finales"""
+        names = source.names
+        if self.journal is not None:
+            names = [name for name in names if name not in self.journal.done]
+        with self._lock:
+            self._status = 'procesando'
+            self._total = len(source.names)
+            self._skipped = len(source.names) - len(names)
+            self._started = time.monotonic()
+        os.makedirs(self.results_dir, exist_ok=True)
+        print(f"Inspección por lotes: {len(names)} imágenes por procesar "
+              f"({self._skipped} ya terminadas, {self.decode_workers} hilos de decodificación, lote {self.batch_size})")
+
+        status = 'terminado'
+        try:
+            with ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix='batch-decode') as pool:
+                batch = []
+                for name, frame in self._decoded(pool, source, names):
+                    if frame is None:
+                        self._add_entry({'source': name, 'error': "No se pudo leer la imagen"}, [])
+                        continue
+                    batch.append((name, frame))
+                    if len(batch) >= self.batch_size:
+                        self._process_batch(batch)
+                        batch = []
+                        if self._cancel.is_set():
+                            status = 'cancelado'
+                            break
+                if batch and not self._cancel.is_set():
+                    self._process_batch(batch)
+        except BaseException:
+            status = 'interrumpido'
+            raise
+        finally:
+            # Lo ya procesado queda anotado: una nueva ejecución continúa desde aquí
+            self._checkpoint()
+            with self._lock:
+                self._status = status
+                self._finished = time.monotonic()
+            final_stats = self.stats()
+            print(f"Inspección por lotes {status}: {final_stats['processed']} procesadas, "
+                  f"{final_stats['failed']} con error, {final_stats['defective']} defectuosas "
+                  f"en {final_stats['elapsed_s']} s")
+        return final_stats
+
+    def _decoded(self, pool, source, names):
+        """
+        Lee y decodifica en paralelo conservando el orden, con una ventana acotada
+        (nunca hay más de unos pocos lotes de imágenes decodificadas en memoria)
+        """
+        window = deque()
+        names = iter(names)
+        max_in_flight = self.batch_size * 2 + self.decode_workers
+        for name in names:
+            window.append((name, pool.submit(self._read_and_decode, source, name)))
+            if len(window) >= max_in_flight:
+                break
+        while window:
+            name, future = window.popleft()
+            next_name = next(names, None)
+            if next_name is not None:
+                window.append((next_name, pool.submit(self._read_and_decode, source, next_name)))
+            yield name, future.result()
+
+    @staticmethod
+    def _read_and_decode(source, name):
+        try:
+            with metrics.span('batch_decode'):
+                data = np.frombuffer(source.read(name), dtype=np.uint8)
+                return cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+        except (OSError, KeyError, zipfile.BadZipFile) as e:
+            print(f"Error al leer '{name}': {e}")
+            return None
+
+    def _output_stem(self, name):
+        """
+        Nombre de archivo único para una imagen de la fuente: legible (subcarpetas
+        con '__', extensión con '_') y con un hash corto del nombre completo,
+        así 'a.jpg' y 'a.png', o 'x/a.jpg' y 'x__a.jpg', no se pisan
+        """
+        readable = name.replace('/', '__').replace('\\', '__').replace('.', '_')
+        return f"{readable}_{hashlib.blake2b(name.encode('utf-8'), digest_size=4).hexdigest()}"
+
+    def _process_batch(self, batch):
+        """IA sobre el lote, escritura de imágenes y encolado de reportes"""
+        outputs = self.infer([frame for _, frame in batch], self.outputs)
+        for (name, _), (_, step_images, results_list) in zip(batch, outputs):
+            stem = self._output_stem(name)
+            writes = []
+            final_image_path_for_db = None
+            for step_name, img_data in step_images.items():
+                output_filename = f"{stem}_{step_name}.jpg"
+                writes.append(self.image_writer.submit(os.path.join(self.results_dir, output_filename), img_data))
+                if step_name == 'final_contours':
+                    final_image_path_for_db = f"{self.image_url_base}/{output_filename}"
+
+            reporte_dto = InspectionReportDTO.from_results(
+                results_list, imagen_resultado=final_image_path_for_db,
+                clave_origen=self.journal.report_key(name) if self.journal is not None else None)
+            if self.persistence is not None:
+                self.persistence.enqueue(reporte_dto)
+            self._add_entry({
+                'source': name,
+                'estado_final': reporte_dto.estado_final,
+                'total_pastillas': reporte_dto.total_pastillas,
+                'total_vacios': reporte_dto.total_vacios,
+                'imagen_resultado': final_image_path_for_db,
+            }, writes)
+
+        if self.progress is not None:
+            self.progress(self.stats())
+
+    def _add_entry(self, entry, writes):
+        failed = 'error' in entry
+        with self._lock:
+            if failed:
+                self._failed += 1
+            else:
+                self._processed += 1
+                if entry['estado_final'] != 'Aprobado':
+                    self._defective += 1
+            self._pending_entries.append(entry)
+            self._pending_writes.extend(writes)
+            checkpoint_due = len(self._pending_entries) >= self.checkpoint_every
+        BATCH_IMAGES.inc(result='error' if failed else entry['estado_final'])
+        if checkpoint_due:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        """Espera imágenes y reportes pendientes y los anota en el diario"""
+        with self._lock:
+            entries, self._pending_entries = self._pending_entries, []
+            writes, self._pending_writes = self._pending_writes, []
+        if not entries:
+            return
+        with metrics.span('batch_checkpoint'):
+            failed_writes = sum(1 for future in writes if not future.result())
+            if failed_writes:
+                print(f"Advertencia: {failed_writes} imágenes de resultado no se pudieron guardar")
+            if self.persistence is not None:
+                self.persistence.flush()
+            if self.journal is not None:
+                self.journal.record(entries)
+
+class BatchJob:
+    """Inspección por lotes en un hilo de fondo (para lanzarla desde la app web)"""
+
+    def __init__(self, job_id, runner, source_path):
+        self.job_id = job_id
+        self.runner = runner
+        self.source_path = source_path
+        self.error = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"batch-{self.job_id}")
+        self._thread.start()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def cancel(self):
+        self.runner.cancel()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def to_dict(self) -> dict:
+        data = {'job_id': self.job_id, **self.runner.stats()}
+        if self.error:
+            data['status'] = 'error'
+            data['error'] = self.error
+        return data
+
+    def _run(self):
+        try:
+            source = open_source(self.source_path)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            print(f"Error al abrir el lote '{self.job_id}': {e}")
+            self.error = str(e)
+            return
+        try:
+            self.runner.run(source)
+        except Exception as e:
+            print(f"Error en el lote '{self.job_id}': {e}")
+            self.error = str(e)
+        finally:
+            source.close()
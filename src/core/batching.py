@@ -0,0 +1,334 @@
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import CancelledError, Future, InvalidStateError, TimeoutError as FutureTimeoutError
+from functools import partial
+
+import numpy as np
+
+from . import metrics
+
+INFERENCE_REJECTED = metrics.counter('visionpharma_inference_rejected_total', "Peticiones rechazadas por cola de inferencia llena")
+INFERENCE_BATCH_SIZE = metrics.histogram('visionpharma_inference_batch_size', "Frames por lote de inferencia",
+                                         buckets=(1, 2, 4, 8, 16, 32, 64))
+INFERENCE_QUEUE_WAIT = metrics.histogram('visionpharma_inference_queue_wait_seconds',
+                                         "Tiempo que un frame espera en la cola antes de su lote")
+
+# Valor de 'outputs' para pedir solo las detecciones crudas (array N x 6), sin imágenes ni tabla
+DETECTIONS_ONLY = 'detecciones_crudas'
+
+class InferenceQueueFull(Exception):
+    """La cola de inferencia está llena (el llamador debe responder 503 o descartar el frame)"""
+
+class MicroBatcher:
+    """
+    Servidor de inferencia: agrupa los frames que llegan desde varios hilos
+    (peticiones de Flask, streams en vivo) en lotes para
+    CnnInspectionAgent.process_batch
+
+    Un único hilo de trabajo es el dueño del modelo: toma el primer frame
+    de la cola y espera como máximo 'max_wait_ms' a que lleguen más, hasta
+    'max_batch_size'. La cola es acotada: si está llena, submit lanza
+    InferenceQueueFull en lugar de acumular trabajo sin límite
+    """
+
+    def __init__(self, agent, max_batch_size=None, max_wait_ms=None, max_queue_size=0):
+        """
+        Args:
+            agent (CnnInspectionAgent): Agente que ejecuta la inferencia
+            max_batch_size (int): Tamaño máximo del lote (por defecto el del agente)
+            max_wait_ms (float): Espera máxima para completar un lote (por defecto la del agente)
+            max_queue_size (int): Peticiones pendientes permitidas (0 = sin límite)
+        """
+        self.agent = agent
+        self.max_batch_size = max(1, int(max_batch_size or agent.max_batch_size))
+        self.max_wait_ms = agent.max_wait_ms if max_wait_ms is None else max(0.0, float(max_wait_ms))
+        self.max_queue_size = max(0, int(max_queue_size))
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Estadísticas (protegidas por _stats_lock)
+        self._stats_lock = threading.Lock()
+        self._submitted = 0
+        self._rejected = 0
+        self._errors = 0
+        self._batches = 0
+        self._frames_processed = 0
+        self._last_batch_size = 0
+        self._batch_sizes = Counter()
+
+    def start(self):
+        """Inicia el hilo de inferencia (si no está corriendo)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._worker_loop, daemon=True)
+            self._thread.start()
+        print(f"Hilo de inferencia por lotes iniciado (lote máx. {self.max_batch_size}, "
+              f"espera máx. {self.max_wait_ms} ms, cola máx. {self.max_queue_size or 'sin límite'})")
+
+    def submit(self, frame: np.ndarray, outputs=None) -> Future:
+        """
+        Encola un frame y devuelve un Future con la tupla
+        (frame_final, step_images, formatted_results)
+
+        'outputs' indica qué imágenes de pasos generar (ver
+        CnnInspectionAgent.process_frame_step_by_step)
+
+        Lanza InferenceQueueFull si la cola está llena (nunca bloquea)
+        """
+        if self._thread is None:
+            self.start()
+        future = Future()
+        try:
+            self._queue.put_nowait((frame, outputs, future, time.perf_counter()))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            INFERENCE_REJECTED.inc()
+            raise InferenceQueueFull(f"Cola de inferencia llena ({self.max_queue_size} pendientes)")
+        with self._stats_lock:
+            self._submitted += 1
+        return future
+
+    def process(self, frame: np.ndarray, outputs=None, timeout=None) -> tuple[np.ndarray, dict, list]:
+        """Versión bloqueante de submit (misma firma de salida que process_frame_step_by_step)"""
+        return self.submit(frame, outputs).result(timeout=timeout)
+
+    def detect(self, frame: np.ndarray, timeout=None) -> np.ndarray:
+        """
+        Solo las detecciones (N, 6) del frame, en el mismo lote que el resto
+        de las peticiones (quien llama dibuja o reutiliza las cajas)
+
+        Si se agota 'timeout' el frame se cancela (si aún no entró a un lote)
+        """
+        return _result_or_cancel(self.submit(frame, DETECTIONS_ONLY), timeout)
+
+    def queue_depth(self) -> int:
+        """Peticiones esperando en la cola"""
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        """Profundidad de la cola y estadísticas de tamaño de lote"""
+        with self._stats_lock:
+            return {
+                'queue_depth': self.queue_depth(),
+                'max_queue_size': self.max_queue_size,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'requests_submitted': self._submitted,
+                'requests_rejected': self._rejected,
+                'errors': self._errors,
+                'batches': self._batches,
+                'frames_processed': self._frames_processed,
+                'avg_batch_size': round(self._frames_processed / self._batches, 2) if self._batches else 0.0,
+                'last_batch_size': self._last_batch_size,
+                'batch_size_histogram': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+            }
+
+    def stop(self):
+        """Detiene el hilo de inferencia tras procesar lo pendiente"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _collect_batch(self):
+        """
+        Bloquea hasta tener el primer elemento y luego junta más
+        hasta llenar el lote o agotar la ventana de espera
+        """
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Volver a encolar la señal de parada para salir después de este lote
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker_loop(self):
+        """Bucle del hilo de inferencia"""
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                break
+
+            # Descartar peticiones canceladas antes de gastar inferencia en ellas
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            if metrics.enabled():
+                now = time.perf_counter()
+                for _, _, _, enqueued in batch:
+                    INFERENCE_QUEUE_WAIT.observe(now - enqueued)
+                INFERENCE_BATCH_SIZE.observe(len(batch))
+
+            # Soltar los frames antes de avisar a quien espera: pueden ser vistas sobre
+            # memoria compartida que el dueño cierra o reescribe en cuanto recibe la respuesta
+            futures = [future for _, _, future, _ in batch]
+
+            try:
+                outputs = self._run_batch(batch)
+            except Exception as e:
+                print(f"Error en la inferencia por lotes: {e}")
+                with self._stats_lock:
+                    self._errors += 1
+                batch = None
+                e = e.with_traceback(None) # La traza también retiene los frames
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            batch = None
+
+            with self._stats_lock:
+                self._batches += 1
+                self._frames_processed += len(futures)
+                self._last_batch_size = len(futures)
+                self._batch_sizes[len(futures)] += 1
+
+            for future, output in zip(futures, outputs):
+                future.set_result(output)
+
+    def _run_batch(self, batch):
+        """Una sola detección para todo el lote; luego las salidas que pidió cada petición"""
+        frames = [frame for frame, _, _, _ in batch]
+        wanted_list = [wanted for _, wanted, _, _ in batch]
+        if DETECTIONS_ONLY not in wanted_list:
+            return self.agent.process_batch(frames, outputs_per_frame=wanted_list)
+        if self.agent.model is None:
+            # Sin modelo: ninguna detección (y las salidas vacías de process_batch para el resto)
+            return [np.zeros((0, 6), dtype=np.float32) if wanted == DETECTIONS_ONLY
+                    else self.agent.process_batch([frame], outputs=wanted)[0]
+                    for frame, wanted in zip(frames, wanted_list)]
+
+        with metrics.span('inference_predict_batch'):
+            detections_all = self.agent.detect(frames)
+        with metrics.span('inference_outputs_batch'):
+            return [detections if wanted == DETECTIONS_ONLY else self.agent.build_outputs(frame, detections, wanted)
+                    for frame, detections, wanted in zip(frames, detections_all, wanted_list)]
+
+class FairScheduler:
+    """
+    Reparte un MicroBatcher entre varias fuentes (cámaras) por turnos
+
+    Cada fuente tiene como máximo un frame esperando turno: si llega uno
+    nuevo antes de que el anterior entre al servidor, el viejo se descarta
+    (su Future lanza InferenceQueueFull). Al servidor se le entregan como
+    máximo 'max_in_flight' frames a la vez, tomando primero la fuente que
+    lleva más tiempo esperando; así una cámara rápida no llena la cola ni
+    deja sin inferencia a las demás
+    """
+
+    def __init__(self, batcher, max_in_flight=None):
+        """
+        Args:
+            batcher (MicroBatcher): Servidor de inferencia compartido
+            max_in_flight (int): Frames entregados al servidor a la vez (por defecto un lote completo)
+        """
+        self.batcher = batcher
+        self.max_in_flight = max(1, int(max_in_flight or batcher.max_batch_size))
+        self._lock = threading.Lock()
+        self._waiting = OrderedDict() # fuente -> (frame, future), en orden de llegada
+        self._in_flight = 0
+        self._dispatched = Counter()
+        self._superseded = Counter()
+
+    def submit(self, source_id, frame: np.ndarray) -> Future:
+        """Pide las detecciones (N, 6) del frame para 'source_id'; devuelve un Future"""
+        future = Future()
+        with self._lock:
+            previous = self._waiting.pop(source_id, None)
+            self._waiting[source_id] = (frame, future)
+            if previous is not None:
+                self._superseded[source_id] += 1
+        try:
+            if previous is not None:
+                _settle(previous[1], exception=InferenceQueueFull(f"Frame de '{source_id}' reemplazado por uno más nuevo"))
+        finally:
+            self._dispatch()
+        return future
+
+    def detect(self, source_id, frame: np.ndarray, timeout=None) -> np.ndarray:
+        """Versión bloqueante de submit (si se agota 'timeout' el frame deja de esperar turno)"""
+        return _result_or_cancel(self.submit(source_id, frame), timeout)
+
+    def backlog(self) -> int:
+        """Fuentes esperando turno (mayor que 0 = el servidor está saturado)"""
+        with self._lock:
+            return len(self._waiting)
+
+    def stats(self) -> dict:
+        """Frames entregados y reemplazados por fuente"""
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'waiting': len(self._waiting),
+                'dispatched': dict(self._dispatched),
+                'superseded': dict(self._superseded),
+            }
+
+    def _dispatch(self):
+        """Entrega frames al servidor mientras haya lugar, por turnos"""
+        while True:
+            with self._lock:
+                if not self._waiting or self._in_flight >= self.max_in_flight:
+                    return
+                source_id, (frame, future) = self._waiting.popitem(last=False)
+                if not future.set_running_or_notify_cancel():
+                    continue # Quien lo pidió lo canceló mientras esperaba turno
+                self._in_flight += 1
+                self._dispatched[source_id] += 1
+            try:
+                inner = self.batcher.submit(frame, DETECTIONS_ONLY)
+            except Exception as e:
+                with self._lock:
+                    self._in_flight -= 1
+                _settle(future, exception=e)
+                continue
+            inner.add_done_callback(partial(self._on_done, future))
+
+    def _on_done(self, future, inner):
+        """Copia el resultado del servidor al Future de la fuente y da el turno a la siguiente"""
+        with self._lock:
+            self._in_flight -= 1
+        try:
+            if inner.cancelled():
+                _settle(future, exception=CancelledError()) # Ya está en curso: cancel() no lo resolvería
+            elif inner.exception() is not None:
+                _settle(future, exception=inner.exception())
+            else:
+                _settle(future, result=inner.result())
+        finally:
+            self._dispatch()
+
+def _result_or_cancel(future, timeout):
+    """Resultado del Future; si no llega a tiempo se cancela antes de relanzar el TimeoutError"""
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+
+def _settle(future, result=None, exception=None):
+    """Resuelve un Future del llamador salvo que ya esté resuelto o cancelado"""
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
@@ -1,42 +1,231 @@
+import os
 import cv2
 import threading
 import time
+from . import metrics
+
+CAMERA_FRAMES = metrics.counter('visionpharma_camera_frames_total', "Frames leídos de la cámara", labelnames=('camera',))
+CAMERA_READ_ERRORS = metrics.counter('visionpharma_camera_read_errors_total', "Lecturas fallidas (reconexiones) de la cámara",
+                                     labelnames=('camera',))
+CAMERA_FRAME_INTERVAL = metrics.histogram('visionpharma_camera_frame_interval_seconds',
+                                          "Tiempo entre frames consecutivos de la cámara (1/FPS)", labelnames=('camera',),
+                                          buckets=(0.01, 0.02, 0.033, 0.05, 0.067, 0.1, 0.2, 0.5, 1.0, 2.0))
+CAMERA_FPS = metrics.gauge('visionpharma_camera_fps', "FPS de la cámara (media móvil)", labelnames=('camera',))
+CAMERA_DROPPED = metrics.counter('visionpharma_camera_frames_dropped_total',
+                                 "Frames viejos del buffer del driver descartados antes de publicar", labelnames=('camera',))
+CAMERA_CAPTURE_LATENCY = metrics.histogram('visionpharma_camera_capture_latency_seconds',
+                                           "Tiempo desde que el driver entrega el frame (grab) hasta publicarlo, con la decodificación",
+                                           labelnames=('camera',),
+                                           buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.25))
+CAMERA_RECONNECTS = metrics.counter('visionpharma_camera_reconnects_total', "Intentos de reconexión de la cámara",
+                                    labelnames=('camera',))
+
+class _RingSlot:
+    """Buffer preasignado del anillo de frames (con contador de préstamos)"""
+    __slots__ = ('buffer', 'leases')
+
+    def __init__(self):
+        self.buffer = None
+        self.leases = 0
+
+class FramePacket:
+    """
+    Frame publicado por CameraStream
+
+    'frame' es una vista de solo lectura del buffer del anillo (sin copia).
+    El buffer no se reutiliza mientras el paquete no se libere, por eso
+    hay que usarlo como context manager (o llamar a release())
+    """
+    __slots__ = ('seq', 'timestamp', 'frame', '_camera', '_slot')
+
+    def __init__(self, seq, timestamp, frame, camera, slot):
+        self.seq = seq # Número de secuencia (monótono creciente)
+        self.timestamp = timestamp # Momento de la captura (time.time())
+        self.frame = frame
+        self._camera = camera
+        self._slot = slot
+
+    def release(self):
+        """Devuelve el buffer al anillo"""
+        if self._slot is not None:
+            self._camera._release_slot(self._slot)
+            self._slot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
 
 class CameraStream:
     """
-    Clase Singleton para manejar la cámara en un hilo separado
-    
-    Esto para que Flask (que usa múltiples hilos) pueda 
-    acceder a la cámara sin conflictos
+    Maneja una cámara (o video) en un hilo separado
+
+    Esto para que Flask (que usa múltiples hilos) pueda
+    acceder a la cámara sin conflictos. Cada fuente es una instancia
+    independiente (ver CaptureManager para varias cámaras)
+
+    Cada frame se publica con un número de secuencia y su timestamp de
+    captura. La cámara escribe directamente en un anillo de buffers
+    preasignados, y los consumidores reciben vistas de solo lectura
+    (wait_for_frame) en lugar de una copia por llamada
     """
-    _instance = None
-    _lock = threading.Lock()
-    
-    def __new__(cls, camera_index=0):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super(CameraStream, cls).__new__(cls)
-                    cls._instance.cap = None
-                    cls._instance.camera_index = camera_index
-                    cls._instance.frame = None # Frame actual
-                    cls._instance.running = False # Control del hilo
-                    cls._instance.read_lock = threading.Lock() # Lock para acceder al frame
-        return cls._instance
+
+    # Un grab() que vuelve en menos de esto trae un frame que ya esperaba en el buffer del driver
+    STALE_GRAB_S = 0.002
+    # Máximo de frames viejos a descartar seguidos (los drivers V4L2/DirectShow guardan unos 4)
+    MAX_STALE_FRAMES = 8
+
+    def __init__(self, source=0, camera_id=None, ring_size=4, width=0, height=0, fps=0, fourcc='MJPG',
+                 buffer_size=1, reconnect_initial_s=0.5, reconnect_max_s=30.0):
+        """
+        Args:
+            source: Índice del dispositivo (int o '0'), archivo de video o URL (rtsp://, http://)
+            camera_id (str): Nombre de la cámara en rutas y métricas (por defecto la fuente)
+            ring_size (int): Buffers preasignados del anillo de frames
+            width, height (int): Resolución pedida al driver (0 = la del driver)
+            fps (float): FPS pedidos al driver (0 = los del driver)
+            fourcc (str): Códec de la cámara, p. ej. 'MJPG' (más FPS por USB que YUYV); '' = el del driver.
+                Solo para dispositivos locales: en RTSP/HTTP lo decide el stream
+            buffer_size (int): Frames que guarda el driver (1 = siempre el más reciente); 0 = el del driver
+            reconnect_initial_s (float): Espera antes del primer reintento de conexión
+            reconnect_max_s (float): Espera máxima entre reintentos (se duplica en cada fallo)
+        """
+        if isinstance(source, str) and source.strip().isdigit():
+            source = int(source)
+        self.source = source
+        self.camera_id = str(source) if camera_id is None else str(camera_id)
+        # Un archivo local se reproduce en bucle al ritmo de sus FPS (pruebas sin cámara)
+        self.is_file = isinstance(source, str) and os.path.isfile(source)
+        # Dispositivo local (índice): el único caso con buffer de driver que vaciar y códec que elegir
+        self.is_device = isinstance(source, int)
+        self.cap = None
+        self.running = False # Control del hilo
+        self.thread = None
+        self.read_lock = threading.Lock() # Lock para acceder al frame
+        self.frame_ready = threading.Condition(self.read_lock) # Aviso de frame nuevo
+        self._ring = [_RingSlot() for _ in range(max(2, ring_size))]
+        self._latest = None # Slot con el último frame publicado
+        self.frame_seq = 0 # Secuencia del último frame publicado
+        self.frame_timestamp = None # Timestamp del último frame publicado
+        self._fps = None # FPS medidos (media móvil, solo para métricas)
+        self._file_period = 0.0 # Segundos entre frames al reproducir un archivo
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = float(fps)
+        self.fourcc = fourcc or ''
+        self.buffer_size = int(buffer_size)
+        self.reconnect_initial_s = reconnect_initial_s
+        self.reconnect_max_s = max(reconnect_initial_s, reconnect_max_s)
+        self._reconnect_delay = reconnect_initial_s
+        self._stop_event = threading.Event() # Interrumpe la espera entre reconexiones
+        self.frames_dropped = 0 # Frames viejos descartados del buffer del driver
+        self.reconnects = 0
+        self.capture_latency = None # Segundos desde grab() hasta publicar el último frame
 
     def _initialize_camera(self):
         """Intentar la conexión de la cámara"""
         try:
-            self.cap = cv2.VideoCapture(self.camera_index)
+            self.cap = cv2.VideoCapture(self.source)
             if not self.cap.isOpened():
-                print(f"Error: No se pudo abrir la cámara en el índice {self.camera_index}")
+                print(f"Error: No se pudo abrir la cámara '{self.camera_id}' ({self.source})")
                 self.cap = None
             else:
-                print(f"Cámara en índice {self.camera_index} abierta exitosamente")
-                self.running = True
+                print(f"Cámara '{self.camera_id}' ({self.source}) abierta exitosamente")
+                if self.is_file:
+                    self._file_period = 1.0 / (self.cap.get(cv2.CAP_PROP_FPS) or 30.0)
+                else:
+                    self._configure_capture()
         except Exception as e:
-            print(f"Excepción al abrir la cámara: {e}")
+            print(f"Excepción al abrir la cámara '{self.camera_id}': {e}")
+            self.cap = None
+
+    def _configure_capture(self):
+        """
+        Pide al driver códec, resolución, FPS y tamaño de buffer
+        (el códec va primero: algunos drivers solo ofrecen ciertas resoluciones con MJPG)
+
+        El códec solo se fuerza en dispositivos locales; en un stream de red
+        pedirlo no sirve y con algunos backends rompe la decodificación
+        """
+        if self.fourcc and self.is_device:
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc[:4].ljust(4)))
+        if self.width and self.height:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.fps:
+            self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+        if self.buffer_size:
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+
+        # El driver puede ignorar lo pedido: informar lo que realmente entrega
+        code = int(self.cap.get(cv2.CAP_PROP_FOURCC))
+        fourcc = ''.join(chr((code >> 8 * i) & 0xFF) for i in range(4)).strip('\x00') or '?'
+        print(f"Cámara '{self.camera_id}': {int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x"
+              f"{int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))} a {self.cap.get(cv2.CAP_PROP_FPS):.0f} FPS, "
+              f"códec {fourcc}")
+
+    def _grab_latest(self):
+        """
+        grab() del próximo frame, descartando los que ya estaban en el buffer
+        del driver (llegan al instante) para no publicar imágenes atrasadas
+
+        Solo en dispositivos locales: en RTSP/HTTP un grab() rápido no indica
+        un frame viejo (el backend de red ya entrega por ráfagas) y descartarlo
+        solo perdería imágenes
+
+        Devuelve (ok, momento del grab del frame que se publicará)
+        """
+        start = time.monotonic()
+        ok = self.cap.grab()
+        grabbed = time.monotonic()
+        if not self.is_device:
+            return ok, grabbed
+        stale = 0
+        while ok and grabbed - start < self.STALE_GRAB_S and stale < self.MAX_STALE_FRAMES:
+            stale += 1
+            start = grabbed
+            ok = self.cap.grab()
+            grabbed = time.monotonic()
+        if stale:
+            self.frames_dropped += stale
+            CAMERA_DROPPED.inc(stale, camera=self.camera_id)
+        return ok, grabbed
+
+    def _reconnect(self):
+        """Cierra y vuelve a abrir la cámara, esperando cada vez el doble (hasta reconnect_max_s)"""
+        if self.cap is not None:
+            self.cap.release()
             self.cap = None
+        print(f"Reintentando conectar la cámara '{self.camera_id}' en {self._reconnect_delay:.1f} s...")
+        if self._stop_event.wait(self._reconnect_delay):
+            return # Se detuvo la cámara durante la espera
+        self.reconnects += 1
+        CAMERA_RECONNECTS.inc(camera=self.camera_id)
+        self._initialize_camera()
+        if self.cap is None:
+            self._reconnect_delay = min(self._reconnect_delay * 2, self.reconnect_max_s)
+        else:
+            self._reconnect_delay = self.reconnect_initial_s
+
+    def _acquire_write_slot(self):
+        """
+        Elige el buffer donde se escribirá el próximo frame:
+        nunca el último publicado ni uno prestado a un consumidor
+        (Llamar con read_lock tomado)
+        """
+        for slot in self._ring:
+            if slot is not self._latest and slot.leases == 0:
+                return slot
+        # Todos prestados: se amplía el anillo (solo pasa con consumidores muy lentos)
+        slot = _RingSlot()
+        self._ring.append(slot)
+        print(f"Anillo de frames ampliado a {len(self._ring)} buffers")
+        return slot
+
+    def _release_slot(self, slot):
+        with self.read_lock:
+            slot.leases -= 1
 
     def _read_loop(self):
         """
@@ -44,65 +233,148 @@ class CameraStream:
         Su trabajo es leer fotogramas de la cámara
         """
         while self.running:
-            if self.cap:
-                ret, frame = self.cap.read()
-                if ret:
-                    # Guardar el frame de forma segura (thread-safe)
-                    with self.read_lock:
-                        self.frame = frame
-                else:
-                    # Si falla la lectura, intenta reconectar
-                    print("Error leyendo frame, intentando reconectar cámara...")
-                    self.cap.release()
-                    time.sleep(1)
-                    self._initialize_camera()
+            if self.cap is None:
+                self._reconnect()
+                continue
+
+            # grab() espera el frame (y descarta los viejos); retrieve() lo decodifica
+            ok, grabbed = self._grab_latest()
+            if not ok and self.is_file and self.frame_seq:
+                # Fin del video: volver al principio
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                continue
+            if ok:
+                with self.read_lock:
+                    slot = self._acquire_write_slot()
+                # Decodificar directamente en el buffer preasignado (sin asignar memoria)
+                with metrics.span('camera_read'):
+                    ok, frame = self.cap.retrieve(slot.buffer)
+            if ok:
+                if self.is_file:
+                    self._pace_file()
+                # Publicar el frame de forma segura (thread-safe)
+                with self.frame_ready:
+                    previous_timestamp = self.frame_timestamp
+                    slot.buffer = frame
+                    self._latest = slot
+                    self.frame_seq += 1
+                    self.frame_timestamp = time.time()
+                    self.frame_ready.notify_all()
+                if not self.is_file:
+                    self.capture_latency = time.monotonic() - grabbed
+                self._record_frame(previous_timestamp)
             else:
-                time.sleep(1)
+                # Si falla la lectura, intenta reconectar
+                print(f"Error leyendo frame de la cámara '{self.camera_id}'")
+                CAMERA_READ_ERRORS.inc(camera=self.camera_id)
+                self._reconnect()
+
+    def _pace_file(self):
+        """Espera hasta el momento del próximo frame del archivo (como una cámara real)"""
+        if self.frame_timestamp is not None:
+            delay = self.frame_timestamp + self._file_period - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _record_frame(self, previous_timestamp):
+        """Actualiza las métricas de FPS con el frame recién publicado"""
+        if not metrics.enabled():
+            return
+        CAMERA_FRAMES.inc(camera=self.camera_id)
+        if self.capture_latency is not None:
+            CAMERA_CAPTURE_LATENCY.observe(self.capture_latency, camera=self.camera_id)
+        if previous_timestamp is not None:
+            interval = self.frame_timestamp - previous_timestamp
+            if interval > 0:
+                CAMERA_FRAME_INTERVAL.observe(interval, camera=self.camera_id)
+                self._fps = 1.0 / interval if self._fps is None else 0.9 * self._fps + 0.1 / interval
+                CAMERA_FPS.set(self._fps, camera=self.camera_id)
 
     def start(self):
         """
         Inicia el hilo de lectura de la cámara
         """
         if self.running:
-            print("El hilo de la cámara ya está corriendo")
+            print(f"El hilo de la cámara '{self.camera_id}' ya está corriendo")
             return
 
         if self.cap is None:
             self._initialize_camera()
             if self.cap is None:
-                return # No pudo iniciar
+                print(f"La cámara '{self.camera_id}' se seguirá intentando en segundo plano")
 
-        # Crear e iniciar el hilo daemon
+        # Crear e iniciar el hilo daemon (si la cámara no abrió, reintenta con espera creciente)
+        self.running = True
+        self._stop_event.clear()
         self.thread = threading.Thread(target=self._read_loop, daemon=True)
         self.thread.start()
-        print("Hilo de lectura de cámara iniciado")
+        print(f"Hilo de lectura de la cámara '{self.camera_id}' iniciado")
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        """
+        Bloquea hasta que haya un frame con secuencia mayor que 'after_seq'
+
+        Devuelve un FramePacket con una vista de solo lectura del frame
+        (sin copia), o None si se agotó el tiempo o la cámara se detuvo.
+        El paquete debe liberarse (usarlo con 'with') al terminar
+        """
+        with self.frame_ready:
+            self.frame_ready.wait_for(lambda: self.frame_seq > after_seq or not self.running, timeout=timeout)
+            if self.frame_seq <= after_seq or self._latest is None:
+                return None
+            slot = self._latest
+            slot.leases += 1
+            view = slot.buffer.view()
+            view.flags.writeable = False
+            return FramePacket(self.frame_seq, self.frame_timestamp, view, self, slot)
 
     def get_frame(self):
         """
         Esta función ya no lee de la cámara
         Simplemente copia el último frame que el hilo guardó
         (Es rápido y seguro para Flask)
+
+        Para evitar la copia usar wait_for_frame
         """
         frame_copy = None
         with self.read_lock:
-            if self.frame is not None:
-                frame_copy = self.frame.copy()
+            if self._latest is not None:
+                frame_copy = self._latest.buffer.copy()
         return frame_copy
 
     def stop(self):
         """
         Detiene el hilo y libera la cámara
         """
-        print("Deteniendo hilo de cámara...")
-        self.running = False
+        if self.thread is None and self.cap is None:
+            return # Ya detenida
+        print(f"Deteniendo hilo de la cámara '{self.camera_id}'...")
+        with self.frame_ready:
+            self.running = False
+            self.frame_ready.notify_all() # Despertar a los consumidores en espera
+        self._stop_event.set()
         if self.thread:
             self.thread.join()
-        
+            self.thread = None
+
         if self.cap:
             print("Liberando recurso de la cámara...")
             self.cap.release()
             self.cap = None
 
+    def stats(self) -> dict:
+        """Estado de la captura: FPS, frames publicados y descartados, latencia y reconexiones"""
+        return {
+            'source': str(self.source),
+            'running': self.running,
+            'connected': self.cap is not None,
+            'frames': self.frame_seq,
+            'fps': round(self._fps, 1) if self._fps else None,
+            'frames_dropped': self.frames_dropped,
+            'capture_latency_ms': round(self.capture_latency * 1000, 2) if self.capture_latency is not None else None,
+            'reconnects': self.reconnects,
+        }
+
     def __del__(self):
         """Asegurarse de liberar la cámara"""
-        self.stop()
\ No newline at end of file
+        self.stop()
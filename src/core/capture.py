@@ -0,0 +1,72 @@
+"""
+Varias cámaras en un mismo proceso
+
+Cada fuente (índice de dispositivo, archivo de video o URL rtsp:// / http://)
+es un CameraStream con su propio hilo de lectura y su anillo de buffers.
+La inferencia de todas las cámaras pasa por un único MicroBatcher
+(ver batching.FairScheduler para el reparto por turnos)
+"""
+import re
+
+from .camera import CameraStream
+
+_CAMERA_ID = re.compile(r'^[A-Za-z_][\w-]*$')
+
+def parse_camera_sources(value) -> dict:
+    """
+    Convierte 'linea1=0,linea2=rtsp://host/stream,prueba=video.mp4' en
+    {'linea1': 0, 'linea2': 'rtsp://host/stream', 'prueba': 'video.mp4'}
+
+    Las fuentes sin nombre se llaman por su posición: '0,1' -> {'cam0': 0, 'cam1': 1}
+    """
+    sources = {}
+    for position, item in enumerate(p.strip() for p in value.split(',')):
+        if not item:
+            continue
+        name, sep, source = item.partition('=')
+        if not sep or not _CAMERA_ID.match(name.strip()):
+            # Sin nombre (o el '=' es parte de la URL)
+            name, source = f"cam{position}", item
+        name, source = name.strip(), source.strip()
+        if name in sources:
+            raise ValueError(f"Cámara repetida: '{name}'")
+        sources[name] = int(source) if source.isdigit() else source
+    return sources
+
+class CaptureManager:
+    """Abre, inicia y detiene un CameraStream por fuente"""
+
+    def __init__(self, sources, ring_size=4, **camera_options):
+        """
+        Args:
+            sources (dict): {id_cámara: fuente} (ver parse_camera_sources)
+            ring_size (int): Buffers del anillo de cada cámara
+            camera_options: Ajustes de captura comunes (width, height, fps, fourcc,
+                buffer_size, reconnect_max_s; ver CameraStream)
+        """
+        if not sources:
+            raise ValueError("No hay cámaras configuradas")
+        self.cameras = {camera_id: CameraStream(source, camera_id=camera_id, ring_size=ring_size, **camera_options)
+                        for camera_id, source in sources.items()}
+
+    def start(self):
+        """Inicia el hilo de lectura de cada cámara (las que no abren se reintentan en segundo plano)"""
+        for camera in self.cameras.values():
+            camera.start()
+
+    def stop(self):
+        """Detiene todas las cámaras"""
+        for camera in self.cameras.values():
+            camera.stop()
+
+    def get(self, camera_id):
+        """CameraStream con ese id, o None"""
+        return self.cameras.get(camera_id)
+
+    def ids(self) -> list:
+        """Ids de las cámaras en el orden de configuración"""
+        return list(self.cameras)
+
+    def stats(self) -> dict:
+        """Estado de cada cámara"""
+        return {camera_id: camera.stats() for camera_id, camera in self.cameras.items()}
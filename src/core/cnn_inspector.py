@@ -1,91 +1,312 @@
+import hashlib
+import os
+import time
 import cv2
 import numpy as np
-from ultralytics import YOLO
+from . import metrics
+from .inference_backends import create_backend
+from .rendering import get_renderer, resolve_renderer
+from .tiling import TilePlanner
 
 class CnnInspectionAgent:
     """
     Agente de inspección que utiliza un modelo YOLOv8 entrenado (best.pt)
     para la detección de objetos (pastillas y cavidades vacías)
     """
-    
-    def __init__(self, model_path='best.pt'):
+
+    # Confianza mínima para aceptar una detección
+    CONFIDENCE = 0.5
+
+    # Imágenes de pasos que puede generar el pipeline (en orden de visualización)
+    STEP_IMAGES = ('original', 'grayscale', 'thresholded', 'final_contours')
+    # Imágenes que necesitan el frame con los recuadros dibujados
+    PLOTTED_IMAGES = frozenset({'thresholded', 'final_contours'})
+    # Presets de salida: solo detecciones, solo la imagen final o el set completo de depuración
+    OUTPUT_PRESETS = {
+        'detections': frozenset(),
+        'final': frozenset({'final_contours'}),
+        'debug': frozenset(STEP_IMAGES),
+    }
+
+    def __init__(self, model_path='best.pt', max_batch_size=8, max_wait_ms=5.0,
+                 backend='auto', intra_op_threads=0, providers=None, renderer='ultralytics',
+                 imgsz=0, roi=None, tile_size=0, tile_overlap=0.2):
         """
         Carga el modelo YOLOv8 al instanciar el agente
-        
+
         Args:
-            model_path (str): Ruta al archivo .pt (el cerebro de IA)
+            model_path (str): Ruta al archivo .pt o .onnx (el cerebro de IA)
+            max_batch_size (int): Máximo de frames por llamada a predict en process_batch
+            max_wait_ms (float): Tiempo máximo que un lote espera a completarse
+                (lo usa MicroBatcher para cambiar latencia por rendimiento)
+            backend (str): 'pytorch', 'onnx', 'auto' (según la extensión del modelo) o un objeto backend
+            intra_op_threads (int): Hilos por operador de ONNX Runtime (0 = automático)
+            providers (list[str]): Execution providers de ONNX Runtime (p. ej. OpenVINO)
+            renderer (str): 'ultralytics' (mismo aspecto que plot()) u 'opencv' (más liviano)
+            imgsz (int): Lado de la entrada del modelo (0 = el del modelo)
+            roi: Zona 'x,y,ancho,alto' a inspeccionar (la bandeja del blíster); None = frame completo
+            tile_size (int): Dividir la zona en teselas de este lado (0 = sin teselas)
+            tile_overlap (float): Solape entre teselas, como fracción del lado
         """
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.renderer = resolve_renderer(renderer) # El que se usa de verdad (entra en la huella)
+        self._draw = get_renderer(self.renderer)
+        self.tiles = TilePlanner(roi=roi, tile_size=tile_size, overlap=tile_overlap)
+        self.imgsz = imgsz
+        self._model_digest = None
         try:
-            self.model = YOLO(model_path)
+            self.model = create_backend(model_path, backend=backend, intra_op_threads=intra_op_threads,
+                                        providers=providers, imgsz=imgsz)
             # Obtiene los nombres de las clases del modelo ('pastilla', 'vacio')
             self.class_names = self.model.names
-            print(f"Modelo '{model_path}' cargado exitosamente.")
+            self._build_status_table()
+            # (un backend remoto trae la huella del archivo que cargó el servidor)
+            self._model_digest = getattr(self.model, 'digest', None) or self._file_digest(model_path) or self.model.name
+            print(f"Modelo '{model_path}' cargado exitosamente (backend {self.model.name}).")
             print(f"Clases detectadas: {self.class_names}")
         except Exception as e:
-            print(f"Error fatal al cargar el modelo YOLO '{model_path}': {e}")
+            print(f"Error fatal al cargar el modelo '{model_path}': {e}")
             self.model = None
 
-    def process_frame_step_by_step(self, frame_original: np.ndarray) -> tuple[np.ndarray, dict, list]:
+    def process_frame_step_by_step(self, frame_original: np.ndarray, outputs=None) -> tuple[np.ndarray, dict, list]:
         """
         Ejecuta el pipeline de inferencia de IA en un solo frame.
+
+        Args:
+            frame_original (np.ndarray): Frame BGR
+            outputs: Imágenes de pasos a generar. Un preset ('detections', 'final',
+                'debug') o una lista de nombres de STEP_IMAGES. Por defecto 'debug'
+                (las cuatro). Lo que no se pide nunca se calcula
         """
+        wanted = self.resolve_outputs(outputs)
         if self.model is None:
             print("Error: El modelo no está cargado. No se puede procesar el frame")
-            # Devolver imágenes vacías para evitar que la app web se rompa
-            h, w = frame_original.shape[:2]
-            dummy_img = np.zeros((h, w, 3), dtype=np.uint8)
-            return dummy_img, {'original': dummy_img, 'grayscale': dummy_img, 'thresholded': dummy_img, 'final_contours': dummy_img}, []
+            return self._empty_output(frame_original, wanted)
 
-        step_images = {'original': frame_original.copy()}
-        
         # 1. Predicción
-        
-        # La IA ejecuta la detección en el frame original
-        results = self.model.predict(frame_original, conf=0.5) # Confianza mínima del 50%
-        
-        frame_final = frame_original.copy()
-        formatted_results = []
-        
+
+        # La IA ejecuta la detección en el frame original (o en su ROI / teselas)
+        with metrics.span('inference_predict'):
+            if self.tiles.active:
+                results = self.detect([frame_original])
+            else:
+                results = self.model.predict(frame_original, conf=self.CONFIDENCE)
+
         if not results:
             print("No se encontraron resultados en la predicción")
-            return frame_final, step_images, formatted_results
-
-        # 2. Procesar y Dibujar Resultados
-        for r in results:
-            boxes = r.boxes
-            
-            # Dibujar los recuadros en la imagen
-            # (Se usa la función 'plot' de ultralytics para mayor velocidad)
-            frame_final = r.plot(show=False) # 'show=False' devuelve la imagen
-
-            # 3. Formatear para la Tabla de Reportes
-            for box in boxes:
-                # Obtener coordenadas, confianza y ID de clase
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                conf = float(box.conf[0])
-                cls_id = int(box.cls[0])
-                class_name = self.class_names.get(cls_id, 'Desconocido') # Obtener nombre de la clase
-                
-                # Formatear los datos para la tabla del frontend
-                # Nota: 'confianza' en el lugar de 'circularidad'
-                formatted_results.append({
-                    'id': len(formatted_results) + 1,
-                    'area': int((x2 - x1) * (y2 - y1)), # Área del recuadro
-                    'circularity': round(conf, 2), # Mostrar confianza en esta columna
-                    'status': class_name.capitalize() # 'Pastilla' o 'Vacio'
-                })
-
-        # 4. Preparar Imágenes de Pasos
+            step_images = {'original': frame_original.copy()} if 'original' in wanted else {}
+            return frame_original, step_images, []
+
+        with metrics.span('inference_outputs'):
+            return self._build_outputs(frame_original, results[0], wanted)
+
+    def detect(self, frames: list[np.ndarray]) -> list[np.ndarray]:
+        """
+        Solo detección, en lotes de 'max_batch_size'
+
+        Devuelve un array (N, 6) por frame: x1, y1, x2, y2, confianza, clase
+
+        Con ROI o teselas, las regiones de todos los frames se agrupan en los
+        mismos lotes y sus detecciones se fusionan por frame
+        """
+        if not self.tiles.active:
+            return self._predict_chunks(frames)
+
+        regions_per_frame = [self.tiles.regions(frame) for frame in frames]
+        raw = self._predict_chunks([region for regions in regions_per_frame for region, _, _ in regions])
+        detections = []
+        start = 0
+        for regions in regions_per_frame:
+            end = start + len(regions)
+            detections.append(self.tiles.merge(raw[start:end], [(dx, dy) for _, dx, dy in regions]))
+            start = end
+        return detections
+
+    def warmup(self) -> float:
+        """
+        Inferencias sobre frames vacíos (uno solo y un lote completo) y un dibujo
+        de todas las imágenes de pasos, para que la primera petición real no pague
+        la inicialización del backend ni la de OpenCV. Devuelve los segundos que tardó
+        """
+        if self.model is None:
+            return 0.0
+        side = self.imgsz or 640
+        frame = np.zeros((side, side, 3), dtype=np.uint8)
+        # Una caja de ejemplo: un frame vacío no tiene detecciones y no se dibujaría nada
+        sample = np.array([[side * 0.25, side * 0.25, side * 0.75, side * 0.75, 0.9, next(iter(self.class_names), 0)]],
+                          dtype=np.float32)
+        start = time.perf_counter()
+        with metrics.span('inference_warmup'):
+            for size in sorted({1, self.max_batch_size}):
+                self.detect([frame] * size)
+            self.build_outputs(frame, sample, outputs='debug')
+        return time.perf_counter() - start
+
+    def _predict_chunks(self, images: list[np.ndarray]) -> list[np.ndarray]:
+        """Llama a predict en lotes de 'max_batch_size'"""
+        detections = []
+        for start in range(0, len(images), self.max_batch_size):
+            chunk = images[start:start + self.max_batch_size]
+            detections.extend(self.model.predict(chunk, conf=self.CONFIDENCE, verbose=False))
+        return detections
+
+    @property
+    def model_digest(self):
+        """Identificador del modelo cargado (hash del archivo o del backend; None sin modelo)"""
+        return self._model_digest
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Huella del modelo cargado y de los ajustes que cambian las detecciones
+        o su dibujo (la usa la caché de resultados: si cambia, nada se reutiliza)
+        """
+        settings = (self._model_digest, self.CONFIDENCE, self.imgsz, self.tiles.roi,
+                    self.tiles.tile_size, self.tiles.overlap, self.renderer)
+        return hashlib.sha256(repr(settings).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _file_digest(path):
+        """SHA-256 del archivo del modelo (None si no es un archivo)"""
+        if not isinstance(path, str) or not os.path.isfile(path):
+            return None
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def render(self, frame: np.ndarray, detections: np.ndarray) -> np.ndarray:
+        """Dibuja las detecciones sobre una copia del frame con el renderer configurado"""
+        if len(detections) == 0:
+            return frame.copy() # Nada que dibujar (también sin modelo cargado)
+        return self._draw(frame, detections, self.class_names)
+
+    def format_results(self, detections: np.ndarray) -> list:
+        """
+        Convierte las detecciones (N, 6) en la lista para la tabla del frontend,
+        calculando áreas, confianzas y estados sobre arrays completos
+        """
+        if len(detections) == 0:
+            return []
+
+        # Coordenadas truncadas a enteros (igual que int() sobre cada valor)
+        xyxy = detections[:, :4].astype(np.int64)
+        areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1]) # Área del recuadro
+        confs = np.round(detections[:, 4].astype(np.float64), 2)
+        cls_ids = detections[:, 5].astype(np.int64)
+        known = (cls_ids >= 0) & (cls_ids < len(self._status_table) - 1)
+        statuses = self._status_table[np.where(known, cls_ids, -1)] # -1 -> 'Desconocido'
+
+        # Ordenar por estado (orden estable: mismos IDs que el orden de detección)
+        order = np.argsort(statuses, kind='stable')
+
+        # Nota: 'confianza' en el lugar de 'circularidad'
+        return [
+            {'id': i + 1, 'area': area, 'circularity': conf, 'status': status}
+            for i, area, conf, status in zip(order.tolist(), areas[order].tolist(),
+                                             confs[order].tolist(), statuses[order].tolist())
+        ]
+
+    def _build_status_table(self):
+        """Tabla id de clase -> estado ('Pastilla', 'Vacio'); la última entrada es 'Desconocido'"""
+        size = max(self.class_names) + 1 if self.class_names else 0
+        table = ['Desconocido'] * (size + 1)
+        for cls_id, class_name in self.class_names.items():
+            table[cls_id] = class_name.capitalize()
+        self._status_table = np.array(table, dtype=object)
+
+    def process_batch(self, frames: list[np.ndarray], outputs=None, outputs_per_frame=None) -> list[tuple[np.ndarray, dict, list]]:
+        """
+        Ejecuta el pipeline sobre varios frames con una sola llamada a predict
+        por lote (ultralytics hace el letterbox de los N frames en un solo tensor)
+
+        Los frames se agrupan en lotes de como máximo 'max_batch_size'.
+        Devuelve, para cada frame y en el mismo orden, la misma tupla
+        (frame_final, step_images, formatted_results) que process_frame_step_by_step
+
+        'outputs' se aplica a todos los frames; 'outputs_per_frame' (una entrada
+        por frame) permite que cada frame pida imágenes distintas
+        """
+        if not frames:
+            return []
+
+        if outputs_per_frame is None:
+            wanted_list = [self.resolve_outputs(outputs)] * len(frames)
+        else:
+            wanted_list = [self.resolve_outputs(o) for o in outputs_per_frame]
+
+        if self.model is None:
+            print("Error: El modelo no está cargado. No se puede procesar el lote")
+            return [self._empty_output(frame, wanted) for frame, wanted in zip(frames, wanted_list)]
+
+        with metrics.span('inference_predict_batch'):
+            detections_all = self.detect(frames)
+        with metrics.span('inference_outputs_batch'):
+            return [self._build_outputs(frame, detections, wanted)
+                    for frame, detections, wanted in zip(frames, detections_all, wanted_list)]
+
+    def build_outputs(self, frame_original: np.ndarray, detections: np.ndarray, outputs=None) -> tuple[np.ndarray, dict, list]:
+        """
+        Misma salida que process_frame_step_by_step a partir de detecciones ya calculadas
+        (para quien ejecuta detect() por su cuenta, p. ej. MicroBatcher)
+        """
+        return self._build_outputs(frame_original, detections, self.resolve_outputs(outputs))
+
+    @classmethod
+    def resolve_outputs(cls, outputs=None) -> frozenset:
+        """Convierte un preset o lista de nombres en el conjunto de imágenes a generar"""
+        if outputs is None:
+            return cls.OUTPUT_PRESETS['debug']
+        if isinstance(outputs, str):
+            if outputs in cls.OUTPUT_PRESETS:
+                return cls.OUTPUT_PRESETS[outputs]
+            outputs = (outputs,)
+        wanted = frozenset(outputs)
+        unknown = wanted - frozenset(cls.STEP_IMAGES)
+        if unknown:
+            raise ValueError(f"Imágenes de pasos desconocidas: {sorted(unknown)}")
+        return wanted
+
+    def _empty_output(self, frame_original: np.ndarray, wanted=None) -> tuple[np.ndarray, dict, list]:
+        """Devolver imágenes vacías para evitar que la app web se rompa"""
+        wanted = self.OUTPUT_PRESETS['debug'] if wanted is None else wanted
+        h, w = frame_original.shape[:2]
+        dummy_img = np.zeros((h, w, 3), dtype=np.uint8)
+        return dummy_img, {name: dummy_img for name in self.STEP_IMAGES if name in wanted}, []
+
+    def _build_outputs(self, frame_original: np.ndarray, detections: np.ndarray, wanted) -> tuple[np.ndarray, dict, list]:
+        """
+        Convierte las detecciones de un frame en la imagen final,
+        las imágenes de pasos pedidas ('wanted') y la lista de resultados para la tabla
+
+        Si no se pide ninguna imagen dibujada, no se dibuja nada y
+        'frame_final' es el propio frame original (sin anotar)
+        """
+        step_images = {}
+        if 'original' in wanted:
+            step_images['original'] = frame_original.copy()
+
+        # 2. Dibujar Resultados (solo si alguna salida lo necesita)
+        if wanted & self.PLOTTED_IMAGES:
+            frame_final = self.render(frame_original, detections)
+        else:
+            frame_final = frame_original
+
+        # 3. Formatear para la Tabla de Reportes (ya ordenada por estado)
+        formatted_results = self.format_results(detections)
+
+        # 4. Preparar Imágenes de Pasos (solo las pedidas)
         # El HTML espera 'grayscale' y 'thresholded'
-        step_images['grayscale'] = cv2.cvtColor(frame_original, cv2.COLOR_BGR2GRAY)
-        
+        if 'grayscale' in wanted:
+            step_images['grayscale'] = cv2.cvtColor(frame_original, cv2.COLOR_BGR2GRAY)
+
         # Se usa la imagen con los recuadros dibujados como "thresholded"
-        step_images['thresholded'] = cv2.cvtColor(frame_final, cv2.COLOR_BGR2GRAY)
-        
-        step_images['final_contours'] = frame_final # La imagen final con colores
+        if 'thresholded' in wanted:
+            step_images['thresholded'] = cv2.cvtColor(frame_final, cv2.COLOR_BGR2GRAY)
 
-        # Ordenar por estado para que se vea bien en la tabla
-        formatted_results.sort(key=lambda x: x['status'])
-        
-        return frame_final, step_images, formatted_results
+        if 'final_contours' in wanted:
+            step_images['final_contours'] = frame_final # La imagen final con colores
 
+        return frame_final, step_images, formatted_results
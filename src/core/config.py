@@ -0,0 +1,125 @@
+"""
+Configuración de VisionPharma leída de variables de entorno
+
+Cada valor tiene un valor por defecto pensado para un PC de línea,
+así las apps funcionan sin configurar nada
+"""
+import os
+
+def env_str(name, default):
+    """Lee una variable de entorno de texto"""
+    return os.environ.get(name, default)
+
+def env_int(name, default):
+    """Lee una variable de entorno entera (usa el valor por defecto si no es válida)"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        print(f"Valor inválido para {name}, usando {default}")
+        return default
+
+def env_float(name, default):
+    """Lee una variable de entorno decimal (usa el valor por defecto si no es válida)"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        print(f"Valor inválido para {name}, usando {default}")
+        return default
+
+def env_bool(name, default):
+    """Lee una variable de entorno booleana ('1', 'true', 'si', 'yes', 'on')"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'si', 'sí', 'yes', 'on')
+
+# Modelo de IA
+MODEL_PATH = env_str('VISIONPHARMA_MODEL', 'best.pt')
+# 'pytorch', 'onnx' o 'auto' (según la extensión del modelo)
+INFERENCE_BACKEND = env_str('VISIONPHARMA_BACKEND', 'auto')
+# Hilos por operador de ONNX Runtime (0 = automático)
+INTRA_OP_THREADS = env_int('VISIONPHARMA_INTRA_OP_THREADS', 0)
+# Execution providers de ONNX Runtime separados por coma (p. ej. OpenVINOExecutionProvider)
+ONNX_PROVIDERS = [p.strip() for p in env_str('VISIONPHARMA_ONNX_PROVIDERS', '').split(',') if p.strip()]
+# Dibujo de detecciones: 'ultralytics' (igual que plot()) u 'opencv' (más liviano). Por defecto
+# 'opencv' con el backend ONNX (el Annotator de ultralytics importaría torch solo para dibujar)
+_ONNX_MODEL = INFERENCE_BACKEND == 'onnx' or (INFERENCE_BACKEND == 'auto' and MODEL_PATH.lower().endswith('.onnx'))
+RENDERER = env_str('VISIONPHARMA_RENDERER', 'opencv' if _ONNX_MODEL else 'ultralytics')
+# Lado de la entrada del modelo en píxeles (0 = el del entrenamiento)
+INFERENCE_IMGSZ = env_int('VISIONPHARMA_IMGSZ', 0)
+# Zona a inspeccionar 'x,y,ancho,alto' en píxeles (vacío = frame completo)
+INFERENCE_ROI = env_str('VISIONPHARMA_ROI', '')
+# Teselas para imágenes de alta resolución: lado en píxeles (0 = sin teselas) y solape (fracción del lado)
+TILE_SIZE = env_int('VISIONPHARMA_TILE_SIZE', 0)
+TILE_OVERLAP = env_float('VISIONPHARMA_TILE_OVERLAP', 0.2)
+
+# Servidor de inferencia por lotes (MicroBatcher)
+MAX_BATCH_SIZE = env_int('VISIONPHARMA_MAX_BATCH_SIZE', 8)
+MAX_WAIT_MS = env_float('VISIONPHARMA_MAX_WAIT_MS', 5.0)
+INFERENCE_QUEUE_SIZE = env_int('VISIONPHARMA_INFERENCE_QUEUE_SIZE', 32)
+INFERENCE_TIMEOUT_S = env_float('VISIONPHARMA_INFERENCE_TIMEOUT_S', 30.0)
+
+# Modo producción (serve.py): procesos web, hilos por proceso y dirección donde escuchar
+SERVE_WORKERS = env_int('VISIONPHARMA_WORKERS', 2)
+SERVE_THREADS = env_int('VISIONPHARMA_THREADS', 4)
+SERVE_BIND = env_str('VISIONPHARMA_BIND', '127.0.0.1:5000')
+# Proceso de inferencia compartido: socket Unix o 'host:puerto' (vacío = el modelo se carga en la app).
+# serve.py los completa solo; el número de worker lo asigna serve.py a cada proceso web
+INFERENCE_SERVER = env_str('VISIONPHARMA_INFERENCE_SERVER', '')
+INFERENCE_AUTHKEY = env_str('VISIONPHARMA_INFERENCE_AUTHKEY', '')
+WORKER_ID = env_str('VISIONPHARMA_WORKER_ID', '')
+
+# Stream en vivo (app_live.py)
+# Cámaras separadas por coma, con nombre opcional: 'linea1=0,linea2=rtsp://host/stream,prueba=video.mp4'
+CAMERAS = env_str('VISIONPHARMA_CAMERAS', '0')
+# Captura: resolución y FPS pedidos al driver (0 = los del driver), códec y frames en el buffer del driver
+CAMERA_WIDTH = env_int('VISIONPHARMA_CAMERA_WIDTH', 0)
+CAMERA_HEIGHT = env_int('VISIONPHARMA_CAMERA_HEIGHT', 0)
+CAMERA_FPS = env_float('VISIONPHARMA_CAMERA_FPS', 0.0)
+CAMERA_FOURCC = env_str('VISIONPHARMA_CAMERA_FOURCC', 'MJPG') # Vacío = el del driver
+CAMERA_BUFFER_SIZE = env_int('VISIONPHARMA_CAMERA_BUFFER_SIZE', 1)
+CAMERA_RECONNECT_MAX_S = env_float('VISIONPHARMA_CAMERA_RECONNECT_MAX_S', 30.0) # Espera máxima entre reconexiones
+STREAM_JPEG_QUALITY = env_int('VISIONPHARMA_STREAM_JPEG_QUALITY', 80)
+# Inferencias por segundo del stream: el controlador se mueve entre el mínimo y el máximo según la carga
+LIVE_MAX_INFERENCE_FPS = env_float('VISIONPHARMA_LIVE_MAX_INFERENCE_FPS', 15.0)
+LIVE_MIN_INFERENCE_FPS = env_float('VISIONPHARMA_LIVE_MIN_INFERENCE_FPS', 1.0)
+# Saltar la IA mientras la escena no cambia (se reutilizan las últimas detecciones)
+MOTION_GATE = env_bool('VISIONPHARMA_MOTION_GATE', True)
+MOTION_THRESHOLD = env_int('VISIONPHARMA_MOTION_THRESHOLD', 8) # Diferencia de gris (0-255) por píxel
+MOTION_MIN_CHANGED = env_float('VISIONPHARMA_MOTION_MIN_CHANGED', 0.01) # Fracción de píxeles que deben cambiar
+MOTION_MAX_STATIC_S = env_float('VISIONPHARMA_MOTION_MAX_STATIC_S', 5.0) # Inferir al menos cada tantos segundos
+
+# Base de datos: 'mysql', 'postgresql' o 'sqlite' (archivo local, sin servidor)
+DB_BACKEND = env_str('VISIONPHARMA_DB_BACKEND', 'mysql')
+DB_HOST = env_str('VISIONPHARMA_DB_HOST', 'localhost')
+DB_PORT = env_int('VISIONPHARMA_DB_PORT', 0) # 0 = puerto por defecto del motor
+DB_NAME = env_str('VISIONPHARMA_DB_NAME', 'visionpharma_db')
+DB_USER = env_str('VISIONPHARMA_DB_USER', 'root')
+DB_PASSWORD = env_str('VISIONPHARMA_DB_PASSWORD', '')
+SQLITE_PATH = env_str('VISIONPHARMA_SQLITE_PATH', os.path.join('data', 'visionpharma.db'))
+DB_POOL_SIZE = env_int('VISIONPHARMA_DB_POOL_SIZE', 5)
+DB_POOL_TIMEOUT_S = env_float('VISIONPHARMA_DB_POOL_TIMEOUT_S', 10.0) # Espera por una conexión libre
+DB_CONNECT_TIMEOUT_S = env_int('VISIONPHARMA_DB_CONNECT_TIMEOUT_S', 5)
+
+# Persistencia de reportes (escritura diferida)
+DB_BATCH_SIZE = env_int('VISIONPHARMA_DB_BATCH_SIZE', 50)
+DB_FLUSH_INTERVAL_S = env_float('VISIONPHARMA_DB_FLUSH_INTERVAL_S', 2.0)
+
+# Imágenes de resultados (app_cnn.py)
+RESULT_JPEG_QUALITY = env_int('VISIONPHARMA_RESULT_JPEG_QUALITY', 90)
+RESULT_WRITER_THREADS = env_int('VISIONPHARMA_RESULT_WRITER_THREADS', 2)
+# Caché de resultados por contenido de la imagen (0 = desactivada) y carpeta opcional para guardarla en disco
+RESULT_CACHE_SIZE = env_int('VISIONPHARMA_RESULT_CACHE_SIZE', 256)
+RESULT_CACHE_DIR = env_str('VISIONPHARMA_RESULT_CACHE_DIR', '')
+# Retención de las imágenes de resultado (0 = sin límite) y ancho de las miniaturas
+RESULTS_MAX_AGE_DAYS = env_float('VISIONPHARMA_RESULTS_MAX_AGE_DAYS', 0.0)
+RESULTS_MAX_GB = env_float('VISIONPHARMA_RESULTS_MAX_GB', 0.0)
+RESULTS_SWEEP_INTERVAL_S = env_float('VISIONPHARMA_RESULTS_SWEEP_INTERVAL_S', 3600.0)
+THUMBNAIL_WIDTH = env_int('VISIONPHARMA_THUMBNAIL_WIDTH', 320)
+
+# Métricas de rendimiento (ruta /metrics en formato Prometheus)
+METRICS_ENABLED = env_bool('VISIONPHARMA_METRICS', True)
+
+# Inspección por lotes (batch_inspect.py y la ruta /batch)
+BATCH_DECODE_WORKERS = env_int('VISIONPHARMA_BATCH_DECODE_WORKERS', 4)
+BATCH_CHECKPOINT_EVERY = env_int('VISIONPHARMA_BATCH_CHECKPOINT_EVERY', 100)
@@ -1,125 +1,320 @@
-import mysql.connector
-from mysql.connector import pooling
 import threading
+import time
+from contextlib import closing
+from . import config, metrics
 from .models import InspectionReportDTO
+from .storage_backends import create_storage_backend
+
+# Tiempo esperando una conexión libre del pool
+POOL_WAIT_SECONDS = metrics.histogram('visionpharma_db_pool_wait_seconds',
+                                      "Espera para obtener una conexión del pool de la base de datos")
+DB_ERRORS = metrics.counter('visionpharma_db_errors_total', "Errores de la base de datos por operación",
+                            labelnames=('operation',))
+
+def to_local_naive(value):
+    """
+    Las fechas de 'inspections' se guardan en hora local sin zona: una fecha con
+    zona (p. ej. '...Z' en la URL) se pasa a hora local y se le quita la zona
+    """
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
 
 class DatabaseConnection:
     """
-    Clase Singleton para manejar la conexión a la base de datos MySQL
-    
-    Utiliza un pool de conexiones para ser eficiente en un entorno web (Flask)
+    Clase Singleton para manejar la conexión a la base de datos
+
+    El motor (MySQL, PostgreSQL o SQLite local) se elige por configuración
+    (VISIONPHARMA_DB_BACKEND, ver storage_backends.py); esta clase solo tiene
+    el SQL común. Utiliza un pool de conexiones para ser eficiente en un
+    entorno web (Flask)
     """
     _instance = None
-    _pool = None
     _lock = threading.Lock() # Para seguridad en hilos (thread-safety)
+    initialized = False # La tabla ya se creó o verificó (lo consulta la ruta /ready)
 
-    # Configuración de MySQL 
-    DB_NAME = "visionpharma_db"
-    DB_USER = "root"
-    DB_PASS = ""
-    DB_HOST = "localhost"
-    DB_PORT = 3306
+    def __new__(cls, backend=None):
+        """
+        Singleton pattern implementation
 
-    def __new__(cls):
-        """Singleton pattern implementation"""
+        Con 'backend' (un StorageBackend) se crea una instancia independiente
+        del singleton (p. ej. la base central al sincronizar)
+        """
+        if backend is not None:
+            instance = super(DatabaseConnection, cls).__new__(cls)
+            instance.backend = backend
+            return instance
         if cls._instance is None:
             with cls._lock:
                 if cls._instance is None:
-                    cls._instance = super(DatabaseConnection, cls).__new__(cls)
-                    cls._instance._initialize_pool()
+                    instance = super(DatabaseConnection, cls).__new__(cls)
+                    instance.backend = create_storage_backend(config.DB_BACKEND,
+                                                              database=config.DB_NAME,
+                                                              user=config.DB_USER,
+                                                              password=config.DB_PASSWORD,
+                                                              host=config.DB_HOST,
+                                                              port=config.DB_PORT or None,
+                                                              sqlite_path=config.SQLITE_PATH,
+                                                              pool_size=config.DB_POOL_SIZE,
+                                                              pool_timeout=config.DB_POOL_TIMEOUT_S,
+                                                              connect_timeout=config.DB_CONNECT_TIMEOUT_S)
+                    cls._instance = instance
         return cls._instance
 
-    def _initialize_pool(self):
-        try:
-            print(f"Creando pool de conexiones para MySQL: {self.DB_NAME} en {self.DB_HOST}...")
-            pool_config = {
-                "pool_name": "visionpharma_pool",
-                "pool_size": 5,
-                "database": self.DB_NAME,
-                "user": self.DB_USER,
-                "password": self.DB_PASS,
-                "host": self.DB_HOST,
-                "port": self.DB_PORT
-            }
-            DatabaseConnection._pool = mysql.connector.pooling.MySQLConnectionPool(**pool_config)
-            print("Pool de conexiones MySQL creado exitosamente")
-        except mysql.connector.Error as error:
-            print(f"Error al inicializar el pool de conexiones MySQL: {error}")
-            DatabaseConnection._pool = None
-
     def get_connection(self):
-        """Obtiene una conexión del pool"""
-        if DatabaseConnection._pool is None:
-            print("Pool no inicializado, intentando reconectar...")
-            self._initialize_pool()
-        
-        if DatabaseConnection._pool:
-            try:
-                return DatabaseConnection._pool.get_connection()
-            except mysql.connector.Error as e:
-                print(f"Error al obtener conexión del pool MySQL: {e}")
-                return None
-        return None
+        """Obtiene una conexión del pool (None si no hay)"""
+        start = time.perf_counter()
+        conn = self.backend.get_connection()
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+        if conn is None:
+            DB_ERRORS.inc(operation='get_connection')
+        return conn
+
+    def release_connection(self, conn, error=None):
+        """Devuelve una conexión al pool (si 'error' la dejó inservible, el pool la descarta)"""
+        self.backend.release_connection(conn, broken=error is not None and self.backend.is_disconnect(error))
+
+    def close(self):
+        """Cierra las conexiones del pool"""
+        self.backend.close()
 
-    def release_connection(self, conn):
-        """Devuelve una conexión al pool"""
+    def initialize(self) -> bool:
+        """
+        Crea la tabla 'inspections' si no existe, con sus índices
+        (los índices que falten en una tabla existente se agregan)
+
+        Devuelve True si la base de datos respondió
+        """
+        conn = self.get_connection()
         if conn:
+            failure = None
             try:
-                conn.close()
-            except mysql.connector.Error as e:
-                print(f"Error al devolver la conexión al pool: {e}")
+                with closing(conn.cursor()) as c:
+                    self.backend.ensure_schema(c)
+                conn.commit()
+                print(f"Tabla 'inspections' inicializada en {self.backend.name}")
+                self.initialized = True
+            except self.backend.errors as error:
+                print(f"Error: {error}")
+                failure = error
+            finally:
+                self.release_connection(conn, failure)
+        return self.initialized
+
+    INSERT_COMMAND = """
+        INSERT INTO inspections (timestamp, total_pastillas, total_vacios, estado_final, imagen_resultado, clave_origen)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """
+
+    def _insert_command(self):
+        """INSERT que ignora un reporte cuya clave_origen ya está guardada (idempotente al reanudar lotes)"""
+        return self.backend.adapt_query(self.INSERT_COMMAND + self.backend.ignore_duplicates('clave_origen'))
 
-    def initialize(self):
+    @staticmethod
+    def _to_row(inspection: InspectionReportDTO) -> tuple:
+        return (
+            inspection.timestamp,
+            inspection.total_pastillas,
+            inspection.total_vacios,
+            inspection.estado_final,
+            inspection.imagen_resultado,
+            inspection.clave_origen
+        )
+
+    def save_inspection(self, inspection: InspectionReportDTO) -> bool:
         """
-        Crea la tabla 'inspections' si no existe
-        en la base de datos MySQL.
+        Guarda un DTO de reporte
+
+        Devuelve True si se guardó
         """
-        create_table_command = """
-            CREATE TABLE IF NOT EXISTS inspections (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                timestamp DATETIME NOT NULL,
-                total_pastillas INT NOT NULL,
-                total_vacios INT NOT NULL,
-                estado_final VARCHAR(50) NOT NULL,
-                imagen_resultado VARCHAR(255)
-            )
+        with metrics.span('db_save_inspection'):
+            return self._save_inspection(inspection)
+
+    def _save_inspection(self, inspection: InspectionReportDTO) -> bool:
+        conn = self.get_connection()
+        if conn:
+            failure = None
+            try:
+                with closing(conn.cursor()) as c:
+                    c.execute(self._insert_command(), self._to_row(inspection))
+                conn.commit()
+                print(f"DTO de Reporte guardado en {self.backend.name}: {inspection.timestamp}, {inspection.estado_final}")
+                return True
+            except self.backend.errors as error:
+                print(f"Error al guardar DTO en {self.backend.name}: {error}")
+                DB_ERRORS.inc(operation='save_inspection')
+                failure = error
+                try:
+                    conn.rollback()
+                except self.backend.errors:
+                    pass # La conexión pudo haberse perdido
+            finally:
+                self.release_connection(conn, failure)
+        return False
+
+    def save_inspections(self, inspections: list[InspectionReportDTO]) -> bool:
         """
+        Guarda varios DTOs con un solo executemany en una sola transacción
+
+        Devuelve True si se guardaron todos (si falla no se guarda ninguno)
+        """
+        if not inspections:
+            return True
+        with metrics.span('db_save_inspections'):
+            return self._save_inspections(inspections)
+
+    def _save_inspections(self, inspections: list[InspectionReportDTO]) -> bool:
         conn = self.get_connection()
         if conn:
+            failure = None
             try:
-                with conn.cursor() as c:
-                    c.execute(create_table_command)
+                with closing(conn.cursor()) as c:
+                    c.executemany(self._insert_command(), [self._to_row(i) for i in inspections])
                 conn.commit()
-                print("Tabla 'inspections' inicializada en MySQL")
-            except mysql.connector.Error as error:
-                print(f"Error: {error}")
+                print(f"{len(inspections)} DTOs de Reporte guardados en {self.backend.name}")
+                return True
+            except self.backend.errors as error:
+                print(f"Error al guardar lote de DTOs en {self.backend.name}: {error}")
+                DB_ERRORS.inc(operation='save_inspections')
+                failure = error
+                try:
+                    conn.rollback()
+                except self.backend.errors:
+                    pass # La conexión pudo haberse perdido
             finally:
-                self.release_connection(conn)
+                self.release_connection(conn, failure)
+        return False
 
-    def save_inspection(self, inspection: InspectionReportDTO):
+    # Consultas del historial
+
+    MAX_PAGE_SIZE = 500
+
+    def query_inspections(self, start=None, end=None, estado=None, limit=50, before=None):
         """
-        Guarda un DTO de reporte
+        Historial de inspecciones, de la más reciente a la más antigua
+
+        Paginación por clave (keyset): 'before' es el par (timestamp, id) del
+        último elemento de la página anterior. A diferencia de OFFSET, el costo
+        no crece con el número de página
+
+        Args:
+            start (datetime): Desde (inclusive)
+            end (datetime): Hasta (exclusive)
+            estado (str): Filtrar por estado final ('Aprobado', 'Defectuoso')
+            limit (int): Elementos por página (máximo MAX_PAGE_SIZE)
+            before (tuple): (timestamp, id) donde continuar
+
+        Devuelve (lista de dicts, hay_mas) o None si falla la consulta
+        """
+        limit = max(1, min(int(limit), self.MAX_PAGE_SIZE))
+        start, end = to_local_naive(start), to_local_naive(end)
+        if before:
+            before = (to_local_naive(before[0]), before[1])
+        conditions, params = [], []
+        if estado:
+            conditions.append("estado_final = %s")
+            params.append(estado)
+        if start:
+            conditions.append("timestamp >= %s")
+            params.append(start)
+        if end:
+            conditions.append("timestamp < %s")
+            params.append(end)
+        if before:
+            # Forma expandida de (timestamp, id) < (%s, %s): todos los motores la resuelven con el índice
+            conditions.append("(timestamp < %s OR (timestamp = %s AND id < %s))")
+            params.extend([before[0], before[0], before[1]])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        query = f"""
+            SELECT id, timestamp, total_pastillas, total_vacios, estado_final, imagen_resultado
+            FROM inspections {where}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT %s
         """
-        insert_command = """
-            INSERT INTO inspections (timestamp, total_pastillas, total_vacios, estado_final, imagen_resultado)
-            VALUES (%s, %s, %s, %s, %s)
+        rows = self._fetch_all(query, params + [limit + 1])
+        if rows is None:
+            return None
+        return rows[:limit], len(rows) > limit
+
+    def hourly_defect_rates(self, start, end):
+        """
+        Inspecciones, defectuosas y tasa de defectos por hora en [start, end)
+
+        El rango es obligatorio: la consulta recorre solo ese tramo del índice de timestamp
+        """
+        query = f"""
+            SELECT {self.backend.hour_bucket('timestamp')} AS hora,
+                   COUNT(*) AS inspecciones,
+                   SUM(CASE WHEN estado_final <> 'Aprobado' THEN 1 ELSE 0 END) AS defectuosas
+            FROM inspections
+            WHERE timestamp >= %s AND timestamp < %s
+            GROUP BY hora
+            ORDER BY hora
         """
+        rows = self._fetch_all(query, [to_local_naive(start), to_local_naive(end)])
+        if rows is None:
+            return None
+        for row in rows:
+            row['defectuosas'] = int(row['defectuosas'] or 0)
+            row['tasa_defectos'] = round(row['defectuosas'] / row['inspecciones'], 4) if row['inspecciones'] else 0.0
+        return rows
+
+    def _fetch_all(self, query, params):
+        """Ejecuta una consulta de lectura y devuelve las filas como dicts (None si falla)"""
         conn = self.get_connection()
         if conn:
+            failure = None
+            try:
+                with metrics.span('db_query'):
+                    with closing(conn.cursor()) as c:
+                        c.execute(self.backend.adapt_query(query), params)
+                        columns = [column[0] for column in c.description]
+                        return [dict(zip(columns, row)) for row in c.fetchall()]
+            except self.backend.errors as error:
+                print(f"Error al consultar el historial en {self.backend.name}: {error}")
+                DB_ERRORS.inc(operation='query')
+                failure = error
+            finally:
+                self.release_connection(conn, failure)
+        return None
+
+    # Mantenimiento
+
+    def clear_result_images(self, paths, chunk_size=500) -> int:
+        """
+        Quita la referencia a imágenes de resultado que ya no existen
+        (imagen_resultado = NULL); devuelve cuántos reportes se actualizaron
+        """
+        updated = 0
+        for start in range(0, len(paths), chunk_size):
+            chunk = paths[start:start + chunk_size]
+            query = f"UPDATE inspections SET imagen_resultado = NULL WHERE imagen_resultado IN ({', '.join(['%s'] * len(chunk))})"
+            conn = self.get_connection()
+            if not conn:
+                break
+            failure = None
             try:
-                with conn.cursor() as c:
-                    data_tuple = (
-                        inspection.timestamp,
-                        inspection.total_pastillas,
-                        inspection.total_vacios,
-                        inspection.estado_final,
-                        inspection.imagen_resultado
-                    )
-                    c.execute(insert_command, data_tuple)
+                with closing(conn.cursor()) as c:
+                    c.execute(self.backend.adapt_query(query), chunk)
+                    updated += max(c.rowcount, 0)
                 conn.commit()
-                print(f"DTO de Reporte guardado en MySQL: {inspection.timestamp}, {inspection.estado_final}")
-            except mysql.connector.Error as error:
-                print(f"Error al guardar DTO en MySQL: {error}")
-                conn.rollback()
+            except self.backend.errors as error:
+                print(f"Error al limpiar imágenes borradas en {self.backend.name}: {error}")
+                DB_ERRORS.inc(operation='clear_images')
+                failure = error
+                try:
+                    conn.rollback()
+                except self.backend.errors:
+                    pass
+                break
             finally:
-                self.release_connection(conn)
\ No newline at end of file
+                self.release_connection(conn, failure)
+        return updated
+
+    def inspections_after(self, last_id, limit=500):
+        """Reportes con id mayor que 'last_id', en orden de id (para sincronizar con la base central)"""
+        query = """
+            SELECT id, timestamp, total_pastillas, total_vacios, estado_final, imagen_resultado, clave_origen
+            FROM inspections WHERE id > %s ORDER BY id LIMIT %s
+        """
+        return self._fetch_all(query, [last_id, limit])
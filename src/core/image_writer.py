@@ -0,0 +1,137 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import cv2
+import numpy as np
+
+from . import metrics
+
+class ResultImageWriter:
+    """
+    Codifica y guarda las imágenes de resultados en un pool de hilos,
+    fuera del camino de la petición web
+
+    Cada imagen se escribe primero a un archivo temporal y luego se renombra,
+    así nunca se sirve un JPEG a medio escribir. Mientras una imagen está
+    pendiente, wait(path) permite esperarla (p. ej. desde la ruta estática)
+    """
+
+    def __init__(self, max_workers=2, jpeg_quality=90):
+        """
+        Args:
+            max_workers (int): Hilos de codificación/escritura
+            jpeg_quality (int): Calidad JPEG (0-100)
+        """
+        self.jpeg_quality = int(jpeg_quality)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)),
+                                            thread_name_prefix='result-writer')
+        self._pending = {} # Ruta absoluta -> Future
+        self._lock = threading.Lock()
+
+    def submit(self, path, image: np.ndarray):
+        """Encola la escritura de 'image' en 'path' y devuelve el Future"""
+        path = os.path.abspath(path)
+        future = self._executor.submit(self._write, path, image)
+        with self._lock:
+            self._pending[path] = future
+        future.add_done_callback(lambda _: self._forget(path, future))
+        return future
+
+    def submit_copy(self, source, path):
+        """
+        Encola una copia de la imagen 'source' (ya escrita o pendiente) en 'path'
+        y devuelve el Future. Se usa un enlace duro si el sistema de archivos lo
+        permite (sin ocupar más espacio); si no, se copia el archivo
+        """
+        source, path = os.path.abspath(source), os.path.abspath(path)
+        future = self._executor.submit(self._copy, source, path)
+        with self._lock:
+            self._pending[path] = future
+        future.add_done_callback(lambda _: self._forget(path, future))
+        return future
+
+    def wait(self, path, timeout=None) -> bool:
+        """
+        Espera a que termine la escritura pendiente de 'path' (si la hay)
+
+        Devuelve False si se agotó el tiempo o la escritura falló
+        """
+        with self._lock:
+            future = self._pending.get(os.path.abspath(path))
+        if future is None:
+            return True
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return False
+
+    def exists(self, path) -> bool:
+        """True si la imagen ya está en disco o se está escribiendo"""
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._pending:
+                return True
+        return os.path.exists(path)
+
+    def pending(self) -> int:
+        """Imágenes aún no escritas"""
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self):
+        """Termina de escribir todo lo pendiente"""
+        self._executor.shutdown(wait=True)
+
+    def _forget(self, path, future):
+        with self._lock:
+            if self._pending.get(path) is future:
+                del self._pending[path]
+
+    def _write(self, path, image: np.ndarray) -> bool:
+        """Codifica a JPEG y escribe de forma atómica (temporal + renombrar)"""
+        with metrics.span('result_image_write'):
+            return self._encode_and_write(path, image)
+
+    def _copy(self, source, path) -> bool:
+        """Enlaza (o copia) 'source' en 'path' de forma atómica, después de su escritura pendiente"""
+        if not self.wait(source):
+            print(f"Error al copiar la imagen '{source}': no se pudo escribir")
+            return False
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path) # Otro disco o sin soporte de enlaces
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            print(f"Error al copiar la imagen '{source}' en '{path}': {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+    def _encode_and_write(self, path, image: np.ndarray) -> bool:
+        ret, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+        if not ret:
+            print(f"Error al codificar la imagen '{path}'")
+            return False
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(buffer.tobytes())
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            print(f"Error al guardar la imagen '{path}': {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
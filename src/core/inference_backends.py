@@ -0,0 +1,236 @@
+"""
+Backends de inferencia para CnnInspectionAgent
+
+Todos exponen la misma interfaz que usa el agente:
+    backend.names -> dict {id_clase: nombre}
+    backend.predict(source, conf, verbose=True) -> lista de arrays (N, 6), uno por frame,
+        con las columnas x1, y1, x2, y2, confianza, clase (coordenadas del frame original)
+
+- UltralyticsBackend: el modelo .pt original (PyTorch)
+- OnnxRuntimeBackend: el modelo exportado a ONNX (opcionalmente INT8) ejecutado
+  con una sesión de ONNX Runtime en CPU (u OpenVINO si está instalado)
+"""
+import ast
+import os
+
+import cv2
+import numpy as np
+
+def letterbox(frame: np.ndarray, new_shape=(640, 640), color=(114, 114, 114)):
+    """
+    Redimensiona manteniendo la proporción y rellena hasta 'new_shape'
+    (mismo cálculo que LetterBox de ultralytics, para obtener cajas idénticas)
+
+    Devuelve (imagen, ganancia, (pad_x, pad_y))
+    """
+    h, w = frame.shape[:2]
+    new_h, new_w = new_shape
+    gain = min(new_h / h, new_w / w)
+    new_unpad = (int(round(w * gain)), int(round(h * gain)))
+    dw = (new_w - new_unpad[0]) / 2
+    dh = (new_h - new_unpad[1]) / 2
+
+    if (w, h) != new_unpad:
+        frame = cv2.resize(frame, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    frame = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return frame, gain, (left, top)
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float, metric='iou') -> np.ndarray:
+    """
+    Non-Maximum Suppression voraz en NumPy
+
+    Args:
+        boxes (np.ndarray): Cajas (N, 4) en formato x1, y1, x2, y2
+        scores (np.ndarray): Confianzas (N,)
+        iou_threshold (float): Solape a partir del cual se descarta una caja
+        metric (str): 'iou' (intersección sobre unión) o 'ios' (intersección
+            sobre el área de la caja más chica, para fusionar cajas cortadas)
+
+    Returns:
+        np.ndarray: Índices de las cajas conservadas, de mayor a menor confianza
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = w * h
+        if metric == 'ios':
+            overlap = inter / (np.minimum(areas[i], areas[rest]) + 1e-9)
+        else:
+            overlap = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[overlap <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+class UltralyticsBackend:
+    """Modelo .pt cargado con ultralytics (PyTorch)"""
+    name = 'pytorch'
+
+    def __init__(self, model_path, imgsz=0):
+        """
+        Args:
+            model_path (str): Ruta al archivo .pt
+            imgsz (int): Lado de la entrada del modelo (0 = el del entrenamiento)
+        """
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+        self.names = self.model.names
+        self._predict_kwargs = {'imgsz': int(imgsz)} if imgsz else {}
+
+    def predict(self, source, conf, verbose=True):
+        results = self.model.predict(source, conf=conf, verbose=verbose, **self._predict_kwargs)
+        if not results:
+            return []
+        # Una sola transferencia a CPU para todo el lote (en lugar de un .item() por caja)
+        import torch
+        data = [r.boxes.data for r in results]
+        stacked = torch.cat(data).cpu().numpy().astype(np.float32, copy=False)
+        return np.split(stacked, np.cumsum([len(d) for d in data])[:-1])
+
+class OnnxRuntimeBackend:
+    """
+    Modelo YOLOv8 exportado a ONNX ejecutado con ONNX Runtime en CPU
+
+    Reproduce el pre y post-procesamiento de ultralytics (letterbox, NMS por
+    clase, reescalado de cajas), así el agente produce exactamente el mismo
+    'formatted_results'. No necesita PyTorch
+    """
+    name = 'onnx'
+
+    # Parámetros de NMS por defecto de ultralytics
+    IOU_THRESHOLD = 0.7
+    MAX_DET = 300
+    MAX_WH = 7680 # Desplazamiento por clase para hacer NMS de todas las clases a la vez
+
+    def __init__(self, model_path, intra_op_threads=0, providers=None, imgsz=0):
+        """
+        Args:
+            model_path (str): Ruta al archivo .onnx
+            intra_op_threads (int): Hilos de ONNX Runtime por operador (0 = automático)
+            providers (list[str]): Execution providers en orden de preferencia
+                (p. ej. ['OpenVINOExecutionProvider']); se añade CPU como respaldo
+            imgsz (int): Tamaño de entrada si el modelo tiene dimensiones dinámicas
+                (0 = el guardado al exportar, o 640)
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = int(intra_op_threads)
+
+        available = ort.get_available_providers()
+        requested = [p for p in (providers or []) if p in available]
+        for p in (providers or []):
+            if p not in available:
+                print(f"Execution provider '{p}' no disponible, se ignora")
+        if 'CPUExecutionProvider' not in requested:
+            requested.append('CPUExecutionProvider')
+
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=requested)
+        self.input_name = self.session.get_inputs()[0].name
+        print(f"Sesión ONNX Runtime creada con {self.session.get_providers()}")
+
+        # Metadatos que ultralytics guarda al exportar (nombres de clases, tamaño de entrada)
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {0: 'pastilla', 1: 'vacio'}
+
+        batch_dim, _, in_h, in_w = self.session.get_inputs()[0].shape
+        if isinstance(in_h, int) and isinstance(in_w, int):
+            self.imgsz = (in_h, in_w)
+            if imgsz and (imgsz, imgsz) != self.imgsz:
+                print(f"El modelo ONNX tiene entrada fija {in_w}x{in_h}: se ignora imgsz={imgsz} "
+                      f"(exportar con dynamic=True o con ese tamaño)")
+        elif imgsz:
+            self.imgsz = (imgsz, imgsz)
+        elif 'imgsz' in metadata:
+            self.imgsz = tuple(ast.literal_eval(metadata['imgsz']))
+        else:
+            self.imgsz = (640, 640)
+        # Modelos exportados sin 'dynamic' solo aceptan un frame por llamada
+        self.fixed_batch = batch_dim if isinstance(batch_dim, int) else None
+
+    def predict(self, source, conf, verbose=True):
+        frames = source if isinstance(source, (list, tuple)) else [source]
+        if not frames:
+            return []
+
+        step = self.fixed_batch or len(frames)
+        results = []
+        for start in range(0, len(frames), step):
+            chunk = frames[start:start + step]
+            prepared = [letterbox(frame, self.imgsz) for frame in chunk]
+            blob = np.stack([img for img, _, _ in prepared])
+            # BGR -> RGB, HWC -> CHW, 0-255 -> 0-1
+            blob = np.ascontiguousarray(blob[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+            preds = self.session.run(None, {self.input_name: blob})[0]
+            for frame, pred, (_, gain, pad) in zip(chunk, preds, prepared):
+                results.append(self._postprocess(pred, conf, gain, pad, frame.shape[:2]))
+
+        if verbose:
+            print(f"ONNX Runtime: {len(frames)} frame(s) procesados")
+        return results
+
+    def _postprocess(self, pred: np.ndarray, conf: float, gain: float, pad, shape) -> np.ndarray:
+        """
+        Decodifica la salida (4 + nc, N) de YOLOv8 a detecciones (M, 6):
+        x1, y1, x2, y2, confianza, clase (en coordenadas del frame original)
+        """
+        pred = pred.T # (N, 4 + nc)
+        scores = pred[:, 4:]
+        cls_ids = scores.argmax(axis=1)
+        confs = scores[np.arange(len(scores)), cls_ids]
+        mask = confs > conf
+        if not mask.any():
+            return np.zeros((0, 6), dtype=np.float32)
+
+        xywh, confs, cls_ids = pred[mask, :4], confs[mask], cls_ids[mask]
+        boxes = np.empty_like(xywh)
+        boxes[:, 0] = xywh[:, 0] - xywh[:, 2] / 2
+        boxes[:, 1] = xywh[:, 1] - xywh[:, 3] / 2
+        boxes[:, 2] = xywh[:, 0] + xywh[:, 2] / 2
+        boxes[:, 3] = xywh[:, 1] + xywh[:, 3] / 2
+
+        # NMS por clase (desplazando las cajas de cada clase)
+        keep = nms(boxes + cls_ids[:, None] * self.MAX_WH, confs, self.IOU_THRESHOLD)[:self.MAX_DET]
+        boxes, confs, cls_ids = boxes[keep], confs[keep], cls_ids[keep]
+
+        # Deshacer el letterbox y recortar al tamaño del frame
+        boxes[:, [0, 2]] -= pad[0]
+        boxes[:, [1, 3]] -= pad[1]
+        boxes /= gain
+        h, w = shape
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+
+        return np.concatenate([boxes, confs[:, None], cls_ids[:, None]], axis=1).astype(np.float32)
+
+def create_backend(model_path, backend='auto', intra_op_threads=0, providers=None, imgsz=0):
+    """
+    Crea el backend adecuado para el modelo
+
+    Args:
+        model_path (str): Ruta al modelo (.pt o .onnx)
+        backend (str): 'pytorch', 'onnx' o 'auto' (según la extensión del archivo).
+            También acepta un objeto backend ya creado (p. ej. el modelo falso de los benchmarks)
+        intra_op_threads (int): Hilos por operador para ONNX Runtime
+        providers (list[str]): Execution providers de ONNX Runtime
+        imgsz (int): Lado de la entrada del modelo (0 = el del modelo)
+    """
+    if not isinstance(backend, str):
+        return backend
+    if backend == 'auto':
+        backend = 'onnx' if os.path.splitext(model_path)[1].lower() == '.onnx' else 'pytorch'
+    if backend == 'onnx':
+        return OnnxRuntimeBackend(model_path, intra_op_threads=intra_op_threads, providers=providers, imgsz=imgsz)
+    if backend == 'pytorch':
+        return UltralyticsBackend(model_path, imgsz=imgsz)
+    raise ValueError(f"Backend de inferencia desconocido: '{backend}'")
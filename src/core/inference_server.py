@@ -0,0 +1,282 @@
+"""
+Proceso de inferencia compartido por varios workers web (serve.py)
+
+El modelo se carga una sola vez en un proceso aparte que atiende a todos
+los workers por un socket local (multiprocessing.connection). Los frames no
+viajan por el socket: cada conexión tiene un bloque de memoria compartida
+(multiprocessing.shared_memory) donde el worker copia los frames y el
+servidor los lee en el lugar, sin serializarlos. Por el socket solo pasan
+el nombre del bloque, las formas de los frames y las detecciones (N, 6)
+
+- InferenceServer: dentro del proceso de inferencia, reparte las peticiones
+  de todas las conexiones en un MicroBatcher (los frames de distintos
+  workers se agrupan en el mismo lote)
+- RemoteBackend: backend para CnnInspectionAgent en cada worker; misma
+  interfaz que los de inference_backends (names, predict), así el agente
+  sigue haciendo ROI, teselas, dibujo y tabla en el worker
+"""
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError, wait
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from .batching import MicroBatcher, InferenceQueueFull, DETECTIONS_ONLY
+from .cnn_inspector import CnnInspectionAgent
+
+# El bloque compartido crece de a 1 MB (y nunca se achica)
+SHM_ALIGN = 1 << 20
+
+def parse_address(value):
+    """'host:puerto' -> ('host', puerto); cualquier otro valor es la ruta de un socket Unix"""
+    host, sep, port = value.rpartition(':')
+    if sep and host and port.isdigit():
+        return host, int(port)
+    return value
+
+class InferenceServer:
+    """Atiende a los workers: un hilo por conexión, un MicroBatcher para todos"""
+
+    def __init__(self, agent, address, authkey, max_queue_size=0):
+        """
+        Args:
+            agent (CnnInspectionAgent): Agente con el modelo cargado (sin ROI ni
+                teselas: eso lo hace cada worker antes de enviar los frames)
+            address: Dirección del socket (ver parse_address)
+            authkey (bytes): Clave compartida con los workers
+            max_queue_size (int): Frames pendientes permitidos en el MicroBatcher
+        """
+        self.agent = agent
+        self.address = address
+        self.authkey = authkey
+        self.batcher = MicroBatcher(agent, max_queue_size=max_queue_size)
+        self._listener = None
+        self._connections = 0
+        self._connections_lock = threading.Lock()
+
+    def listen(self):
+        """Abre el socket (borrando uno viejo de una ejecución anterior) e inicia el MicroBatcher"""
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        self._listener = Listener(self.address, authkey=self.authkey)
+        self.batcher.start()
+        print(f"Servidor de inferencia escuchando en {self.address}")
+
+    def serve_forever(self):
+        """Acepta conexiones hasta que se cierre el socket"""
+        while True:
+            listener = self._listener
+            if listener is None:
+                break # close() ya se llamó
+            try:
+                conn = listener.accept()
+            except OSError:
+                break # Socket cerrado
+            except Exception as e:
+                print(f"Conexión rechazada: {e}") # p. ej. clave incorrecta
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        self.batcher.stop()
+
+    def hello(self) -> dict:
+        """Datos del modelo que necesita el RemoteBackend de cada worker"""
+        return {
+            'names': self.agent.class_names,
+            'name': self.agent.model.name,
+            'digest': self.agent.model_digest,
+        }
+
+    def _handle(self, conn):
+        """Bucle de una conexión: ('hello',), ('predict', bloque, formas) o ('stats',)"""
+        with self._connections_lock:
+            self._connections += 1
+        shm = None
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    break
+                command = message[0]
+                if command == 'hello':
+                    conn.send(('ok', self.hello()))
+                elif command == 'stats':
+                    conn.send(('ok', {**self.batcher.stats(), 'connections': self._connections}))
+                elif command == 'predict':
+                    _, shm_name, layout = message
+                    if shm is None or shm.name != shm_name:
+                        if shm is not None:
+                            shm.close()
+                        shm = self._attach(shm_name)
+                    conn.send(self._predict(shm, layout))
+                else:
+                    conn.send(('error', f"Comando desconocido: {command}"))
+        finally:
+            with self._connections_lock:
+                self._connections -= 1
+            if shm is not None:
+                shm.close()
+            conn.close()
+
+    @staticmethod
+    def _attach(name):
+        # El bloque es del worker, que lo borra al cerrar. Lanzados desde serve.py, este proceso
+        # y los workers comparten el resource_tracker: lo que un worker caído deje lo borra al salir
+        return shared_memory.SharedMemory(name=name)
+
+    def _predict(self, shm, layout):
+        """Detecciones de los frames del bloque (vistas sobre la memoria compartida, sin copiarlos)"""
+        frames = [np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+                  for shape, dtype, offset in layout]
+        futures = []
+        try:
+            for frame in frames:
+                futures.append(self.batcher.submit(frame, DETECTIONS_ONLY))
+            return ('ok', [future.result() for future in futures])
+        except InferenceQueueFull:
+            return ('busy', "Cola de inferencia llena")
+        except Exception as e:
+            return ('error', str(e))
+        finally:
+            # Antes de responder ningún frame puede seguir en uso: el worker reescribe el bloque
+            # con la siguiente petición. Los que no entraron a un lote se cancelan y se espera
+            # a los que ya están en la inferencia
+            wait([future for future in futures if not future.cancel()])
+            frame = frames = None # Sin vistas vivas: el bloque se puede cerrar o reemplazar
+
+def run_server(address, authkey, agent_options, max_queue_size=0, ready=None):
+    """
+    Punto de entrada del proceso de inferencia (serve.py): carga el modelo,
+    lo precalienta y atiende a los workers hasta que se detenga el proceso
+
+    Args:
+        address: Dirección del socket (ver parse_address)
+        authkey (bytes): Clave compartida con los workers
+        agent_options (dict): Argumentos de CnnInspectionAgent
+        max_queue_size (int): Frames pendientes permitidos
+        ready (multiprocessing.Event): Se activa cuando el servidor ya acepta conexiones
+    """
+    agent = CnnInspectionAgent(**agent_options)
+    if agent.model is None:
+        raise SystemExit(1)
+    print(f"Modelo precalentado en {agent.warmup():.2f} s")
+    server = InferenceServer(agent, address, authkey, max_queue_size=max_queue_size)
+    server.listen()
+    if ready is not None:
+        ready.set()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+class RemoteBackend:
+    """
+    Backend que envía los frames al proceso de inferencia compartido
+
+    Para CnnInspectionAgent es un backend más (names, predict); se pasa
+    como objeto en 'backend' (ver inference_backends.create_backend)
+    """
+
+    def __init__(self, address, authkey, timeout=30.0):
+        """
+        Args:
+            address: Dirección del servidor (ver parse_address)
+            authkey (bytes): Clave compartida con el servidor
+            timeout (float): Segundos máximos de espera por una respuesta
+        """
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._conn = None
+        self._shm = None
+        info = self._request(('hello',))
+        self.names = info['names']
+        self.name = f"remoto ({info['name']})"
+        self.digest = info['digest']
+
+    def predict(self, source, conf, verbose=True):
+        # La confianza la aplica el servidor (CnnInspectionAgent.CONFIDENCE, la misma en ambos lados)
+        frames = source if isinstance(source, (list, tuple)) else [source]
+        if not frames:
+            return []
+        with self._lock:
+            layout, offset = [], 0
+            for frame in frames:
+                layout.append((frame.shape, frame.dtype.str, offset))
+                offset += frame.nbytes
+            shm = self._buffer(offset)
+            for frame, (shape, dtype, start) in zip(frames, layout):
+                np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=start)[...] = frame
+            return self._request_locked(('predict', shm.name, layout))
+
+    def stats(self) -> dict:
+        """Estadísticas del MicroBatcher del proceso de inferencia"""
+        return self._request(('stats',))
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+            if self._shm is not None:
+                self._shm.close()
+                self._shm.unlink()
+                self._shm = None
+
+    def _buffer(self, size):
+        """Bloque compartido de al menos 'size' bytes (se reemplaza por uno más grande si hace falta)"""
+        if self._shm is None or self._shm.size < size:
+            if self._shm is not None:
+                self._shm.close()
+                self._shm.unlink()
+            self._shm = shared_memory.SharedMemory(create=True, size=-(-size // SHM_ALIGN) * SHM_ALIGN)
+        return self._shm
+
+    def _request(self, message):
+        with self._lock:
+            return self._request_locked(message)
+
+    def _request_locked(self, message):
+        """Envía y espera la respuesta; si el servidor se reinició, reconecta una vez"""
+        for attempt in range(2):
+            try:
+                if self._conn is None:
+                    self._conn = Client(self.address, authkey=self.authkey)
+                self._conn.send(message)
+                answered = self._conn.poll(self.timeout)
+                if answered:
+                    status, payload = self._conn.recv()
+                break
+            except (EOFError, OSError):
+                self._disconnect()
+                if attempt:
+                    raise ConnectionError(f"Servidor de inferencia no disponible en {self.address}")
+        if not answered:
+            # Sin respuesta: descartar la conexión (y el bloque, que el servidor aún podría estar leyendo)
+            self._disconnect()
+            if self._shm is not None:
+                self._shm.close()
+                self._shm.unlink()
+                self._shm = None
+            raise FutureTimeoutError(f"El servidor de inferencia no respondió en {self.timeout} s")
+        if status == 'busy':
+            raise InferenceQueueFull(payload)
+        if status != 'ok':
+            raise RuntimeError(f"Error en el servidor de inferencia: {payload}")
+        return payload
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+            self._conn = None
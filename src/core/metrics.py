@@ -0,0 +1,250 @@
+"""
+Métricas livianas del pipeline (contadores, gauges e histogramas)
+
+Se exponen en formato de texto de Prometheus desde la ruta /metrics de cada app.
+Las etapas se miden con span():
+
+    with metrics.span('upload_decode'):
+        frame = cv2.imdecode(...)
+
+Si las métricas están desactivadas (VISIONPHARMA_METRICS=0), span() devuelve
+un context manager vacío compartido y observe/inc/set no hacen nada
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from . import config
+
+# Límites (segundos) de los histogramas de latencia: de 0.5 ms a 10 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = config.METRICS_ENABLED
+
+def enabled() -> bool:
+    return _enabled
+
+def set_enabled(value: bool):
+    """Activa o desactiva la recolección en tiempo de ejecución"""
+    global _enabled
+    _enabled = bool(value)
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Etiquetas esperadas {labelnames}, recibidas {sorted(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+class _Metric:
+    """Base común: nombre, ayuda, etiquetas y un valor por combinación de etiquetas"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    """Valor que solo crece (frames leídos, errores, rechazos)"""
+    kind = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(_Metric):
+    """
+    Valor que sube y baja (profundidad de cola, FPS)
+
+    set_function permite leerlo en el momento del scrape (sin etiquetas)
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self) -> list[str]:
+        if self._function is not None:
+            try:
+                with self._lock:
+                    self._values[()] = float(self._function())
+            except Exception as e:
+                print(f"Error al leer la métrica '{self.name}': {e}")
+        return super().render()
+
+class Histogram(_Metric):
+    """Distribución de valores en buckets acumulativos (latencias, tiempos de espera)"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [conteo por bucket (no acumulado) + bucket +Inf, suma]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Conjunto de métricas con nombre único, exportable a texto de Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"La métrica '{name}' ya existe con otro tipo")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames=labelnames)
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames=labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames=labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+# Registro global compartido por todos los módulos de la app
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latencia de cada etapa medida con span()
+STAGE_SECONDS = histogram('visionpharma_stage_seconds', "Duración de cada etapa del pipeline", labelnames=('stage',))
+
+class _NullSpan:
+    """Context manager vacío (métricas desactivadas)"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+@contextmanager
+def _timed_span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+def span(stage):
+    """Mide la duración del bloque 'with' en el histograma de etapas"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _timed_span(stage)
+
+HTTP_REQUEST_SECONDS = histogram('visionpharma_http_request_seconds', "Duración de las peticiones HTTP por ruta",
+                                 labelnames=('endpoint', 'method', 'status'))
+
+def install_flask(app, path='/metrics'):
+    """
+    Registra en una app de Flask la ruta de métricas y la medición
+    de la duración de cada petición (excepto streams y la propia ruta de métricas)
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _metrics_start_timer():
+        if _enabled:
+            g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None and not response.is_streamed and request.endpoint != 'metrics':
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=request.endpoint or 'desconocido',
+                                         method=request.method, status=response.status_code)
+        return response
+
+    @app.route(path, endpoint='metrics')
+    def _metrics_endpoint():
+        """Métricas en formato de texto de Prometheus"""
+        if not _enabled:
+            return Response("Métricas desactivadas (VISIONPHARMA_METRICS=0)\n", status=404, mimetype='text/plain')
+        return Response(render(), content_type=CONTENT_TYPE)
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from collections import Counter
+from dataclasses import dataclass, asdict
 from datetime import datetime
 
 @dataclass
@@ -12,4 +13,40 @@ class InspectionReportDTO:
     total_pastillas: int
     total_vacios: int
     estado_final: str
-    imagen_resultado: str
\ No newline at end of file
+    imagen_resultado: str
+    # Identifica la imagen de origen de un lote: la base ignora un segundo reporte con la misma clave
+    # (al reanudar un lote interrumpido). None en las inspecciones sueltas
+    clave_origen: str = None
+
+    def to_dict(self) -> dict:
+        """Serializa el DTO (timestamp en ISO 8601) para guardarlo en disco"""
+        data = asdict(self)
+        data['timestamp'] = self.timestamp.isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'InspectionReportDTO':
+        """Reconstruye el DTO desde el diccionario generado por to_dict"""
+        data = dict(data)
+        data['timestamp'] = datetime.fromisoformat(data['timestamp'])
+        return cls(**data)
+
+    @classmethod
+    def from_results(cls, results_list: list, imagen_resultado: str = None, timestamp: datetime = None,
+                     clave_origen: str = None) -> 'InspectionReportDTO':
+        """
+        Construye el reporte a partir de la lista de resultados de la IA
+        ('Pastilla', 'Vacio'): cuenta cada estado y decide el estado final
+        """
+        status_counts = Counter(r['status'] for r in results_list)
+        total_vacios = status_counts['Vacio']
+        # (Se podría añadir lógica para 'Deforme' u otro estado si el modelo lo soporta)
+        estado_final = "Defectuoso" if total_vacios > 0 else "Aprobado"
+        return cls(
+            timestamp=timestamp or datetime.now(),
+            total_pastillas=status_counts['Pastilla'],
+            total_vacios=total_vacios,
+            estado_final=estado_final,
+            imagen_resultado=imagen_resultado,
+            clave_origen=clave_origen
+        )
@@ -0,0 +1,242 @@
+"""
+Inferencia condicionada por movimiento y FPS adaptativos para el stream en vivo
+
+- MotionGate: detecta si la escena cambió comparando versiones reducidas
+  en gris del frame actual y del último frame que pasó por la IA
+- AdaptiveRateController: ajusta cuántas inferencias por segundo se piden
+  (sube de a poco mientras la IA va holgada, baja rápido si se atrasa o la
+  cola de inferencia tiene trabajo pendiente)
+- GatedAnnotator: combina ambos. Todos los frames de la cámara se publican
+  (el stream MJPEG sigue fluido), pero la IA solo se ejecuta cuando hay
+  movimiento y el controlador lo permite; en el resto se dibujan las
+  últimas detecciones sobre el frame nuevo
+"""
+import threading
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+
+from . import metrics
+from .batching import InferenceQueueFull
+
+LIVE_FRAMES = metrics.counter('visionpharma_live_frames_total', "Frames del stream en vivo según la acción tomada",
+                              labelnames=('camera', 'action'))
+LIVE_INFERENCE_FPS = metrics.gauge('visionpharma_live_inference_fps', "Inferencias por segundo permitidas por el controlador adaptativo",
+                                   labelnames=('camera',))
+
+# Detecciones vacías para dibujar antes de la primera inferencia
+_NO_DETECTIONS = np.zeros((0, 6), dtype=np.float32)
+
+class MotionGate:
+    """Detector de cambios barato: diferencia de frames reducidos a 'width' píxeles de ancho"""
+
+    def __init__(self, width=160, pixel_threshold=8, min_changed_fraction=0.01, max_static_s=5.0):
+        """
+        Args:
+            width (int): Ancho de la versión reducida (el alto mantiene la proporción)
+            pixel_threshold (int): Diferencia de gris (0-255) a partir de la cual un píxel cambió
+            min_changed_fraction (float): Fracción de píxeles cambiados que cuenta como movimiento
+            max_static_s (float): Forzar una inferencia cada tantos segundos aunque no haya movimiento
+        """
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_fraction = min_changed_fraction
+        self.max_static_s = max_static_s
+        self._reference = None
+        self._reference_time = 0.0
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        size = (self.width, max(1, round(h * self.width / w)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        # Suavizar para que el ruido del sensor no cuente como movimiento
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def changed(self, frame, now=None) -> bool:
+        """True si el frame difiere de la referencia (o si la referencia es muy vieja)"""
+        now = time.monotonic() if now is None else now
+        if self._reference is None or now - self._reference_time >= self.max_static_s:
+            return True
+        thumbnail = self._thumbnail(frame)
+        if thumbnail.shape != self._reference.shape:
+            return True
+        diff = cv2.absdiff(thumbnail, self._reference)
+        changed_fraction = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        return changed_fraction >= self.min_changed_fraction
+
+    def set_reference(self, frame, now=None):
+        """Toma el frame como referencia (llamar cuando pasa por la IA)"""
+        self._reference = self._thumbnail(frame)
+        self._reference_time = time.monotonic() if now is None else now
+
+class AdaptiveRateController:
+    """
+    Tasa de inferencia con aumento aditivo y disminución multiplicativa (AIMD)
+
+    Si una inferencia tarda más que 'headroom' veces el intervalo entre
+    inferencias, o si hay presión (cola ocupada), la tasa baja; si no, sube
+    'increase_step' FPS hasta 'max_fps'
+    """
+
+    def __init__(self, max_fps=15.0, min_fps=1.0, headroom=0.8, increase_step=0.5, decrease_factor=0.7, pressure=None,
+                 camera_id='0'):
+        """
+        Args:
+            max_fps (float): Inferencias por segundo como máximo
+            min_fps (float): Inferencias por segundo como mínimo (aun bajo presión)
+            headroom (float): Fracción del intervalo que puede ocupar una inferencia
+            increase_step (float): FPS que se suman tras una inferencia holgada
+            decrease_factor (float): Factor que multiplica los FPS al atrasarse
+            pressure (callable): Devuelve True si el sistema está cargado (p. ej. cola de inferencia con pendientes)
+            camera_id (str): Nombre de la cámara en las métricas
+        """
+        self.max_fps = float(max_fps)
+        self.min_fps = min(float(min_fps), self.max_fps)
+        self.headroom = headroom
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.pressure = pressure
+        self.camera_id = camera_id
+        self.fps = self.max_fps
+        self._last_start = None
+        LIVE_INFERENCE_FPS.set(self.fps, camera=self.camera_id)
+
+    def ready(self, now=None) -> bool:
+        """True si ya pasó el intervalo mínimo desde la última inferencia"""
+        now = time.monotonic() if now is None else now
+        return self._last_start is None or now - self._last_start >= 1.0 / self.fps
+
+    def started(self, now=None):
+        """Marca el inicio de una inferencia"""
+        self._last_start = time.monotonic() if now is None else now
+
+    def record(self, latency):
+        """Ajusta la tasa con la duración de la última inferencia"""
+        if latency > self.headroom / self.fps or (self.pressure is not None and self.pressure()):
+            self.fps = max(self.min_fps, self.fps * self.decrease_factor)
+        else:
+            self.fps = min(self.max_fps, self.fps + self.increase_step)
+        LIVE_INFERENCE_FPS.set(self.fps, camera=self.camera_id)
+
+    def overloaded(self):
+        """La inferencia fue rechazada (cola llena): bajar la tasa"""
+        self.fps = max(self.min_fps, self.fps * self.decrease_factor)
+        LIVE_INFERENCE_FPS.set(self.fps, camera=self.camera_id)
+
+class GatedAnnotator:
+    """
+    Función de anotación para LiveStreamBroadcaster (frame -> frame anotado)
+    que solo ejecuta la IA cuando hace falta y si no reutiliza las últimas detecciones
+
+    La IA no bloquea la difusión: el frame se envía a inferir y se vuelve de
+    inmediato; mientras tanto cada frame nuevo se dibuja con las últimas
+    detecciones, que se reemplazan cuando termina la inferencia
+    """
+
+    def __init__(self, submit, render, gate=None, controller=None, camera_id='0', timeout=None):
+        """
+        Args:
+            submit (callable): frame -> Future con las detecciones (N, 6) (p. ej. FairScheduler.submit);
+                si lanza o termina con InferenceQueueFull se reutilizan las últimas detecciones
+            render (callable): (frame, detecciones) -> frame anotado (p. ej. agent.render)
+            gate (MotionGate): Detector de cambios (None = inferir siempre que el controlador lo permita)
+            controller (AdaptiveRateController): Control de la tasa (None = sin límite)
+            camera_id (str): Nombre de la cámara en las métricas
+            timeout (float): Segundos tras los que una inferencia sin respuesta se cancela (None = sin límite)
+        """
+        self.submit = submit
+        self.render = render
+        self.gate = gate
+        self.controller = controller
+        self.camera_id = camera_id
+        self.timeout = timeout
+        self._detections = None
+        self._pending = None # Future de la inferencia en curso
+        self._pending_since = 0.0
+        self._lock = threading.Lock()
+        self._inferred = 0
+        self._reused = 0
+
+    def __call__(self, frame):
+        now = time.monotonic()
+        with self._lock:
+            pending = self._pending
+            detections = self._detections
+            expired = None
+            if pending is not None and self.timeout and now - self._pending_since > self.timeout:
+                expired, self._pending, pending = pending, None, None
+        if expired is not None:
+            expired.cancel() # Si aún espera turno no gasta inferencia
+            self._congested()
+
+        run = pending is None and (detections is None or (
+            (self.controller is None or self.controller.ready(now))
+            and (self.gate is None or self.gate.changed(frame, now))
+        ))
+        if run:
+            run = self._start(frame, now)
+
+        with self._lock:
+            if run:
+                self._inferred += 1
+            else:
+                self._reused += 1
+        LIVE_FRAMES.inc(camera=self.camera_id, action='inferred' if run else 'reused')
+        # Antes de la primera detección el frame se publica sin cajas
+        return self.render(frame, _NO_DETECTIONS if detections is None else detections)
+
+    def _start(self, frame, now) -> bool:
+        """Envía el frame a inferir sin esperar el resultado; False si la cola está llena"""
+        if self.controller is not None:
+            self.controller.started(now)
+        # El frame puede ser una vista del anillo de la cámara, que se reescribe antes de que termine la IA
+        frame = frame.copy()
+        try:
+            future = self.submit(frame)
+        except InferenceQueueFull:
+            self._congested()
+            return False
+        with self._lock:
+            self._pending = future
+            self._pending_since = now
+        future.add_done_callback(partial(self._on_done, frame, now))
+        return True
+
+    def _on_done(self, frame, started, future):
+        """Al terminar la inferencia (en el hilo que la resolvió): nuevas detecciones, tasa y referencia"""
+        with self._lock:
+            if self._pending is not future:
+                return # Vencida (ver timeout): ya se contó como congestión
+            self._pending = None
+        if future.cancelled():
+            return
+        error = future.exception()
+        if isinstance(error, InferenceQueueFull):
+            self._congested() # Cola llena o reemplazado por un frame más nuevo
+            return
+        if error is not None:
+            print(f"Error en la inferencia de la cámara '{self.camera_id}': {error}")
+            return
+        if self.controller is not None:
+            self.controller.record(time.monotonic() - started)
+        if self.gate is not None:
+            self.gate.set_reference(frame, started)
+        with self._lock:
+            self._detections = future.result()
+
+    def _congested(self):
+        """La inferencia fue rechazada o no respondió a tiempo: bajar la tasa y seguir con las últimas cajas"""
+        if self.controller is not None:
+            self.controller.overloaded()
+
+    def stats(self) -> dict:
+        """Frames con inferencia nueva, frames con detecciones reutilizadas y FPS de inferencia actuales"""
+        with self._lock:
+            data = {'frames_inferred': self._inferred, 'frames_reused': self._reused}
+        if self.controller is not None:
+            data['inference_fps'] = round(self.controller.fps, 2)
+        return data
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+
+from .models import InspectionReportDTO
+
+class WriteBehindQueue:
+    """
+    Buffer de escritura diferida para los reportes de inspección
+
+    La petición web solo encola el DTO (no espera a la base de datos).
+    Un hilo de fondo vacía el buffer con un solo executemany por lote
+    cuando se juntan 'batch_size' reportes o pasan 'flush_interval' segundos.
+
+    Si la base de datos no está disponible, el lote se guarda en un archivo
+    local de solo-agregar (JSON Lines) y se reenvía cuando la base vuelve
+    """
+
+    def __init__(self, db_conn, spill_path, batch_size=50, flush_interval=2.0, replay_interval=30.0):
+        """
+        Args:
+            db_conn (DatabaseConnection): Conexión con save_inspections(lista)
+            spill_path (str): Archivo local donde se guardan los lotes no persistidos
+            batch_size (int): Reportes que disparan un vaciado inmediato
+            flush_interval (float): Segundos máximos que un reporte espera en el buffer
+            replay_interval (float): Segundos entre reintentos del archivo local
+        """
+        self.db_conn = db_conn
+        self.spill_path = spill_path
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.replay_interval = replay_interval
+
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._running = False
+        self._closed = False # close() ya se llamó: lo que llegue después va directo al archivo local
+        self._thread = None
+        self._last_replay = 0.0
+        self._io_lock = threading.Lock() # Un solo vaciado/derivación a la vez (hilo propio o flush)
+        self._inflight = 0 # Reportes que el hilo de fondo sacó del buffer y aún está guardando
+
+        # Estadísticas
+        self._flushed = 0
+        self._spilled = 0
+        self._replayed = 0
+        self._errors = 0
+        self._invalid_lines = 0
+
+    def start(self):
+        """Inicia el hilo de escritura (reenvía primero lo pendiente en disco)"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print(f"Escritura diferida de reportes iniciada (lote {self.batch_size}, cada {self.flush_interval} s)")
+
+    def enqueue(self, inspection: InspectionReportDTO):
+        """
+        Agrega un reporte al buffer (no bloquea)
+
+        Después de close() ya no hay hilo que vacíe el buffer: el reporte
+        se guarda en el archivo local y se reenvía en el próximo start()
+        """
+        with self._cond:
+            closed = self._closed
+            if not closed:
+                self._buffer.append(inspection)
+                if len(self._buffer) >= self.batch_size:
+                    self._cond.notify_all()
+        if closed:
+            print("Reporte recibido con la escritura diferida detenida: se guarda en disco")
+            with self._io_lock:
+                self._spill([inspection])
+
+    def flush(self):
+        """
+        Vacía el buffer de inmediato en el hilo que llama
+
+        Al volver, todo lo encolado antes está en la base de datos o
+        en el archivo local (lo usa el procesamiento por lotes antes de
+        marcar imágenes como terminadas)
+        """
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._flush(batch)
+        # Esperar también el lote que el hilo de fondo pudiera estar guardando
+        with self._cond:
+            self._cond.wait_for(lambda: self._inflight == 0)
+
+    def close(self):
+        """Detiene el hilo y vacía todo lo pendiente (o lo guarda en disco)"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        print("Escritura diferida de reportes detenida")
+
+    def stats(self) -> dict:
+        """Reportes pendientes, guardados, derivados a disco y reenviados"""
+        with self._cond:
+            return {
+                'pending': len(self._buffer),
+                'flushed': self._flushed,
+                'spilled': self._spilled,
+                'replayed': self._replayed,
+                'errors': self._errors,
+                'invalid_lines': self._invalid_lines,
+                'spill_file_pending': os.path.exists(self.spill_path),
+                'writer_alive': self._thread is not None and self._thread.is_alive(),
+            }
+
+    def _run(self):
+        """
+        Bucle del hilo de escritura
+
+        Un error en un vaciado o en un reenvío se anota y el bucle sigue:
+        si el hilo muriera, los reportes se acumularían en memoria sin guardarse
+        """
+        self._replay_spill()
+        while True:
+            with self._cond:
+                if self._running and len(self._buffer) < self.batch_size:
+                    self._cond.wait(timeout=self.flush_interval)
+                batch, self._buffer = self._buffer, []
+                self._inflight = len(batch)
+                running = self._running
+
+            if batch:
+                try:
+                    self._flush(batch)
+                finally:
+                    with self._cond:
+                        self._inflight = 0
+                        self._cond.notify_all()
+            if time.monotonic() - self._last_replay >= self.replay_interval:
+                self._replay_spill()
+            if not running:
+                break
+
+    def _flush(self, batch):
+        """Guarda un lote en la base o, si falla (o lanza una excepción), en el archivo local"""
+        with self._io_lock:
+            try:
+                saved = self.db_conn.save_inspections(batch)
+            except Exception as e:
+                print(f"Error al guardar {len(batch)} reportes: {e}")
+                with self._cond:
+                    self._errors += 1
+                saved = False
+            if saved:
+                with self._cond:
+                    self._flushed += len(batch)
+            else:
+                self._spill(batch)
+
+    def _spill(self, batch):
+        """Agrega el lote al archivo local de pendientes"""
+        try:
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for inspection in batch:
+                    f.write(json.dumps(inspection.to_dict()) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            with self._cond:
+                self._spilled += len(batch)
+            print(f"Base de datos no disponible: {len(batch)} reportes guardados en '{self.spill_path}'")
+        except OSError as e:
+            print(f"Error fatal: no se pudieron guardar {len(batch)} reportes en disco: {e}")
+            with self._cond:
+                self._errors += 1
+
+    def _replay_spill(self):
+        """Reenvía a la base de datos los reportes guardados en el archivo local"""
+        with self._io_lock:
+            try:
+                self._replay_spill_locked()
+            except Exception as e:
+                # Lo que quedó en el '.replay' se vuelve a intentar en el próximo reenvío
+                print(f"Error al reenviar los reportes de '{self.spill_path}': {e}")
+                with self._cond:
+                    self._errors += 1
+
+    def _replay_spill_locked(self):
+        self._last_replay = time.monotonic()
+
+        # Mover el archivo antes de leerlo: lo que falle se vuelve a agregar al original
+        # (si quedó un '.replay' de una ejecución interrumpida, se procesa ese primero)
+        replay_path = self.spill_path + '.replay'
+        if not os.path.exists(replay_path):
+            if not os.path.exists(self.spill_path):
+                return
+            try:
+                os.replace(self.spill_path, replay_path)
+            except FileNotFoundError:
+                return # Otro proceso lo tomó antes
+
+        pending, invalid = [], []
+        with open(replay_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    pending.append(InspectionReportDTO.from_dict(json.loads(line)))
+                except (ValueError, TypeError, KeyError) as e:
+                    print(f"Línea inválida en '{replay_path}' apartada en '{self.spill_path}.invalid': {e}")
+                    invalid.append(line)
+        if invalid:
+            # En cuarentena (para revisarlas a mano) en lugar de perderlas o reintentarlas siempre
+            with open(self.spill_path + '.invalid', 'a', encoding='utf-8') as f:
+                f.write('\n'.join(invalid) + '\n')
+            with self._cond:
+                self._invalid_lines += len(invalid)
+
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            if not self.db_conn.save_inspections(batch):
+                # La base sigue caída: devolver el resto al archivo de pendientes
+                self._spill(pending[start:])
+                with self._cond:
+                    self._spilled -= len(pending) - start # No son reportes nuevos
+                break
+            with self._cond:
+                self._replayed += len(batch)
+        try:
+            os.remove(replay_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,78 @@
+"""
+Dibujo de detecciones sobre un frame
+
+Las detecciones llegan como un array (N, 6): x1, y1, x2, y2, confianza, clase
+
+- 'ultralytics': mismo aspecto que Results.plot() (Annotator de ultralytics)
+- 'opencv': solo cv2.rectangle/putText, bastante más barato en blísteres con muchas cavidades
+
+Si ultralytics no está instalado (p. ej. solo ONNX Runtime) se usa 'opencv'
+"""
+import importlib.util
+
+import cv2
+import numpy as np
+
+# Primeros colores de la paleta de ultralytics (en BGR), para que ambos renderers se parezcan
+PALETTE = [
+    (56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+    (10, 249, 72), (23, 204, 146), (134, 219, 61), (52, 147, 26), (187, 212, 0),
+]
+
+def _line_width(frame: np.ndarray) -> int:
+    """Grosor de línea proporcional al tamaño de la imagen (misma fórmula que ultralytics)"""
+    return max(round(sum(frame.shape[:2]) / 2 * 0.003), 2)
+
+def draw_detections_opencv(frame: np.ndarray, detections: np.ndarray, names: dict) -> np.ndarray:
+    """Dibuja cajas y etiquetas solo con OpenCV sobre una copia del frame"""
+    canvas = frame.copy()
+    if len(detections) == 0:
+        return canvas
+
+    lw = _line_width(canvas)
+    font_scale = lw / 3
+    thickness = max(lw - 1, 1)
+    boxes = detections[:, :4].astype(np.int32)
+    confs = detections[:, 4]
+    cls_ids = detections[:, 5].astype(np.int32)
+
+    for (x1, y1, x2, y2), conf, cls_id in zip(boxes.tolist(), confs.tolist(), cls_ids.tolist()):
+        color = PALETTE[cls_id % len(PALETTE)]
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), color, lw, cv2.LINE_AA)
+
+        label = f"{names.get(cls_id, cls_id)} {conf:.2f}"
+        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+        outside = y1 >= th + 3 # Etiqueta encima de la caja si cabe
+        y_text = y1 - 2 if outside else y1 + th + 2
+        cv2.rectangle(canvas, (x1, y1), (x1 + tw, y1 - th - 3 if outside else y1 + th + 3), color, -1, cv2.LINE_AA)
+        cv2.putText(canvas, label, (x1, y_text), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                    (255, 255, 255), thickness, cv2.LINE_AA)
+    return canvas
+
+def draw_detections_ultralytics(frame: np.ndarray, detections: np.ndarray, names: dict) -> np.ndarray:
+    """Dibuja las detecciones con el Annotator de ultralytics (igual que Results.plot())"""
+    from ultralytics.utils.plotting import Annotator, colors
+
+    annotator = Annotator(frame.copy(), example=str(names))
+    for *xyxy, conf, cls_id in detections.tolist():
+        c = int(cls_id)
+        annotator.box_label(xyxy, f"{names.get(c, c)} {conf:.2f}", color=colors(c, True))
+    return annotator.result()
+
+RENDERERS = {
+    'opencv': draw_detections_opencv,
+    'ultralytics': draw_detections_ultralytics,
+}
+
+def resolve_renderer(name) -> str:
+    """Nombre del renderer que se usará: 'ultralytics' pasa a 'opencv' si ultralytics no está instalado"""
+    if name not in RENDERERS:
+        raise ValueError(f"Renderer desconocido: '{name}' (opciones: {sorted(RENDERERS)})")
+    if name == 'ultralytics' and importlib.util.find_spec('ultralytics') is None:
+        print("ultralytics no está instalado: se dibuja con el renderer 'opencv'")
+        return 'opencv'
+    return name
+
+def get_renderer(name):
+    """Devuelve la función de dibujo por nombre ('opencv' o 'ultralytics'; ver resolve_renderer)"""
+    return RENDERERS[resolve_renderer(name)]
@@ -0,0 +1,165 @@
+"""
+Caché de resultados de inspección por contenido de la imagen
+
+La misma imagen subida otra vez (reintentos, re-chequeos) con el mismo
+modelo da el mismo resultado: se guarda, por hash del archivo, las
+detecciones, la tabla de resultados y las rutas de las imágenes de
+resultado ya escritas. Un acierto evita decodificar, inferir, dibujar y
+volver a codificar los JPEG (app_cnn.py los enlaza en la carpeta del día,
+así cada reporte tiene sus propias imágenes)
+
+Las claves llevan la huella del agente (CnnInspectionAgent.fingerprint:
+archivo del modelo, confianza, tamaño de entrada, ROI/teselas, renderer),
+así que cambiar cualquiera de ellos invalida la caché sin borrar nada
+
+- Memoria: LRU acotada a 'max_entries' (las entradas son chicas: no guardan imágenes)
+- Disco (opcional): un JSON por entrada en 'disk_dir/<huella>/', sobrevive a reinicios
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from . import metrics
+
+RESULT_CACHE_LOOKUPS = metrics.counter('visionpharma_result_cache_lookups_total',
+                                       "Búsquedas en la caché de resultados", labelnames=('result',))
+
+class CachedResult:
+    """Resultado guardado: detecciones (N, 6), tabla de resultados e imágenes {paso: ruta relativa a static/}"""
+    __slots__ = ('detections', 'results', 'images')
+
+    def __init__(self, detections: np.ndarray, results: list, images: dict):
+        self.detections = detections
+        self.results = results
+        self.images = images
+
+    def to_json(self) -> dict:
+        return {'detections': self.detections.tolist(), 'results': self.results, 'images': self.images}
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'CachedResult':
+        detections = np.asarray(data['detections'], dtype=np.float32).reshape(-1, 6)
+        return cls(detections, data['results'], data['images'])
+
+class ResultCache:
+    """LRU en memoria con un nivel opcional en disco"""
+
+    def __init__(self, max_entries=256, disk_dir=None):
+        """
+        Args:
+            max_entries (int): Entradas en memoria (0 = caché desactivada)
+            disk_dir (str): Carpeta del nivel en disco (None = solo memoria)
+        """
+        self.max_entries = max(0, int(max_entries))
+        self.disk_dir = disk_dir or None
+        self._entries = OrderedDict() # (huella, clave) -> CachedResult, del menos al más reciente
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def content_key(data: bytes) -> str:
+        """Hash del contenido del archivo subido"""
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def get(self, fingerprint, key):
+        """CachedResult para la imagen 'key' con el modelo 'fingerprint', o None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get((fingerprint, key))
+            if entry is not None:
+                self._entries.move_to_end((fingerprint, key))
+                self._hits += 1
+        if entry is not None:
+            RESULT_CACHE_LOOKUPS.inc(result='hit')
+            return entry
+
+        entry = self._read_disk(fingerprint, key)
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+            else:
+                self._disk_hits += 1
+                self._store(fingerprint, key, entry)
+        RESULT_CACHE_LOOKUPS.inc(result='miss' if entry is None else 'disk_hit')
+        return entry
+
+    def put(self, fingerprint, key, detections: np.ndarray, results: list, images: dict):
+        """Guarda (o reemplaza) el resultado de la imagen 'key'"""
+        if not self.enabled:
+            return
+        entry = CachedResult(detections, results, images)
+        with self._lock:
+            self._store(fingerprint, key, entry)
+        self._write_disk(fingerprint, key, entry)
+
+    def clear_stale(self, fingerprint):
+        """Borra del disco las entradas de otras huellas (modelos o ajustes anteriores)"""
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name != fingerprint and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                print(f"Caché de resultados: entradas de la huella '{name}' eliminadas (modelo o ajustes cambiados)")
+
+    def stats(self) -> dict:
+        """Aciertos en memoria y en disco, fallos y entradas en memoria"""
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'disk_dir': self.disk_dir,
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_rate': round((self._hits + self._disk_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+    def _store(self, fingerprint, key, entry):
+        """Agrega a la LRU y descarta la menos usada si se pasa del límite (llamar con _lock)"""
+        self._entries[(fingerprint, key)] = entry
+        self._entries.move_to_end((fingerprint, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, fingerprint, key):
+        return os.path.join(self.disk_dir, fingerprint, f"{key}.json")
+
+    def _read_disk(self, fingerprint, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(fingerprint, key), encoding='utf-8') as f:
+                return CachedResult.from_json(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Entrada de caché ilegible '{key}': {e}")
+            return None
+
+    def _write_disk(self, fingerprint, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(fingerprint, key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry.to_json(), f)
+            os.replace(tmp_path, path) # Nunca se lee un JSON a medio escribir
+        except OSError as e:
+            print(f"No se pudo guardar la entrada de caché '{key}': {e}")
@@ -0,0 +1,304 @@
+"""
+Ciclo de vida de las imágenes de resultado (static/results)
+
+- dated_subdir: las imágenes nuevas van a carpetas por día (AAAA/MM/DD),
+  así ningún directorio crece sin límite
+- ThumbnailCache: miniaturas generadas al pedirlas (decodificando el JPEG
+  ya reducido) y guardadas en disco para las siguientes veces
+- RetentionSweeper: hilo que borra las imágenes más viejas que la edad
+  máxima y, si el total supera el presupuesto, las más antiguas hasta
+  entrar en él; avisa qué rutas borró para limpiar la base de datos
+"""
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+from . import metrics
+
+RESULTS_EVICTED = metrics.counter('visionpharma_results_evicted_total', "Imágenes de resultado borradas por la retención",
+                                  labelnames=('reason',))
+RESULTS_BYTES = metrics.gauge('visionpharma_results_bytes', "Bytes ocupados por las imágenes de resultado (último barrido)")
+
+# Marcadores SOF de JPEG (baseline, progresivo, etc.) donde está el tamaño de la imagen
+_JPEG_SOF_MARKERS = frozenset({0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF})
+
+def dated_subdir(when=None) -> str:
+    """Subcarpeta del día para las imágenes nuevas: 'AAAA/MM/DD'"""
+    return (when or datetime.now()).strftime('%Y/%m/%d')
+
+# Carpetas que barre la retención: las de año creadas por dated_subdir y las de los lotes
+# de la app web (batch_<id>); lo demás en static/results (p. ej. lote_<nombre> de batch_inspect.py) no se toca
+_YEAR_DIR = re.compile(r'^\d{4}$')
+_BATCH_DIR = re.compile(r'^batch_\w+$')
+
+def jpeg_size(path):
+    """(ancho, alto) leídos de la cabecera del JPEG sin decodificarlo, o None"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(65536)
+    except OSError:
+        return None
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker in _JPEG_SOF_MARKERS:
+            return int.from_bytes(data[i + 7:i + 9], 'big'), int.from_bytes(data[i + 5:i + 7], 'big')
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+class ThumbnailCache:
+    """Miniaturas de las imágenes de static/, generadas la primera vez que se piden"""
+
+    # Decodificación reducida de OpenCV: el JPEG se decodifica directamente a 1/2, 1/4 o 1/8
+    _REDUCED_READ = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+    def __init__(self, static_dir, thumbs_dir, max_width=320, jpeg_quality=80):
+        """
+        Args:
+            static_dir (str): Carpeta de las imágenes originales (static/)
+            thumbs_dir (str): Carpeta donde se guardan las miniaturas
+            max_width (int): Ancho máximo de la miniatura
+            jpeg_quality (int): Calidad JPEG de la miniatura
+        """
+        self.static_dir = os.path.abspath(static_dir)
+        self.thumbs_dir = os.path.abspath(thumbs_dir)
+        self.max_width = max(16, int(max_width))
+        self.jpeg_quality = int(jpeg_quality)
+
+    def source_path(self, relative_path):
+        """Ruta de la imagen original, o None si sale de static/"""
+        path = os.path.abspath(os.path.join(self.static_dir, relative_path))
+        if os.path.commonpath([path, self.static_dir]) != self.static_dir:
+            return None
+        return path
+
+    def thumbnail_path(self, relative_path):
+        return os.path.join(self.thumbs_dir, os.path.normpath(relative_path))
+
+    def get(self, relative_path):
+        """
+        Ruta de la miniatura de 'relative_path' (relativa a static/), creándola si
+        falta o si la original es más nueva. None si la imagen original no existe
+        """
+        source = self.source_path(relative_path)
+        if source is None or not os.path.isfile(source):
+            return None
+        thumb = self.thumbnail_path(relative_path)
+        try:
+            if os.path.getmtime(thumb) >= os.path.getmtime(source):
+                return thumb
+        except OSError:
+            pass # Aún no existe
+        return thumb if self._create(source, thumb) else None
+
+    def _create(self, source, thumb) -> bool:
+        with metrics.span('thumbnail_create'):
+            size = jpeg_size(source)
+            flag = cv2.IMREAD_COLOR
+            if size is not None:
+                # El mayor factor de reducción que deja la imagen al menos del ancho pedido
+                flag = next((f for factor, f in self._REDUCED_READ if size[0] // factor >= self.max_width), flag)
+            image = cv2.imread(source, flag)
+            if image is None:
+                print(f"No se pudo leer la imagen '{source}' para la miniatura")
+                return False
+            h, w = image.shape[:2]
+            if w > self.max_width:
+                image = cv2.resize(image, (self.max_width, max(1, round(h * self.max_width / w))),
+                                   interpolation=cv2.INTER_AREA)
+            ret, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+        if not ret:
+            return False
+        tmp_path = f"{thumb}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(thumb), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(buffer.tobytes())
+            os.replace(tmp_path, thumb)
+            return True
+        except OSError as e:
+            print(f"Error al guardar la miniatura '{thumb}': {e}")
+            return False
+
+class RetentionSweeper:
+    """
+    Borra imágenes de resultado por edad y por presupuesto de disco, en un hilo de fondo
+
+    Solo se barren las carpetas por día (AAAA/MM/DD) y las de los lotes de la
+    app web (batch_<id>): las salidas de batch_inspect.py y cualquier otro
+    archivo suelto en static/results se dejan. Dentro de ellas se borran archivos .jpg (y temporales .tmp
+    abandonados); las miniaturas de las imágenes borradas se borran con ellas
+    """
+
+    # Un .tmp más viejo que esto es de una escritura que se cortó
+    ORPHAN_TMP_AGE_S = 3600
+
+    def __init__(self, results_dir, static_dir, max_age_days=0, max_bytes=0, interval_s=3600,
+                 thumbnails=None, on_evicted=None):
+        """
+        Args:
+            results_dir (str): Carpeta a barrer (static/results)
+            static_dir (str): Carpeta base de las rutas guardadas en la base de datos (static/)
+            max_age_days (float): Edad máxima de una imagen (0 = sin límite)
+            max_bytes (int): Presupuesto total en bytes (0 = sin límite)
+            interval_s (float): Segundos entre barridos
+            thumbnails (ThumbnailCache): Miniaturas a borrar junto con sus imágenes
+            on_evicted (callable): Recibe la lista de rutas borradas, relativas a
+                static/ y con '/' (p. ej. para limpiar 'imagen_resultado')
+        """
+        self.results_dir = os.path.abspath(results_dir)
+        self.static_dir = os.path.abspath(static_dir)
+        self.max_age_s = max(0.0, float(max_age_days)) * 86400
+        self.max_bytes = max(0, int(max_bytes))
+        self.interval_s = interval_s
+        self.thumbnails = thumbnails
+        self.on_evicted = on_evicted
+        self._stop = threading.Event()
+        self._thread = None
+        self._last = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age_s > 0 or self.max_bytes > 0
+
+    def start(self):
+        """Inicia el hilo de barrido (si hay alguna política configurada)"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print(f"Retención de imágenes de resultado iniciada (cada {self.interval_s:.0f} s)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        """Política configurada y resultado del último barrido"""
+        return {
+            'max_age_days': self.max_age_s / 86400,
+            'max_bytes': self.max_bytes,
+            'last_sweep': dict(self._last),
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep_once()
+            except Exception as e:
+                print(f"Error en el barrido de imágenes de resultado: {e}")
+            self._stop.wait(self.interval_s)
+
+    def sweep_once(self) -> dict:
+        """Un barrido completo; devuelve cuántas imágenes y bytes se borraron"""
+        now = time.time()
+        files = [] # (mtime, tamaño, ruta)
+        year_dirs, batch_dirs = self._managed_dirs()
+        for path, st in self._scan(*year_dirs, *batch_dirs):
+            if path.endswith('.tmp'):
+                if now - st.st_mtime > self.ORPHAN_TMP_AGE_S:
+                    self._remove(path)
+            elif path.lower().endswith('.jpg'):
+                files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+
+        evicted, freed = [], 0
+        cutoff = now - self.max_age_s if self.max_age_s else None
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if cutoff is not None and mtime < cutoff:
+                reason = 'age'
+            elif self.max_bytes and total > self.max_bytes:
+                reason = 'size'
+            else:
+                break # Ordenadas por fecha: las siguientes son más nuevas y entran en el presupuesto
+            if self._remove(path):
+                evicted.append(path)
+                freed += size
+                total -= size
+                RESULTS_EVICTED.inc(reason=reason)
+
+        if evicted:
+            relative = [os.path.relpath(path, self.static_dir).replace(os.sep, '/') for path in evicted]
+            if self.thumbnails is not None:
+                for rel in relative:
+                    self._remove(self.thumbnails.thumbnail_path(rel))
+            for year_dir in year_dirs:
+                self._remove_empty_dirs(year_dir, keep_root=False)
+            # La carpeta de un lote se deja: el lote puede seguir escribiendo en ella (o reanudarse)
+            if self.thumbnails is not None:
+                self._remove_empty_dirs(self.thumbnails.thumbs_dir)
+            if self.on_evicted is not None:
+                self.on_evicted(relative)
+            print(f"Retención: {len(evicted)} imágenes de resultado borradas ({freed / 1e6:.1f} MB)")
+
+        RESULTS_BYTES.set(total)
+        self._last = {'time': datetime.now().isoformat(timespec='seconds'), 'files': len(files) - len(evicted),
+                      'bytes': total, 'evicted': len(evicted), 'freed_bytes': freed}
+        return self._last
+
+    def _managed_dirs(self):
+        """Carpetas de año (AAAA) y de lotes (batch_<id>) dentro de static/results"""
+        year_dirs, batch_dirs = [], []
+        try:
+            entries = list(os.scandir(self.results_dir))
+        except OSError:
+            return year_dirs, batch_dirs
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if _YEAR_DIR.match(entry.name):
+                year_dirs.append(entry.path)
+            elif _BATCH_DIR.match(entry.name):
+                batch_dirs.append(entry.path)
+        return year_dirs, batch_dirs
+
+    @staticmethod
+    def _scan(*roots):
+        """Recorre las carpetas con os.scandir (sin un stat extra por archivo en la mayoría de los sistemas)"""
+        stack = list(roots)
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue # Borrado mientras se recorría
+
+    @staticmethod
+    def _remove(path) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"No se pudo borrar '{path}': {e}")
+            return False
+
+    @staticmethod
+    def _remove_empty_dirs(root, keep_root=True):
+        """Borra las subcarpetas vacías (días ya barridos); la raíz solo si keep_root es False"""
+        for dirpath, _, _ in os.walk(root, topdown=False):
+            if dirpath != root or not keep_root:
+                try:
+                    os.rmdir(dirpath) # Falla (y se ignora) si no está vacía
+                except OSError:
+                    pass
@@ -0,0 +1,129 @@
+"""
+Servicios de una app creados al primer uso
+
+Importar app_cnn.py o app_live.py ya no carga el modelo ni conecta la base
+de datos: cada servicio (agente, servidor de inferencia, base de datos...)
+se registra con la función que lo crea y se crea la primera vez que se pide.
+Un hilo de arranque (ServiceContainer.start) los crea y precalienta en
+segundo plano mientras Flask ya acepta conexiones; una petición que llega
+antes solo espera al servicio que necesita
+
+status() dice qué está listo (la usa la ruta /ready)
+"""
+import threading
+import time
+
+class ServiceContainer:
+    """Registro de servicios perezosos: services.agent crea el agente si aún no existe"""
+
+    def __init__(self):
+        self._factories = {} # nombre -> (crear, cerrar, listo)
+        self._instances = {}
+        self._states = {} # nombre -> {'state', 'seconds', 'error'}
+        self._locks = {}
+        self._order = [] # Orden de creación (se cierran al revés)
+        self._order_lock = threading.Lock()
+        self._startup = None
+        self._started_at = time.monotonic()
+        self._startup_seconds = None
+
+    def register(self, name, factory, close=None, ready=None):
+        """
+        Args:
+            name (str): Nombre del servicio (services.<nombre>)
+            factory (callable): Crea el servicio (sin argumentos; puede pedir otros servicios)
+            close (callable): Recibe el servicio al cerrar la app
+            ready (callable): Recibe el servicio y dice si está listo (p. ej. el modelo cargó)
+        """
+        self._factories[name] = (factory, close, ready)
+        self._locks[name] = threading.Lock()
+        self._states[name] = {'state': 'pending'}
+
+    def __contains__(self, name):
+        return name in self._factories
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self.get(name)
+        except KeyError:
+            raise AttributeError(f"Servicio no registrado: '{name}'") from None
+
+    def get(self, name):
+        """El servicio, creándolo si hace falta (los hilos que lo piden a la vez esperan al mismo)"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        factory = self._factories[name][0]
+        with self._locks[name]:
+            if name in self._instances:
+                return self._instances[name]
+            self._states[name] = {'state': 'starting'}
+            start = time.perf_counter()
+            try:
+                instance = factory()
+            except Exception as e:
+                self._states[name] = {'state': 'error', 'error': str(e)}
+                raise
+            self._states[name] = {'state': 'created', 'seconds': round(time.perf_counter() - start, 3)}
+            self._instances[name] = instance
+            with self._order_lock:
+                self._order.append(name)
+        return instance
+
+    def created(self, name) -> bool:
+        """True si el servicio ya existe (sin crearlo)"""
+        return name in self._instances
+
+    def start(self, warmup):
+        """
+        Ejecuta 'warmup' (crea y precalienta los servicios) en un hilo de fondo;
+        las peticiones se atienden mientras tanto
+        """
+        def run():
+            try:
+                warmup()
+            except Exception as e:
+                print(f"Error al iniciar los servicios: {e}")
+            self._startup_seconds = round(time.monotonic() - self._started_at, 3)
+            print(f"Arranque de servicios terminado en {self._startup_seconds} s")
+        self._startup = threading.Thread(target=run, daemon=True)
+        self._startup.start()
+
+    def wait(self, timeout=None) -> bool:
+        """Espera a que termine el hilo de arranque; True si terminó"""
+        if self._startup is None:
+            return True
+        self._startup.join(timeout)
+        return not self._startup.is_alive()
+
+    def status(self) -> dict:
+        """Estado de cada servicio y si la app está lista (todos creados y en condiciones)"""
+        services = {}
+        for name, (_, _, ready) in self._factories.items():
+            state = dict(self._states[name])
+            if state['state'] == 'created':
+                ok = ready is None or bool(ready(self._instances[name]))
+                state['state'] = 'ready' if ok else 'not_ready'
+            services[name] = state
+        return {
+            'ready': all(s['state'] == 'ready' for s in services.values()),
+            'startup_s': self._startup_seconds,
+            'uptime_s': round(time.monotonic() - self._started_at, 1),
+            'services': services,
+        }
+
+    def close(self):
+        """Cierra los servicios creados, en orden inverso al de creación"""
+        with self._order_lock:
+            order, self._order = self._order, []
+        for name in reversed(order):
+            close = self._factories[name][1]
+            instance = self._instances.pop(name)
+            self._states[name] = {'state': 'pending'}
+            if close is not None:
+                try:
+                    close(instance)
+                except Exception as e:
+                    print(f"Error al cerrar el servicio '{name}': {e}")
@@ -0,0 +1,369 @@
+"""
+Backends de almacenamiento para DatabaseConnection
+
+Todos exponen la misma interfaz que usa DatabaseConnection:
+    backend.get_connection() / backend.release_connection(conn, broken) -> conexión DB-API 2.0 (o None)
+    backend.is_disconnect(error) -> True si el error dejó la conexión inservible (no se devuelve al pool)
+    backend.ensure_schema(cursor) -> crea la tabla 'inspections' y sus índices
+    backend.adapt_query(sql) -> la consulta (escrita con %s) en el estilo de parámetros del driver
+    backend.hour_bucket(column) -> expresión SQL que trunca una fecha a la hora ('AAAA-MM-DD HH:00:00')
+    backend.ignore_duplicates(column) -> final de un INSERT que omite las filas con 'column' (única) repetida
+    backend.errors -> excepciones del driver que se capturan
+
+- MySQLBackend: servidor MySQL/MariaDB (mysql-connector-python), el modo original
+- PostgreSQLBackend: servidor PostgreSQL (psycopg2)
+- SQLiteBackend: archivo local en modo WAL, sin servidor (PCs de línea)
+
+Los drivers se importan al crear el backend: con SQLite no hace falta
+tener instalado ningún conector
+"""
+import os
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+
+class StorageBackend:
+    """
+    Base común: limita las conexiones prestadas a 'pool_size' y espera
+    hasta 'pool_timeout' segundos por una libre (los pools de los drivers
+    fallan de inmediato cuando se agotan)
+    """
+    name = None
+    errors = ()
+    INDEXES = {}
+    # Índices únicos (clave_origen: un lote reanudado no duplica reportes; admite varios NULL)
+    UNIQUE_INDEXES = {
+        'uq_inspections_clave_origen': '(clave_origen)',
+    }
+
+    def __init__(self, pool_size=5, pool_timeout=10.0):
+        self.pool_size = max(1, int(pool_size))
+        self.pool_timeout = pool_timeout
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+
+    def get_connection(self):
+        """Conexión del pool, o None si no hay una libre a tiempo o el servidor no responde"""
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            print(f"Pool de {self.name} agotado: ninguna conexión libre en {self.pool_timeout} s")
+            return None
+        try:
+            conn = self._connect()
+        except self.errors as e:
+            print(f"Error al obtener conexión de {self.name}: {e}")
+            conn = None
+        if conn is None:
+            self._slots.release()
+        return conn
+
+    def release_connection(self, conn, broken=False):
+        """Devuelve una conexión al pool ('broken': se perdió la conexión, el pool la descarta)"""
+        if conn is None:
+            return
+        try:
+            self._release(conn, broken)
+        except self.errors as e:
+            print(f"Error al devolver la conexión al pool: {e}")
+        finally:
+            self._slots.release()
+
+    def adapt_query(self, sql):
+        return sql
+
+    def ensure_schema(self, cursor):
+        raise NotImplementedError
+
+    def hour_bucket(self, column):
+        raise NotImplementedError
+
+    def ignore_duplicates(self, column):
+        return f" ON CONFLICT ({column}) DO NOTHING" # PostgreSQL y SQLite
+
+    def is_disconnect(self, error):
+        return False
+
+    def close(self):
+        """Cierra las conexiones del pool"""
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _release(self, conn, broken=False):
+        raise NotImplementedError
+
+class MySQLBackend(StorageBackend):
+    """Servidor MySQL/MariaDB con el pool de mysql-connector"""
+    name = 'mysql'
+    # InnoDB agrega el id al final de cada índice secundario, así sirven para la paginación (timestamp, id)
+    INDEXES = {
+        'idx_inspections_timestamp': '(timestamp)',
+        'idx_inspections_estado_timestamp': '(estado_final, timestamp)',
+        'idx_inspections_imagen': '(imagen_resultado)',
+    }
+
+    def __init__(self, database, user, password, host, port=3306, pool_size=5, pool_timeout=10.0, connect_timeout=5):
+        import mysql.connector
+        from mysql.connector import pooling
+        super().__init__(pool_size, pool_timeout)
+        self._mysql = mysql.connector
+        self._pooling = pooling
+        self.errors = (mysql.connector.Error,)
+        self.database = database
+        self.host = host
+        self._pool_config = {
+            "pool_name": "visionpharma_pool",
+            "pool_size": self.pool_size,
+            "database": database,
+            "user": user,
+            "password": password,
+            "host": host,
+            "port": port,
+            "connection_timeout": connect_timeout,
+        }
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._initialize_pool()
+
+    def _initialize_pool(self):
+        try:
+            print(f"Creando pool de conexiones para MySQL: {self.database} en {self.host}...")
+            self._pool = self._pooling.MySQLConnectionPool(**self._pool_config)
+            print("Pool de conexiones MySQL creado exitosamente")
+        except self._mysql.Error as error:
+            print(f"Error al inicializar el pool de conexiones MySQL: {error}")
+            self._pool = None
+
+    def _connect(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    print("Pool no inicializado, intentando reconectar...")
+                    self._initialize_pool()
+        if self._pool is None:
+            return None
+        return self._pool.get_connection()
+
+    def _release(self, conn, broken=False):
+        conn.close() # En una conexión del pool, close() la devuelve al pool (que reconecta si se perdió)
+
+    def ensure_schema(self, cursor):
+        index_definitions = ''.join(f",\n                INDEX {name} {columns}" for name, columns in self.INDEXES.items())
+        index_definitions += ''.join(f",\n                UNIQUE INDEX {name} {columns}" for name, columns in self.UNIQUE_INDEXES.items())
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS inspections (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                timestamp DATETIME NOT NULL,
+                total_pastillas INT NOT NULL,
+                total_vacios INT NOT NULL,
+                estado_final VARCHAR(50) NOT NULL,
+                imagen_resultado VARCHAR(255),
+                clave_origen VARCHAR(64){index_definitions}
+            )
+        """)
+        # Agregar la columna y los índices que falten en una tabla creada por una versión anterior
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'inspections' AND column_name = 'clave_origen'
+        """)
+        if not cursor.fetchone()[0]:
+            cursor.execute("ALTER TABLE inspections ADD COLUMN clave_origen VARCHAR(64)")
+        cursor.execute("""
+            SELECT DISTINCT index_name FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'inspections'
+        """)
+        existing = {row[0] for row in cursor.fetchall()}
+        for name, columns in self.INDEXES.items():
+            if name not in existing:
+                print(f"Creando índice '{name}' en 'inspections' (puede tardar en tablas grandes)...")
+                cursor.execute(f"ALTER TABLE inspections ADD INDEX {name} {columns}")
+        for name, columns in self.UNIQUE_INDEXES.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE inspections ADD UNIQUE INDEX {name} {columns}")
+
+    def hour_bucket(self, column):
+        # (los % del formato van duplicados porque la consulta lleva parámetros)
+        return f"DATE_FORMAT({column}, '%%Y-%%m-%%d %%H:00:00')"
+
+    def ignore_duplicates(self, column):
+        return f" ON DUPLICATE KEY UPDATE {column} = {column}" # Sin cambios (INSERT IGNORE ocultaría otros errores)
+
+class PostgreSQLBackend(StorageBackend):
+    """Servidor PostgreSQL con el pool de psycopg2"""
+    name = 'postgresql'
+    # Los índices de PostgreSQL no incluyen la clave primaria: se agrega id para la paginación
+    INDEXES = {
+        'idx_inspections_timestamp': '(timestamp, id)',
+        'idx_inspections_estado_timestamp': '(estado_final, timestamp, id)',
+        'idx_inspections_imagen': '(imagen_resultado)',
+    }
+
+    def __init__(self, database, user, password, host, port=5432, pool_size=5, pool_timeout=10.0, connect_timeout=5):
+        import psycopg2
+        from psycopg2 import pool
+        super().__init__(pool_size, pool_timeout)
+        self.errors = (psycopg2.Error,)
+        self._disconnect_errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+        self.database = database
+        self.host = host
+        self._pool_class = pool.ThreadedConnectionPool
+        self._connect_kwargs = {
+            "dbname": database,
+            "user": user,
+            "password": password,
+            "host": host,
+            "port": port,
+            "connect_timeout": connect_timeout,
+        }
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _connect(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    print(f"Creando pool de conexiones para PostgreSQL: {self.database} en {self.host}...")
+                    self._pool = self._pool_class(1, self.pool_size, **self._connect_kwargs)
+                    print("Pool de conexiones PostgreSQL creado exitosamente")
+        return self._pool.getconn()
+
+    def _release(self, conn, broken=False):
+        # Una conexión perdida (servidor reiniciado, red caída) se cierra en lugar de volver al pool:
+        # si volviera, la siguiente petición fallaría con la misma conexión muerta
+        self._pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def is_disconnect(self, error):
+        return isinstance(error, self._disconnect_errors)
+
+    def ensure_schema(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS inspections (
+                id SERIAL PRIMARY KEY,
+                timestamp TIMESTAMP NOT NULL,
+                total_pastillas INT NOT NULL,
+                total_vacios INT NOT NULL,
+                estado_final VARCHAR(50) NOT NULL,
+                imagen_resultado VARCHAR(255),
+                clave_origen VARCHAR(64)
+            )
+        """)
+        cursor.execute("ALTER TABLE inspections ADD COLUMN IF NOT EXISTS clave_origen VARCHAR(64)")
+        for name, columns in self.INDEXES.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON inspections {columns}")
+        for name, columns in self.UNIQUE_INDEXES.items():
+            cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON inspections {columns}")
+
+    def hour_bucket(self, column):
+        return f"to_char(date_trunc('hour', {column}), 'YYYY-MM-DD HH24:00:00')"
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+
+def _adapt_datetime(value: datetime) -> str:
+    return value.isoformat(sep=' ')
+
+def _convert_timestamp(value: bytes) -> datetime:
+    return datetime.fromisoformat(value.decode())
+
+# Fechas guardadas como texto ISO (ordenable) y leídas de vuelta como datetime
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter('TIMESTAMP', _convert_timestamp)
+
+class SQLiteBackend(StorageBackend):
+    """
+    Base de datos local en un archivo (sin servidor)
+
+    Modo WAL: las lecturas (historial) no bloquean a la escritura, y con
+    synchronous=NORMAL cada commit no espera un fsync. Los reportes llegan
+    en lotes desde la escritura diferida: un commit por lote
+    """
+    name = 'sqlite'
+    errors = (sqlite3.Error,)
+    INDEXES = {
+        'idx_inspections_timestamp': '(timestamp)',
+        'idx_inspections_estado_timestamp': '(estado_final, timestamp)',
+        'idx_inspections_imagen': '(imagen_resultado)',
+    }
+
+    def __init__(self, path, pool_size=5, pool_timeout=10.0, busy_timeout=5.0):
+        super().__init__(pool_size, pool_timeout)
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._idle = queue.LifoQueue() # Conexiones abiertas y libres (se reutilizan)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        print(f"Base de datos local SQLite: {os.path.abspath(path)}")
+
+    def _connect(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False,
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _release(self, conn, broken=False):
+        if conn.in_transaction:
+            conn.rollback() # No devolver al pool una transacción abierta
+        self._idle.put(conn)
+
+    def adapt_query(self, sql):
+        return sql.replace('%s', '?').replace('%%', '%')
+
+    def ensure_schema(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS inspections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TIMESTAMP NOT NULL,
+                total_pastillas INT NOT NULL,
+                total_vacios INT NOT NULL,
+                estado_final VARCHAR(50) NOT NULL,
+                imagen_resultado VARCHAR(255),
+                clave_origen VARCHAR(64)
+            )
+        """)
+        cursor.execute("PRAGMA table_info(inspections)")
+        if 'clave_origen' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE inspections ADD COLUMN clave_origen VARCHAR(64)")
+        for name, columns in self.INDEXES.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON inspections {columns}")
+        for name, columns in self.UNIQUE_INDEXES.items():
+            cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON inspections {columns}")
+
+    def hour_bucket(self, column):
+        return f"strftime('%%Y-%%m-%%d %%H:00:00', {column})"
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+def create_storage_backend(backend='mysql', database='visionpharma_db', user='root', password='', host='localhost',
+                           port=None, sqlite_path='data/visionpharma.db', pool_size=5, pool_timeout=10.0,
+                           connect_timeout=5):
+    """
+    Crea el backend de almacenamiento
+
+    Args:
+        backend (str): 'mysql', 'postgresql' o 'sqlite'
+        database, user, password, host, port: Conexión al servidor (MySQL/PostgreSQL)
+        sqlite_path (str): Archivo de la base local (SQLite)
+        pool_size (int): Conexiones simultáneas
+        pool_timeout (float): Segundos de espera por una conexión libre
+        connect_timeout (float): Segundos para conectar al servidor (o esperar el bloqueo en SQLite)
+    """
+    backend = backend.lower()
+    if backend == 'mysql':
+        return MySQLBackend(database, user, password, host, port=port or 3306, pool_size=pool_size,
+                            pool_timeout=pool_timeout, connect_timeout=connect_timeout)
+    if backend in ('postgresql', 'postgres'):
+        return PostgreSQLBackend(database, user, password, host, port=port or 5432, pool_size=pool_size,
+                                 pool_timeout=pool_timeout, connect_timeout=connect_timeout)
+    if backend == 'sqlite':
+        return SQLiteBackend(sqlite_path, pool_size=pool_size, pool_timeout=pool_timeout, busy_timeout=connect_timeout)
+    raise ValueError(f"Backend de almacenamiento desconocido: '{backend}'")
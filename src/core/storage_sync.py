@@ -0,0 +1,70 @@
+"""
+Sincronización de la base local (SQLite de un PC de línea) con la base central
+
+Copia los reportes en orden de id, por lotes, y guarda el último id enviado
+en un archivo junto a la base local. Si se corta entre el envío y la
+escritura de ese archivo, el último lote se vuelve a enviar (al menos una vez)
+"""
+import json
+import os
+import time
+
+from .models import InspectionReportDTO
+
+class UpstreamSync:
+    """Envía a 'upstream' los reportes de 'local' que aún no se enviaron"""
+
+    def __init__(self, local, upstream, state_path, batch_size=500):
+        """
+        Args:
+            local (DatabaseConnection): Base local (origen)
+            upstream (DatabaseConnection): Base central (destino)
+            state_path (str): Archivo con el último id enviado
+            batch_size (int): Reportes por envío
+        """
+        self.local = local
+        self.upstream = upstream
+        self.state_path = state_path
+        self.batch_size = max(1, int(batch_size))
+
+    def last_synced_id(self) -> int:
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return int(json.load(f)['last_id'])
+        except FileNotFoundError:
+            return 0
+
+    def _save_last_synced_id(self, last_id):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'last_id': last_id}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def sync_once(self) -> int:
+        """Envía todo lo pendiente; devuelve cuántos reportes se enviaron (se detiene al primer fallo)"""
+        last_id = self.last_synced_id()
+        sent = 0
+        while True:
+            rows = self.local.inspections_after(last_id, self.batch_size)
+            if not rows:
+                break
+            batch = [InspectionReportDTO(row['timestamp'], row['total_pastillas'], row['total_vacios'],
+                                         row['estado_final'], row['imagen_resultado'], row['clave_origen'])
+                     for row in rows]
+            if not self.upstream.save_inspections(batch):
+                print(f"Base central no disponible: quedan reportes desde el id {last_id + 1}")
+                break
+            last_id = rows[-1]['id']
+            self._save_last_synced_id(last_id)
+            sent += len(rows)
+        return sent
+
+    def run_forever(self, interval=60.0):
+        """Sincroniza cada 'interval' segundos (Ctrl+C para terminar)"""
+        while True:
+            sent = self.sync_once()
+            if sent:
+                print(f"{sent} reportes enviados a la base central")
+            time.sleep(interval)
@@ -0,0 +1,155 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+
+from . import metrics
+
+STREAM_FRAMES = metrics.counter('visionpharma_stream_frames_encoded_total', "JPEGs publicados en el stream en vivo",
+                                labelnames=('camera',))
+STREAM_DROPPED = metrics.counter('visionpharma_stream_frames_dropped_total',
+                                 "Frames de cámara no publicados en el stream", labelnames=('camera', 'reason'))
+STREAM_SUBSCRIBERS = metrics.gauge('visionpharma_stream_subscribers', "Clientes conectados al stream en vivo",
+                                   labelnames=('camera',))
+STREAM_LATENCY = metrics.histogram('visionpharma_stream_latency_seconds',
+                                   "Tiempo desde la captura del frame hasta su JPEG publicado", labelnames=('camera',))
+
+class LiveStreamBroadcaster:
+    """
+    Pipeline único de anotación + codificación JPEG para el stream en vivo
+
+    Un hilo de fondo espera cada frame nuevo de la cámara, lo procesa con la IA
+    y lo codifica UNA sola vez. Todos los clientes de /video_feed reciben los
+    mismos bytes. Un cliente lento no acumula cola: siempre salta al JPEG más
+    reciente. Si no hay clientes conectados, el hilo queda en pausa
+    """
+
+    def __init__(self, camera, annotate, jpeg_quality=80, frame_timeout=1.0, camera_id='0'):
+        """
+        Args:
+            camera (CameraStream): Fuente de frames
+            annotate (callable): Función frame -> frame anotado (la IA)
+            jpeg_quality (int): Calidad JPEG del stream (0-100)
+            frame_timeout (float): Espera máxima por un frame nuevo de la cámara
+            camera_id (str): Nombre de la cámara en las métricas
+        """
+        self.camera = camera
+        self.camera_id = camera_id
+        self.annotate = annotate
+        self.jpeg_quality = int(jpeg_quality)
+        self.frame_timeout = frame_timeout
+        self._frame_seq = 0 # Secuencia del último frame de cámara procesado
+
+        self._cond = threading.Condition()
+        self._seq = 0 # Número del último JPEG publicado
+        self._jpeg = None # Bytes del último JPEG publicado
+        self._subscribers = 0
+        self._running = False
+        self._thread = None
+        self._frames_encoded = 0
+
+    def start(self):
+        """Inicia el hilo del pipeline"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print(f"Hilo de difusión del stream en vivo de la cámara '{self.camera_id}' iniciado")
+
+    def stop(self):
+        """Detiene el hilo y despierta a los clientes en espera"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    @contextmanager
+    def subscribe(self):
+        """
+        Registra un cliente mientras dure el bloque 'with'
+        (el pipeline solo trabaja si hay al menos un cliente)
+        """
+        with self._cond:
+            self._subscribers += 1
+            STREAM_SUBSCRIBERS.set(self._subscribers, camera=self.camera_id)
+            self._cond.notify_all()
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+                STREAM_SUBSCRIBERS.set(self._subscribers, camera=self.camera_id)
+
+    def wait_for_jpeg(self, after_seq=0, timeout=None):
+        """
+        Espera un JPEG más nuevo que 'after_seq'
+
+        Devuelve (seq, bytes) del JPEG más reciente, o None si se agotó
+        el tiempo o el pipeline se detuvo
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after_seq or not self._running, timeout=timeout)
+            if self._seq > after_seq and self._jpeg is not None:
+                return self._seq, self._jpeg
+        return None
+
+    def stats(self) -> dict:
+        """Clientes conectados y frames codificados"""
+        with self._cond:
+            return {
+                'subscribers': self._subscribers,
+                'frames_encoded': self._frames_encoded,
+                'last_seq': self._seq,
+            }
+
+    def _run(self):
+        """Bucle del pipeline: frame -> IA -> JPEG -> difusión"""
+        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality]
+        while True:
+            # Pausa sin consumir CPU mientras no haya clientes
+            with self._cond:
+                self._cond.wait_for(lambda: self._subscribers > 0 or not self._running)
+                if not self._running:
+                    break
+
+            # Esperar un frame NUEVO de la cámara (nunca re-inferir el mismo)
+            packet = self.camera.wait_for_frame(after_seq=self._frame_seq, timeout=self.frame_timeout)
+            if packet is None:
+                continue
+
+            with packet:
+                if self._frame_seq and packet.seq > self._frame_seq + 1:
+                    # Frames que la cámara publicó mientras se procesaba el anterior
+                    STREAM_DROPPED.inc(packet.seq - self._frame_seq - 1, camera=self.camera_id, reason='skipped')
+                self._frame_seq = packet.seq
+                try:
+                    with metrics.span('stream_annotate'):
+                        final_frame = self.annotate(packet.frame)
+                except Exception as e:
+                    print(f"Error en el procesamiento de IA del frame: {e}")
+                    final_frame = packet.frame
+
+                if final_frame is None:
+                    # El frame se descartó (p. ej. cola de inferencia llena)
+                    STREAM_DROPPED.inc(camera=self.camera_id, reason='inference_busy')
+                    continue
+
+                with metrics.span('stream_encode'):
+                    ret, buffer = cv2.imencode('.jpg', final_frame, encode_params)
+            if not ret:
+                print("Error al codificar frame como JPEG")
+                STREAM_DROPPED.inc(camera=self.camera_id, reason='encode_error')
+                continue
+
+            with self._cond:
+                self._seq += 1
+                self._jpeg = buffer.tobytes()
+                self._frames_encoded += 1
+                self._cond.notify_all()
+            STREAM_FRAMES.inc(camera=self.camera_id)
+            STREAM_LATENCY.observe(time.time() - packet.timestamp, camera=self.camera_id)
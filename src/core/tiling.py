@@ -0,0 +1,131 @@
+"""
+Región de interés y teselado para imágenes de alta resolución
+
+Con imágenes grandes (cámaras de línea), el modelo recibe el frame
+reducido a su tamaño de entrada y las pastillas pequeñas se pierden.
+Aquí se recorta opcionalmente la zona de la bandeja (ROI) y se divide en
+teselas solapadas que el modelo procesa a resolución completa; las
+detecciones se devuelven en coordenadas del frame original y se fusionan
+con NMS entre teselas (una pastilla cortada por el borde de una tesela
+también aparece completa en la vecina)
+"""
+import numpy as np
+
+from .inference_backends import nms
+
+def parse_roi(value):
+    """
+    Convierte 'x,y,ancho,alto' (o una tupla) en una tupla de enteros
+
+    Devuelve None si no hay ROI o si el valor no es válido
+    """
+    if not value:
+        return None
+    try:
+        parts = value.split(',') if isinstance(value, str) else value
+        x, y, w, h = (int(float(p)) for p in parts)
+    except (TypeError, ValueError):
+        print(f"ROI inválida: '{value}' (se espera x,y,ancho,alto), se usa el frame completo")
+        return None
+    if w <= 0 or h <= 0 or x < 0 or y < 0:
+        print(f"ROI inválida: '{value}' (ancho y alto deben ser positivos), se usa el frame completo")
+        return None
+    return x, y, w, h
+
+def tile_origins(length, tile_size, overlap):
+    """Posiciones de inicio de las teselas en un eje (la última queda alineada al borde)"""
+    if length <= tile_size:
+        return [0]
+    step = max(1, tile_size - overlap)
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+class TilePlanner:
+    """
+    Divide cada frame en las regiones que se envían al modelo y
+    devuelve las detecciones de esas regiones al frame original
+
+    Sin ROI y sin teselas, cada frame es una única región (el frame tal cual)
+    """
+
+    # Dos cajas de la misma clase se fusionan si la intersección cubre este
+    # porcentaje de la más chica (IoU no sirve: una caja cortada en el borde
+    # de una tesela tiene poco IoU con la caja completa de la vecina)
+    MERGE_THRESHOLD = 0.6
+
+    def __init__(self, roi=None, tile_size=0, overlap=0.2):
+        """
+        Args:
+            roi: Región 'x,y,ancho,alto' (str o tupla) a inspeccionar; None = frame completo
+            tile_size (int): Lado de las teselas en píxeles; 0 = sin teselas
+            overlap (float): Solape entre teselas vecinas, como fracción del lado
+                (debe cubrir al menos el tamaño de una pastilla)
+        """
+        self.roi = parse_roi(roi)
+        self.tile_size = max(0, int(tile_size))
+        self.overlap = int(self.tile_size * min(max(float(overlap), 0.0), 0.9))
+        self._checked_sizes = {} # (ancho, alto) del frame -> ROI ya validada para ese tamaño
+
+    def _roi_bounds(self, w, h):
+        """
+        Límites (x0, y0, x1, y1) de la ROI dentro de un frame de w x h
+
+        Si la ROI queda fuera del frame (p. ej. configurada para otra cámara)
+        se usa el frame completo; si sale en parte, solo la parte que cae
+        dentro. Se avisa una vez por tamaño de frame
+        """
+        bounds = self._checked_sizes.get((w, h))
+        if bounds is None:
+            rx, ry, rw, rh = self.roi
+            x0, y0, x1, y1 = rx, ry, min(rx + rw, w), min(ry + rh, h)
+            if x0 >= w or y0 >= h:
+                print(f"ROI {self.roi} fuera del frame de {w}x{h}, se usa el frame completo")
+                x0, y0, x1, y1 = 0, 0, w, h
+            elif (x1, y1) != (rx + rw, ry + rh):
+                print(f"ROI {self.roi} sale del frame de {w}x{h}, se usa solo {x0},{y0},{x1 - x0},{y1 - y0}")
+            bounds = self._checked_sizes[(w, h)] = (x0, y0, x1, y1)
+        return bounds
+
+    @property
+    def active(self) -> bool:
+        return self.roi is not None or self.tile_size > 0
+
+    def regions(self, frame: np.ndarray) -> list[tuple[np.ndarray, int, int]]:
+        """Vistas (sin copia) del frame a procesar, con su desplazamiento (x, y)"""
+        h, w = frame.shape[:2]
+        x0, y0, x1, y1 = 0, 0, w, h
+        if self.roi is not None:
+            x0, y0, x1, y1 = self._roi_bounds(w, h)
+
+        if self.tile_size <= 0:
+            return [(frame[y0:y1, x0:x1], x0, y0)]
+
+        return [
+            (frame[y0 + ty:y0 + ty + self.tile_size, x0 + tx:x0 + tx + self.tile_size], x0 + tx, y0 + ty)
+            for ty in tile_origins(y1 - y0, self.tile_size, self.overlap)
+            for tx in tile_origins(x1 - x0, self.tile_size, self.overlap)
+        ]
+
+    def merge(self, detections_per_region: list[np.ndarray], offsets: list[tuple[int, int]]) -> np.ndarray:
+        """Une las detecciones (N, 6) de las regiones de un frame en coordenadas del frame"""
+        shifted = []
+        for detections, (dx, dy) in zip(detections_per_region, offsets):
+            if len(detections) == 0:
+                continue
+            detections = detections.copy()
+            detections[:, [0, 2]] += dx
+            detections[:, [1, 3]] += dy
+            shifted.append(detections)
+
+        if not shifted:
+            return np.zeros((0, 6), dtype=np.float32)
+        merged = np.concatenate(shifted).astype(np.float32, copy=False)
+        if len(shifted) == 1:
+            return merged
+
+        # NMS entre teselas, por clase (desplazando las cajas de cada clase más allá del frame)
+        boxes = merged[:, :4] + merged[:, 5:6] * (merged[:, :4].max() + 1)
+        keep = nms(boxes, merged[:, 4], self.MERGE_THRESHOLD, metric='ios')
+        # Conservar el orden de las regiones (los IDs de la tabla siguen ese orden)
+        return merged[np.sort(keep)]
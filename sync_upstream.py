@@ -0,0 +1,54 @@
+"""
+Envía los reportes guardados en la base local (SQLite) a la base central
+(MySQL o PostgreSQL)
+
+La base local es la configurada con VISIONPHARMA_SQLITE_PATH; la central usa
+VISIONPHARMA_DB_HOST, VISIONPHARMA_DB_NAME, VISIONPHARMA_DB_USER, etc.
+
+Uso:
+    python sync_upstream.py --upstream mysql
+    python sync_upstream.py --upstream postgresql --interval 60
+"""
+import argparse
+
+from src.core import config
+from src.core.database import DatabaseConnection
+from src.core.storage_backends import create_storage_backend
+from src.core.storage_sync import UpstreamSync
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincroniza la base local SQLite con la base central")
+    parser.add_argument('--upstream', required=True, choices=('mysql', 'postgresql'), help="Motor de la base central")
+    parser.add_argument('--batch-size', type=int, default=500, help="Reportes por envío")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="Repetir cada N segundos (0 = sincronizar una vez y salir)")
+    args = parser.parse_args()
+
+    local = DatabaseConnection(create_storage_backend('sqlite', sqlite_path=config.SQLITE_PATH,
+                                                      pool_size=1, pool_timeout=config.DB_POOL_TIMEOUT_S))
+    upstream = DatabaseConnection(create_storage_backend(args.upstream,
+                                                         database=config.DB_NAME,
+                                                         user=config.DB_USER,
+                                                         password=config.DB_PASSWORD,
+                                                         host=config.DB_HOST,
+                                                         port=config.DB_PORT or None,
+                                                         pool_size=1,
+                                                         pool_timeout=config.DB_POOL_TIMEOUT_S,
+                                                         connect_timeout=config.DB_CONNECT_TIMEOUT_S))
+    local.initialize()
+    upstream.initialize()
+
+    sync = UpstreamSync(local, upstream, state_path=config.SQLITE_PATH + '.sync', batch_size=args.batch_size)
+    try:
+        if args.interval > 0:
+            sync.run_forever(args.interval)
+        else:
+            print(f"{sync.sync_once()} reportes enviados a la base central")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        local.close()
+        upstream.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import threading
+
+import numpy as np
+import pytest
+
+class FakeModel:
+    name = 'falso'
+
+class GatedAgent:
+    """
+    Agente falso para MicroBatcher: cada lote espera a que el test abra 'gate'
+    y devuelve una caja con el primer píxel de cada frame ('entered' avisa que
+    un lote ya llegó a la inferencia; 'seen' anota los frames inferidos)
+    """
+    max_batch_size = 1
+    max_wait_ms = 0.0
+    model = FakeModel()
+    model_digest = 'abc123'
+    class_names = {0: 'Pastilla', 1: 'Vacio'}
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.entered = threading.Event()
+        self.seen = []
+
+    def detect(self, frames):
+        self.entered.set()
+        self.gate.wait(5)
+        self.seen.extend(int(frame.flat[0]) for frame in frames)
+        return [np.full((1, 6), frame.flat[0], dtype=np.float32) for frame in frames]
+
+@pytest.fixture
+def gated_agent():
+    agent = GatedAgent()
+    yield agent
+    agent.gate.set() # No dejar hilos de inferencia esperando al terminar el test
@@ -0,0 +1,107 @@
+import json
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+from src.core.batch_runner import BatchInspectionRunner, BatchJournal, DirectorySource
+from src.core.database import DatabaseConnection
+from src.core.persistence_queue import WriteBehindQueue
+from src.core.storage_backends import SQLiteBackend
+
+class FakeWriter:
+    """ResultImageWriter falso: anota las rutas y da cada escritura por hecha"""
+
+    def __init__(self):
+        self.paths = []
+
+    def submit(self, path, image):
+        self.paths.append(path)
+        future = Future()
+        future.set_result(True)
+        return future
+
+def make_images(folder, count):
+    folder.mkdir()
+    for n in range(count):
+        cv2.imwrite(str(folder / f"img_{n}.png"), np.full((8, 8, 3), n, dtype=np.uint8))
+    (folder / 'rota.jpg').write_bytes(b'no es una imagen')
+
+def make_runner(tmp_path, journal, infer, progress=None, persistence=None, checkpoint_every=1):
+    return BatchInspectionRunner(infer, FakeWriter(), str(tmp_path / 'out'), 'results/lote', journal=journal,
+                                 persistence=persistence, batch_size=1, decode_workers=2,
+                                 checkpoint_every=checkpoint_every, progress=progress)
+
+def infer_pills(frames, outputs):
+    return [(frame, {'final_contours': frame}, [{'status': 'Pastilla'}]) for frame in frames]
+
+def journal_sources(path):
+    with open(path, encoding='utf-8') as f:
+        return [entry['source'] for entry in map(json.loads, f) if 'source' in entry]
+
+def test_journal_ignores_a_truncated_last_line(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    BatchJournal(str(path)).record([{'source': 'a.png', 'estado_final': 'Aprobado'}])
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"source": "b.p') # Interrumpido a mitad de línea
+    assert BatchJournal(str(path)).done == {'a.png'}
+
+def test_interrupted_run_resumes_where_it_stopped(tmp_path):
+    make_images(tmp_path / 'src', 3)
+    journal_path = str(tmp_path / 'journal.jsonl')
+    inferred = []
+
+    def infer(frames, outputs):
+        inferred.extend(int(frame[0, 0, 0]) for frame in frames)
+        return [(frame, {'final_contours': frame}, [{'status': 'Pastilla'}]) for frame in frames]
+
+    first = make_runner(tmp_path, BatchJournal(journal_path), infer)
+    first.progress = lambda stats: first.cancel() # Cancelar después del primer lote
+    stats = first.run(DirectorySource(str(tmp_path / 'src')))
+    assert stats['status'] == 'cancelado'
+    assert inferred == [0]
+
+    second = make_runner(tmp_path, BatchJournal(journal_path), infer)
+    stats = second.run(DirectorySource(str(tmp_path / 'src')))
+    assert stats['status'] == 'terminado'
+    assert inferred == [0, 1, 2] # Ninguna imagen se procesó dos veces
+    assert stats['skipped'] == 1 and stats['processed'] == 2 and stats['failed'] == 1
+
+    assert sorted(journal_sources(journal_path)) == ['img_0.png', 'img_1.png', 'img_2.png', 'rota.jpg']
+
+def test_output_names_do_not_collide(tmp_path):
+    runner = make_runner(tmp_path, None, lambda frames, outputs: [])
+    names = ['a.jpg', 'a.png', 'x/a.jpg', 'x__a.jpg']
+    stems = {runner._output_stem(name) for name in names}
+    assert len(stems) == len(names)
+
+def test_resume_does_not_duplicate_reports_saved_after_the_last_checkpoint(tmp_path):
+    make_images(tmp_path / 'src', 3)
+    journal_path = tmp_path / 'journal.jsonl'
+    db = DatabaseConnection(SQLiteBackend(str(tmp_path / 'db.sqlite')))
+    assert db.initialize()
+
+    def run(journal, checkpoint_every):
+        persistence = WriteBehindQueue(db, str(tmp_path / 'pending.jsonl'))
+        persistence.start()
+        try:
+            return make_runner(tmp_path, journal, infer_pills, persistence=persistence,
+                               checkpoint_every=checkpoint_every).run(DirectorySource(str(tmp_path / 'src')))
+        finally:
+            persistence.close()
+
+    run(BatchJournal(str(journal_path)), checkpoint_every=1)
+    assert len(db.inspections_after(0)) == 3
+
+    # Caída antes del último punto de control: los reportes ya están en la base pero el diario solo tiene el primero
+    lines = journal_path.read_text(encoding='utf-8').splitlines()
+    journal_path.write_text('\n'.join(lines[:2]) + '\n', encoding='utf-8')
+
+    stats = run(BatchJournal(str(journal_path)), checkpoint_every=100)
+    assert stats['skipped'] == 1 and stats['processed'] == 2
+    assert len(db.inspections_after(0)) == 3 # Los reportes re-inspeccionados no se duplican
+
+    # Un lote nuevo (otro diario) sí guarda reportes nuevos de las mismas imágenes
+    run(BatchJournal(str(tmp_path / 'otro.jsonl')), checkpoint_every=1)
+    assert len(db.inspections_after(0)) == 6
+    db.close()
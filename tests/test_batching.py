@@ -0,0 +1,56 @@
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+import pytest
+
+from src.core.batching import FairScheduler, InferenceQueueFull, MicroBatcher
+
+@pytest.fixture
+def scheduler(gated_agent):
+    batcher = MicroBatcher(gated_agent)
+    batcher.start()
+    yield FairScheduler(batcher, max_in_flight=1), gated_agent
+    gated_agent.gate.set()
+    batcher.stop()
+
+def frame(value):
+    return np.array([value], dtype=np.uint8)
+
+def test_newer_frame_supersedes_waiting_one(scheduler):
+    sched, agent = scheduler
+    first = sched.submit('a', frame(1)) # Entra al servidor
+    old = sched.submit('b', frame(2)) # Espera turno
+    new = sched.submit('b', frame(3)) # Reemplaza al anterior
+    with pytest.raises(InferenceQueueFull):
+        old.result(timeout=1)
+
+    agent.gate.set()
+    assert first.result(timeout=5)[0, 0] == 1
+    assert new.result(timeout=5)[0, 0] == 3
+    assert agent.seen == [1, 3]
+    assert sched.stats()['superseded'] == {'b': 1}
+
+def test_cancelled_waiting_frame_is_skipped(scheduler):
+    sched, agent = scheduler
+    first = sched.submit('a', frame(1))
+    waiting = sched.submit('b', frame(2))
+    assert waiting.cancel()
+    # Reemplazar un Future ya cancelado no debe fallar
+    replacement = sched.submit('b', frame(4))
+
+    agent.gate.set()
+    assert first.result(timeout=5)[0, 0] == 1
+    assert replacement.result(timeout=5)[0, 0] == 4
+    assert agent.seen == [1, 4]
+    assert sched.stats()['in_flight'] == 0
+
+def test_detect_timeout_gives_up_the_turn(scheduler):
+    sched, agent = scheduler
+    first = sched.submit('a', frame(1))
+    with pytest.raises(FutureTimeoutError):
+        sched.detect('b', frame(2), timeout=0.05)
+
+    agent.gate.set()
+    assert first.result(timeout=5)[0, 0] == 1
+    assert sched.detect('b', frame(5), timeout=5)[0, 0] == 5
+    assert agent.seen == [1, 5]
@@ -0,0 +1,62 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from src.core.database import DatabaseConnection, to_local_naive
+from src.core.models import InspectionReportDTO
+from src.core.storage_backends import SQLiteBackend
+
+def test_aware_datetimes_become_naive_local_time():
+    aware = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+    naive = to_local_naive(aware)
+    assert naive.tzinfo is None
+    assert naive == aware.astimezone().replace(tzinfo=None)
+    assert to_local_naive(datetime(2025, 1, 1, 12, 0)) == datetime(2025, 1, 1, 12, 0)
+    assert to_local_naive(None) is None
+    # El caso de /api/inspections/hourly: 'end' por defecto es datetime.now() (sin zona)
+    assert datetime.now() - to_local_naive(datetime.now(timezone.utc) - timedelta(hours=1)) > timedelta(minutes=59)
+
+def test_history_queries_accept_aware_bounds(tmp_path):
+    db = DatabaseConnection(SQLiteBackend(str(tmp_path / 'db.sqlite')))
+    assert db.initialize()
+    now = datetime.now()
+    assert db.save_inspections([InspectionReportDTO(now, 10, 0, 'Aprobado', None),
+                                InspectionReportDTO(now, 9, 1, 'Defectuoso', None)])
+
+    start = (now - timedelta(hours=1)).astimezone(timezone.utc)
+    end = (now + timedelta(hours=1)).astimezone(timezone.utc)
+    rows, has_more = db.query_inspections(start=start, end=end)
+    assert len(rows) == 2 and not has_more
+    hours = db.hourly_defect_rates(start, end)
+    assert sum(row['inspecciones'] for row in hours) == 2
+    assert sum(row['defectuosas'] for row in hours) == 1
+    db.close()
+
+class DroppingBackend(SQLiteBackend):
+    """SQLite que trata sqlite3.OperationalError como una conexión perdida (como PostgreSQL)"""
+
+    def __init__(self, path):
+        super().__init__(path, pool_size=1, pool_timeout=0.5)
+        self.released = [] # (conexión, broken)
+
+    def is_disconnect(self, error):
+        return isinstance(error, sqlite3.OperationalError)
+
+    def _release(self, conn, broken=False):
+        self.released.append((conn, broken))
+        if broken:
+            conn.close()
+        else:
+            super()._release(conn, broken)
+
+def test_connections_lost_by_an_error_are_not_reused(tmp_path):
+    backend = DroppingBackend(str(tmp_path / 'db.sqlite'))
+    db = DatabaseConnection(backend)
+    assert db.query_inspections() is None # Sin tabla: OperationalError
+    lost, broken = backend.released[-1]
+    assert broken
+
+    assert db.initialize() # El pool (de una conexión) sigue teniendo su lugar libre
+    conn, broken = backend.released[-1]
+    assert conn is not lost and not broken
+    assert db.query_inspections() == ([], False)
+    db.close()
@@ -0,0 +1,23 @@
+import os
+
+import numpy as np
+
+from src.core.image_writer import ResultImageWriter
+
+def test_copy_survives_deleting_the_original(tmp_path):
+    writer = ResultImageWriter(max_workers=2)
+    original, copy = tmp_path / 'a' / 'final.jpg', tmp_path / 'b' / 'final.jpg'
+    writer.submit(str(original), np.zeros((8, 8, 3), dtype=np.uint8))
+    # La copia espera a la escritura pendiente del original
+    assert writer.submit_copy(str(original), str(copy)).result(timeout=5)
+    writer.shutdown()
+
+    data = original.read_bytes()
+    os.remove(original) # Lo que hace la retención con la imagen de un reporte viejo
+    assert copy.read_bytes() == data
+
+def test_copy_of_a_missing_image_fails(tmp_path):
+    writer = ResultImageWriter()
+    assert not writer.submit_copy(str(tmp_path / 'no_existe.jpg'), str(tmp_path / 'copia.jpg')).result(timeout=5)
+    assert not (tmp_path / 'copia.jpg').exists()
+    writer.shutdown()
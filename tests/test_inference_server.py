@@ -0,0 +1,69 @@
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from src.core.batching import DETECTIONS_ONLY, InferenceQueueFull
+from src.core.inference_server import InferenceServer, RemoteBackend
+
+@pytest.fixture
+def server(tmp_path, request, gated_agent):
+    max_queue_size = getattr(request, 'param', 1)
+    server = InferenceServer(gated_agent, str(tmp_path / 'inf.sock'), b'clave', max_queue_size=max_queue_size)
+    yield server, gated_agent
+    gated_agent.gate.set()
+    server.close()
+
+def test_busy_reply_leaves_no_frame_reading_shared_memory(server):
+    server, agent = server
+    server.batcher.start()
+    blocker = server.batcher.submit(np.full((2, 2), 9, dtype=np.uint8), DETECTIONS_ONLY) # Ocupa el hilo de inferencia
+    assert agent.entered.wait(5)
+
+    shm = shared_memory.SharedMemory(create=True, size=12)
+    try:
+        shm.buf[:12] = bytes([1] * 12)
+        layout = [((2, 2), '|u1', offset) for offset in (0, 4, 8)]
+        assert server._predict(shm, layout)[0] == 'busy'
+
+        shm.buf[:12] = bytes(12) # El worker reescribe el bloque con la siguiente petición
+        agent.gate.set()
+        blocker.result(timeout=5)
+        server.batcher.stop()
+        assert agent.seen == [9] # Los frames de la petición rechazada no llegaron a la inferencia
+    finally:
+        shm.close()
+        shm.unlink()
+
+@pytest.mark.parametrize('server', [0], indirect=True)
+def test_remote_backend_round_trip(server):
+    server, agent = server
+    agent.gate.set()
+    server.listen()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    backend = RemoteBackend(server.address, server.authkey, timeout=5)
+    try:
+        assert backend.names == agent.class_names
+        assert backend.digest == 'abc123'
+        frames = [np.full((4, 4, 3), value, dtype=np.uint8) for value in (3, 5)]
+        detections = backend.predict(frames, conf=0.5)
+        assert [d[0, 0] for d in detections] == [3, 5]
+    finally:
+        backend.close()
+
+def test_busy_reply_raises_queue_full_in_the_worker(server):
+    server, agent = server
+    server.listen()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.batcher.submit(np.zeros((2, 2), dtype=np.uint8), DETECTIONS_ONLY)
+    assert agent.entered.wait(5)
+
+    backend = RemoteBackend(server.address, server.authkey, timeout=5)
+    try:
+        with pytest.raises(InferenceQueueFull):
+            backend.predict([np.zeros((2, 2), dtype=np.uint8)] * 3, conf=0.5)
+    finally:
+        agent.gate.set()
+        backend.close()
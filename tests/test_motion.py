@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from src.core.batching import InferenceQueueFull
+from src.core.motion import AdaptiveRateController, GatedAnnotator
+
+def frame(value=0):
+    return np.full((4, 4, 3), value, dtype=np.uint8)
+
+class SlowDetector:
+    """submit falso: el test decide cuándo termina cada inferencia"""
+
+    def __init__(self):
+        self.futures = []
+
+    def __call__(self, frame):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+def render(frame, detections):
+    return len(detections)
+
+def test_frames_keep_flowing_while_inference_runs():
+    detector = SlowDetector()
+    # A 1 FPS, el frame que sigue a la respuesta todavía no dispara otra inferencia
+    annotator = GatedAnnotator(detector, render, controller=AdaptiveRateController(max_fps=1))
+
+    start = time.monotonic()
+    published = [annotator(frame()) for _ in range(20)]
+    assert time.monotonic() - start < 1.0 # Ningún frame esperó a la IA
+    assert published == [0] * 20 # Sin detecciones todavía: frames sin cajas
+    assert len(detector.futures) == 1 # Una sola inferencia en curso
+
+    detector.futures[0].set_result(np.zeros((3, 6), dtype=np.float32))
+    assert annotator(frame()) == 3 # Las nuevas cajas se dibujan en el siguiente frame
+    stats = annotator.stats()
+    assert stats['frames_inferred'] == 1
+    assert stats['frames_reused'] == 20
+
+def test_unanswered_inference_is_cancelled_as_congestion():
+    detector = SlowDetector()
+    controller = AdaptiveRateController(max_fps=1000)
+    annotator = GatedAnnotator(detector, render, controller=controller, timeout=0.01)
+
+    annotator(frame())
+    time.sleep(0.02)
+    annotator(frame())
+    assert detector.futures[0].cancelled()
+    assert controller.fps < 1000
+
+def test_full_queue_keeps_last_detections():
+    controller = AdaptiveRateController(max_fps=1000)
+    calls = []
+
+    def submit(frame):
+        calls.append(frame)
+        if len(calls) > 1:
+            raise InferenceQueueFull("llena")
+        future = Future()
+        future.set_result(np.zeros((2, 6), dtype=np.float32))
+        return future
+
+    annotator = GatedAnnotator(submit, render, controller=controller)
+    annotator(frame())
+    time.sleep(0.01)
+    assert annotator(frame()) == 2
+    assert controller.fps < 1000
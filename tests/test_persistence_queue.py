@@ -0,0 +1,92 @@
+import json
+import time
+from datetime import datetime
+
+from src.core.models import InspectionReportDTO
+from src.core.persistence_queue import WriteBehindQueue
+
+class FakeDatabase:
+    """save_inspections que falla mientras 'up' es False (o lanza si 'error' está definido)"""
+
+    def __init__(self, up=True, error=None):
+        self.up = up
+        self.error = error
+        self.saved = []
+
+    def save_inspections(self, inspections):
+        if self.error is not None:
+            raise self.error
+        if not self.up:
+            return False
+        self.saved.extend(inspections)
+        return True
+
+def report(n):
+    return InspectionReportDTO(timestamp=datetime(2024, 1, 1, 12, 0, n), total_pastillas=n, total_vacios=0,
+                               estado_final='Aprobado', imagen_resultado=f'results/{n}.jpg')
+
+def test_spill_when_database_is_down_then_replay(tmp_path):
+    spill = tmp_path / 'pending.jsonl'
+    db = FakeDatabase(up=False)
+    queue = WriteBehindQueue(db, str(spill))
+    for n in range(3):
+        queue.enqueue(report(n))
+    queue.flush()
+
+    assert db.saved == []
+    assert len(spill.read_text(encoding='utf-8').splitlines()) == 3
+    assert queue.stats()['spilled'] == 3
+
+    db.up = True
+    queue.start() # Reenvía lo pendiente en disco al arrancar
+    queue.close()
+    assert [r.total_pastillas for r in db.saved] == [0, 1, 2]
+    assert not spill.exists()
+    assert queue.stats()['replayed'] == 3
+
+def test_invalid_spill_lines_are_quarantined(tmp_path):
+    spill = tmp_path / 'pending.jsonl'
+    spill.write_text(json.dumps(report(1).to_dict()) + '\n{"roto": \n' + json.dumps({'x': 1}) + '\n', encoding='utf-8')
+    db = FakeDatabase()
+    queue = WriteBehindQueue(db, str(spill))
+    queue.start()
+    queue.close()
+
+    assert [r.total_pastillas for r in db.saved] == [1]
+    assert not spill.exists()
+    assert len((tmp_path / 'pending.jsonl.invalid').read_text(encoding='utf-8').splitlines()) == 2
+    assert queue.stats()['invalid_lines'] == 2
+
+def test_writer_survives_a_database_exception(tmp_path):
+    spill = tmp_path / 'pending.jsonl'
+    db = FakeDatabase(error=RuntimeError("conexión perdida"))
+    queue = WriteBehindQueue(db, str(spill), batch_size=1, flush_interval=0.01)
+    queue.start()
+    try:
+        queue.enqueue(report(1))
+        deadline = time.monotonic() + 5
+        while queue.stats()['spilled'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = queue.stats()
+        assert stats['spilled'] == 1
+        assert stats['errors'] >= 1
+        assert stats['writer_alive']
+    finally:
+        queue.close()
+    assert spill.exists()
+
+def test_reports_enqueued_after_close_are_spilled_and_replayed(tmp_path):
+    spill = tmp_path / 'pending.jsonl'
+    db = FakeDatabase()
+    queue = WriteBehindQueue(db, str(spill))
+    queue.start()
+    queue.close()
+
+    queue.enqueue(report(7)) # p. ej. una petición que termina durante el apagado
+    assert queue.stats()['pending'] == 0
+    assert len(spill.read_text(encoding='utf-8').splitlines()) == 1
+
+    queue.start()
+    queue.close()
+    assert [r.total_pastillas for r in db.saved] == [7]
+    assert not spill.exists()
@@ -0,0 +1,46 @@
+import numpy as np
+
+from src.core.result_cache import ResultCache
+
+def detections(value):
+    return np.full((1, 6), value, dtype=np.float32)
+
+def test_content_key_depends_only_on_bytes():
+    assert ResultCache.content_key(b'imagen') == ResultCache.content_key(b'imagen')
+    assert ResultCache.content_key(b'imagen') != ResultCache.content_key(b'imagen2')
+
+def test_fingerprint_is_part_of_the_key():
+    cache = ResultCache(max_entries=4)
+    cache.put('modelo-a', 'k', detections(1), [], {})
+    assert cache.get('modelo-a', 'k').detections[0, 0] == 1
+    assert cache.get('modelo-b', 'k') is None
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put('f', 'a', detections(1), [], {})
+    cache.put('f', 'b', detections(2), [], {})
+    assert cache.get('f', 'a') is not None # 'a' pasa a ser la más reciente
+    cache.put('f', 'c', detections(3), [], {})
+
+    assert cache.get('f', 'b') is None
+    assert cache.get('f', 'a') is not None
+    assert cache.get('f', 'c') is not None
+    assert cache.stats()['entries'] == 2
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    ResultCache(max_entries=2, disk_dir=str(tmp_path)).put('f', 'a', detections(7), [{'status': 'Pastilla'}],
+                                                             {'final': 'results/a.jpg'})
+    cache = ResultCache(max_entries=2, disk_dir=str(tmp_path))
+    entry = cache.get('f', 'a')
+    assert entry.detections.shape == (1, 6)
+    assert entry.images == {'final': 'results/a.jpg'}
+    assert cache.stats()['disk_hits'] == 1
+
+    cache.clear_stale('otra')
+    assert cache.get('g', 'a') is None
+    assert not (tmp_path / 'f').exists()
+
+def test_disabled_cache_stores_nothing():
+    cache = ResultCache(max_entries=0)
+    cache.put('f', 'a', detections(1), [], {})
+    assert cache.get('f', 'a') is None
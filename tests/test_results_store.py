@@ -0,0 +1,42 @@
+import os
+import time
+
+from src.core.results_store import RetentionSweeper
+
+OLD = time.time() - 10 * 86400
+
+def write(path, mtime=OLD):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * 10)
+    os.utime(path, (mtime, mtime))
+
+def make_tree(tmp_path):
+    results = tmp_path / 'static' / 'results'
+    write(results / '2020' / '01' / '01' / 'final_1.jpg')
+    write(results / 'batch_abc123' / 'img_final_contours.jpg')
+    write(results / 'lote_manual' / 'img_final_contours.jpg')
+    write(results / 'muestra.jpg')
+    return results
+
+def test_age_limit_sweeps_day_and_batch_folders(tmp_path):
+    results = make_tree(tmp_path)
+    evicted = []
+    sweeper = RetentionSweeper(str(results), str(tmp_path / 'static'), max_age_days=1, on_evicted=evicted.extend)
+    assert sweeper.sweep_once()['evicted'] == 2
+
+    assert sorted(evicted) == ['results/2020/01/01/final_1.jpg', 'results/batch_abc123/img_final_contours.jpg']
+    assert not (results / '2020').exists() # Carpetas de días vacías borradas
+    assert (results / 'batch_abc123').is_dir() # La del lote se deja (puede reanudarse)
+    assert (results / 'lote_manual' / 'img_final_contours.jpg').exists()
+    assert (results / 'muestra.jpg').exists()
+
+def test_size_budget_counts_batch_folders(tmp_path):
+    results = make_tree(tmp_path)
+    write(results / 'batch_abc123' / 'nueva.jpg', mtime=time.time())
+    evicted = []
+    sweeper = RetentionSweeper(str(results), str(tmp_path / 'static'), max_age_days=0, max_bytes=10,
+                               on_evicted=evicted.extend)
+    stats = sweeper.sweep_once()
+
+    assert stats['bytes'] == 10 # Solo queda la más nueva; lote_manual y muestra.jpg no cuentan
+    assert evicted and 'results/batch_abc123/nueva.jpg' not in evicted
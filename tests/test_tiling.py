@@ -0,0 +1,21 @@
+import numpy as np
+
+from src.core.tiling import TilePlanner
+
+def test_roi_outside_the_frame_falls_back_to_the_full_frame(capsys):
+    planner = TilePlanner(roi='2000,100,300,300')
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    [(region, x, y)] = planner.regions(frame)
+    assert region.shape == frame.shape and (x, y) == (0, 0)
+    planner.regions(frame)
+    assert capsys.readouterr().out.count('fuera del frame') == 1 # Se avisa una vez por tamaño de frame
+
+def test_roi_partly_outside_the_frame_keeps_the_part_inside():
+    planner = TilePlanner(roi='600,400,300,300')
+    [(region, x, y)] = planner.regions(np.zeros((480, 640, 3), dtype=np.uint8))
+    assert region.shape[:2] == (80, 40) and (x, y) == (600, 400)
+
+def test_roi_inside_the_frame_is_used_as_is():
+    planner = TilePlanner(roi='10,20,100,50')
+    [(region, x, y)] = planner.regions(np.zeros((480, 640, 3), dtype=np.uint8))
+    assert region.shape[:2] == (50, 100) and (x, y) == (10, 20)